@@ -1,7 +1,11 @@
+import io
 import os
 import numpy as np
-import pandas as pd
 import warnings
+from datetime import datetime, timedelta
+
+from RadianceMethod.helper_functions.stage_metrics import StageMetrics, measure_stage
+from RadianceMethod.processing.result_writers import _read_csv_result_file, load_npy_result_data
 
 
 class DataAnalysis:
@@ -24,6 +28,28 @@ class DataAnalysis:
     experiment_name (str or None): The name of the experiment.
     channels_to_analyse (list): A list of integers representing the channels to be analyzed.
     baseline_image_bounds (list): A list of integers giving the first and last image of range to normalize intensities.
+    result_file_format (str): The format of the extracted ROI values to load, 'csv' or the binary 'npy' store.
+    roi_values (numpy.ndarray or None): The ROI values of shape (image, channel, face, ROI) when loaded from the binary
+    'npy' store.
+    intensities_dict (dict or None): A dictionary containing the calculated intensities of every channel.
+    extinction_coefficients_dict (dict or None): A dictionary containing the calculated extinction coefficients of
+    every channel.
+    write_intensities (bool): Whether calc_intensities writes the intensities to CSV files right away.
+    write_extinction_coefficients (bool): Whether calc_extinction_coefficients writes its results to CSV files right
+    away.
+    analysis_engine (str): The engine used for the calculations, 'pandas' analysing channel by channel on DataFrames
+    or 'numpy' analysing all channels at once on arrays of shape (channel, image, ROI).
+    dark_roi_values (numpy.ndarray or None): The dark ROI values of shape (channel, image, ROI) of the 'numpy' engine.
+    light_roi_values (numpy.ndarray or None): The light ROI values of shape (channel, image, ROI) of the 'numpy'
+    engine.
+    intensities (numpy.ndarray or None): The intensities of shape (channel, image, ROI) of the 'numpy' engine.
+    extinction_coefficients (numpy.ndarray or None): The extinction coefficients of shape (channel, image, ROI) of
+    the 'numpy' engine.
+    chunk_size (int): The number of images analysed at once by calc_results_in_chunks.
+    stage_metrics (StageMetrics or None): The recorder of the time, bytes read and peak memory of the load,
+    intensities, extinction coefficients and write stages, None if disabled.
+    stage_metrics_file_path (str or None): The path of the JSON file the stage summary is written to after the
+    extinction coefficients are calculated.
 
     Methods:
         set_experiment_name(experiment_name):
@@ -38,6 +64,21 @@ class DataAnalysis:
         set_baseline_image_bounds(baseline_image_bounds):
             Set the list of first and last image that are use for normalization.
 
+        set_result_file_format(result_file_format):
+            Set the format of the extracted ROI values to load, 'csv' or the binary 'npy' store.
+
+        set_output_options(write_intensities=True, write_extinction_coefficients=True):
+            Set whether intensities and extinction coefficients are written to CSV files as soon as they are calculated.
+
+        set_analysis_engine(analysis_engine):
+            Set the engine used for the calculations, 'pandas' or 'numpy'.
+
+        set_chunk_size(chunk_size):
+            Set the number of images analysed at once by calc_results_in_chunks.
+
+        set_stage_metrics(enabled=True, callback=None, trace_memory=False, summary_file_path=None):
+            Enable or disable the per-stage timing of the analysis, see StageMetrics.
+
         load_result_data():
             Load experimental results and ROI coordinates from files.
 
@@ -45,7 +86,24 @@ class DataAnalysis:
             Calculate the intensities based on the experimental results and save them to CSV files.
 
         calc_extinction_coefficients():
-            Calculate the extinction coefficients from the intensities and distances, and save them to CSV files.
+            Calculate the extinction coefficients from the intensities and distances, and save them to CSV files. The
+            intensities are used at full float64 precision, see the method for the difference to earlier versions.
+
+        calc_results_in_chunks():
+            Calculate intensities and extinction coefficients chunk by chunk without loading all results at once.
+
+        write_results():
+            Write the calculated intensities and extinction coefficients that have not been written yet to CSV files.
+
+        load_roi_geometry():
+            Load the ROI coordinates and camera to ROI distances from files.
+
+        add_roi_values(image_id, roi_values):
+            Add the ROI values of one image for incremental (live) analysis and return the intensities and extinction
+            coefficients of all images that became available.
+
+        resume_incremental_analysis():
+            Add the ROI values already written by an earlier run of the live monitoring for incremental analysis.
     """
 
     def __init__(self):
@@ -60,6 +118,23 @@ class DataAnalysis:
         self.experiment_name = None
         self.channels_to_analyse = [0, 1, 2]
         self.baseline_image_bounds = [0, 1]
+        self.result_file_format = 'csv'
+        self.roi_values = None
+        self.intensities_dict = None
+        self.extinction_coefficients_dict = None
+        self.write_intensities = True
+        self.write_extinction_coefficients = True
+        self.analysis_engine = 'pandas'
+        self.dark_roi_values = None
+        self.light_roi_values = None
+        self.intensities = None
+        self.extinction_coefficients = None
+        self.chunk_size = 10000
+        self.stage_metrics = None
+        self.stage_metrics_file_path = None
+        self._unwritten_results = {}
+        self._incremental_roi_values = []
+        self._incremental_n_0 = None
 
     def set_experiment_name(self, experiment_name):
         self.experiment_name = experiment_name
@@ -73,17 +148,70 @@ class DataAnalysis:
     def set_channels_to_analyse(self, channels_to_analyse):
         self.channels_to_analyse = channels_to_analyse
 
+    def set_output_options(self, write_intensities=True, write_extinction_coefficients=True):
+        self.write_intensities = write_intensities
+        self.write_extinction_coefficients = write_extinction_coefficients
+
+    def set_result_file_format(self, result_file_format):
+        if result_file_format not in ['csv', 'npy']:
+            raise ValueError(f"Unknown result file format '{result_file_format}'")
+        self.result_file_format = result_file_format
+
+    def set_analysis_engine(self, analysis_engine):
+        if analysis_engine not in ['pandas', 'numpy']:
+            raise ValueError(f"Unknown analysis engine '{analysis_engine}'")
+        self.analysis_engine = analysis_engine
+
+    def set_chunk_size(self, chunk_size):
+        if chunk_size < 1:
+            raise ValueError("The chunk size must be at least 1")
+        self.chunk_size = chunk_size
+
+    def set_stage_metrics(self, enabled=True, callback=None, trace_memory=False, summary_file_path=None):
+        if enabled:
+            self.stage_metrics = StageMetrics(callback, trace_memory)
+        else:
+            self.stage_metrics = None
+        self.stage_metrics_file_path = summary_file_path
+
+    def _write_stage_metrics_summary(self):
+        if self.stage_metrics is not None and self.stage_metrics_file_path is not None:
+            self.stage_metrics.write_summary(self.stage_metrics_file_path)
+
     def load_result_data(self):
+        import pandas as pd
         print("Loading extracted image data...")
         self.results_dict = {}
 
+        with measure_stage(self.stage_metrics, 'load') as record:
+            if self.result_file_format == 'npy':
+                record['bytes_read'] = self._load_npy_result_data()
+            else:
+                for cb_face in ["dark", "light"]:
+                    for channel in self.channels_to_analyse:
+                        file_path = os.path.join(self.results_dir,
+                                                 f'{self.experiment_name}_{cb_face}_values_channel_{channel}.csv')
+                        self.results_dict[f"{cb_face}_roi_channel_{channel}"] = pd.read_csv(
+                            file_path, header=[0, 1, 2], index_col=[0, 1, 2])
+                        record['bytes_read'] += os.path.getsize(file_path)
+                if self.analysis_engine == 'numpy':
+                    self._stack_roi_values()
+
+        self.load_roi_geometry()
+
+    def _stack_roi_values(self):
+        import pandas as pd
+        # Collect the frames of all channels in one (channel, image, ROI) array per face, the frames become views on it
         for cb_face in ["dark", "light"]:
-            for channel in self.channels_to_analyse:
-                file_path = os.path.join(self.results_dir,
-                                         f'{self.experiment_name}_{cb_face}_values_channel_{channel}.csv')
-                self.results_dict[f"{cb_face}_roi_channel_{channel}"] = pd.read_csv(file_path, header=[0, 1, 2],
-                                                                                    index_col=[0, 1, 2])
+            frames = [self.results_dict[f"{cb_face}_roi_channel_{channel}"] for channel in self.channels_to_analyse]
+            roi_values = np.empty((len(frames),) + frames[0].shape)
+            for i, (channel, frame) in enumerate(zip(self.channels_to_analyse, frames)):
+                roi_values[i] = frame.to_numpy()
+                self.results_dict[f"{cb_face}_roi_channel_{channel}"] = pd.DataFrame(
+                    roi_values[i], index=frame.index, columns=frame.columns, copy=False)
+            setattr(self, f"{cb_face}_roi_values", roi_values)
 
+    def load_roi_geometry(self):
         self.dark_roi_real_coordinates = np.loadtxt(os.path.join(self.results_dir, 'roi_dark_coordinates.csv'),
                                                     delimiter=',')
         self.light_roi_real_coordinates = np.loadtxt(os.path.join(self.results_dir, 'roi_light_coordinates.csv'),
@@ -95,48 +223,350 @@ class DataAnalysis:
         self.camera_to_roi_centre_real_distances = (self.camera_to_dark_roi_real_distances +
                                                     self.camera_to_light_roi_real_distances) / 2
 
+    def _load_npy_result_data(self):
+        import pandas as pd
+        values_file_path = os.path.join(self.results_dir, f'{self.experiment_name}_roi_values.npy')
+        metadata_file_path = os.path.join(self.results_dir, f'{self.experiment_name}_roi_metadata.npz')
+        self.roi_values, metadata = load_npy_result_data(values_file_path, metadata_file_path)
 
+        index, face_columns = self._get_npy_result_labels(metadata)
+        for face, (cb_face, columns) in enumerate(zip(["dark", "light"], face_columns)):
+            if self.analysis_engine == 'numpy':
+                face_roi_values = np.array(self.roi_values[:, self.channels_to_analyse, face, :].transpose(1, 0, 2),
+                                           dtype=np.float64)
+                setattr(self, f"{cb_face}_roi_values", face_roi_values)
+            for i, channel in enumerate(self.channels_to_analyse):
+                if self.analysis_engine == 'numpy':
+                    self.results_dict[f"{cb_face}_roi_channel_{channel}"] = pd.DataFrame(
+                        face_roi_values[i], index=index, columns=columns, copy=False)
+                else:
+                    roi_values = np.asarray(self.roi_values[:, channel, face, :], dtype=np.float64)
+                    self.results_dict[f"{cb_face}_roi_channel_{channel}"] = pd.DataFrame(roi_values, index=index,
+                                                                                         columns=columns)
+        # The size of the read data, the ROI values are memory-mapped and read on access
+        return os.path.getsize(values_file_path) + os.path.getsize(metadata_file_path)
+
+    @staticmethod
+    def _get_npy_result_labels(metadata):
+        import pandas as pd
+        # Rebuild the same row and column labels as parsed from the CSV headers
+        index = pd.MultiIndex.from_arrays([metadata['image_ids'],
+                                           [str(t) for t in metadata['capture_times'].astype(datetime)],
+                                           [str(t) for t in metadata['time_deltas'].astype(timedelta)]],
+                                          names=["Image ID", "Time", "Timedelta"])
+        face_columns = []
+        for face in range(2):
+            number_of_rois = len(metadata['roi_heights'][face])
+            face_columns.append(pd.MultiIndex.from_arrays(
+                [[str(float(h)) for h in metadata['roi_heights'][face]],
+                 [str(float(d)) for d in metadata['roi_camera_real_distances'][face]],
+                 [f"ROI {i}" for i in range(number_of_rois)]],
+                names=["ROI height [m]", "Camera to ROI real distances [m]", None]))
+        return index, face_columns
 
     def calc_intensities(self):
         print("Calculating intensities...")
+        self.intensities_dict = {}
+        if self.analysis_engine == 'numpy':
+            self._calc_intensities_numpy()
+            return
         for channel in self.channels_to_analyse:
             dark_results_df = self.results_dict[f"dark_roi_channel_{channel}"]
             light_results_df = self.results_dict[f"light_roi_channel_{channel}"]
 
-            n_s = dark_results_df - light_results_df
-            dar_results_mean = dark_results_df.iloc[self.baseline_image_bounds[0]:self.baseline_image_bounds[1],:].mean()
-            light_results_mean = light_results_df.iloc[self.baseline_image_bounds[0]:self.baseline_image_bounds[1],:].mean()
+            with measure_stage(self.stage_metrics, 'intensities'):
+                n_s = dark_results_df - light_results_df
+                dar_results_mean = dark_results_df.iloc[self.baseline_image_bounds[0]:self.baseline_image_bounds[1],:].mean()
+                light_results_mean = light_results_df.iloc[self.baseline_image_bounds[0]:self.baseline_image_bounds[1],:].mean()
 
-            n_0 = dar_results_mean - light_results_mean
+                n_0 = dar_results_mean - light_results_mean
 
-            inteisities = n_s / n_0
-            intensities_df = dark_results_df.copy()
-            intensities_df.iloc[:, :] = inteisities
+                inteisities = n_s / n_0
+                intensities_df = dark_results_df.copy()
+                intensities_df.iloc[:, :] = inteisities
+            self.intensities_dict[f"channel_{channel}"] = intensities_df
             file_path = os.path.join(self.results_dir, f"intensities_channel_{channel}.csv")
-            intensities_df.to_csv(file_path)
+            self._write_result(file_path, intensities_df, self.write_intensities)
+
+    def _calc_intensities_numpy(self):
+        import pandas as pd
+        with measure_stage(self.stage_metrics, 'intensities'):
+            n_s = self.dark_roi_values - self.light_roi_values
+            n_0 = self._calc_baseline_means(self.dark_roi_values) - self._calc_baseline_means(self.light_roi_values)
+            n_s /= n_0[:, np.newaxis, :]
+        self.intensities = n_s
+
+        for i, channel in enumerate(self.channels_to_analyse):
+            dark_results_df = self.results_dict[f"dark_roi_channel_{channel}"]
+            intensities_df = pd.DataFrame(self.intensities[i], index=dark_results_df.index,
+                                          columns=dark_results_df.columns, copy=False)
+            self.intensities_dict[f"channel_{channel}"] = intensities_df
+            file_path = os.path.join(self.results_dir, f"intensities_channel_{channel}.csv")
+            self._write_result(file_path, intensities_df, self.write_intensities)
+
+    def _calc_baseline_means(self, roi_values):
+        return self._calc_column_means(
+            roi_values[:, self.baseline_image_bounds[0]:self.baseline_image_bounds[1], :])
+
+    @staticmethod
+    def _calc_column_means(roi_values):
+        # Same summation as the NaN skipping DataFrame.mean, which sums every column contiguously with NaNs set to 0
+        baseline_values = np.swapaxes(roi_values, -1, -2).copy()
+        nan_mask = np.isnan(baseline_values)
+        baseline_values[nan_mask] = 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return baseline_values.sum(axis=-1) / (~nan_mask).sum(axis=-1)
+
+    def _calc_extinction_coefficients_from_intensities(self, intensity, distance):
+        sigma = -1 * np.log(intensity) / distance
+        if np.any(intensity < 0):
+            warnings.warn("Invalid intensity detected! Check the ROI pixel positions on the reference image.")
+            warnings.warn("Calculated extinction coefficient results may not be correct")
+        if np.any(self.camera_to_roi_centre_real_distances < 0):
+            warnings.warn("Invalid distance detected! Check the ROI real positions.")
+            warnings.warn("Calculated extinction coefficient results may not be correct")
+
+        return sigma
 
     def calc_extinction_coefficients(self):
+        """
+        Calculate the extinction coefficients of all channels from the intensities kept in memory by calc_intensities
+        or, without them, from the intensities CSV files read with float_precision='round_trip'.
+
+        Both ways use the exact float64 intensities. Versions reading the intensities back with the default pandas
+        float parser could be off by one unit in the last place, which -log(I) amplifies for intensities close to 1,
+        so the extinction coefficients can differ from those versions at a relative level of about 1e-10.
+        """
+        import pandas as pd
         print("Calculating extinction coefficients...")
 
-        def calc_extinction_coefficients_from_intensities(intensity, distance):
-            sigma = -1 * np.log(intensity) / distance
-            if np.any(intensity < 0):
-                warnings.warn("Invalid intensity detected! Check the ROI pixel positions on the reference image.")
-                warnings.warn("Calculated extinction coefficient results may not be correct")
-            if np.any(self.camera_to_roi_centre_real_distances < 0):
-                warnings.warn("Invalid distance detected! Check the ROI real positions.")
-                warnings.warn("Calculated extinction coefficient results may not be correct")
+        self.extinction_coefficients_dict = {}
+        if self.analysis_engine == 'numpy':
+            self._calc_extinction_coefficients_numpy()
+            self._write_stage_metrics_summary()
+            return
+        for channel in self.channels_to_analyse:
+            if self.intensities_dict is not None and f"channel_{channel}" in self.intensities_dict:
+                intensities_df = self.intensities_dict[f"channel_{channel}"]
+            else:
+                file_path = os.path.join(self.results_dir, f"intensities_channel_{channel}.csv")
+                with measure_stage(self.stage_metrics, 'load') as record:
+                    intensities_df = pd.read_csv(file_path, header=[0, 1, 2], index_col=[0, 1, 2],
+                                                 float_precision='round_trip')
+                    record['bytes_read'] = os.path.getsize(file_path)
+            with measure_stage(self.stage_metrics, 'extinction_coefficients'):
+                intensities = intensities_df.to_numpy()
+                extinction_coefficients = self._calc_extinction_coefficients_from_intensities(
+                    intensities, self.camera_to_roi_centre_real_distances)
 
-            return sigma
+                extinction_coefficients_df = self.results_dict["light_roi_channel_0"].copy()
+                extinction_coefficients_df.iloc[:, :] = extinction_coefficients
+            self.extinction_coefficients_dict[f"channel_{channel}"] = extinction_coefficients_df
+            file_path = os.path.join(self.results_dir, f"extinction_coefficients_channel_{channel}.csv")
+            self._write_result(file_path, extinction_coefficients_df, self.write_extinction_coefficients)
+        self._write_stage_metrics_summary()
 
-        for channel in self.channels_to_analyse:
-            file_path = os.path.join(self.results_dir, f"intensities_channel_{channel}.csv")
-            intensities_df = pd.read_csv(file_path, header=[0, 1, 2], index_col=[0, 1, 2])
-            intensities = intensities_df.to_numpy()
-            extinction_coefficients = calc_extinction_coefficients_from_intensities(intensities,
-                                                                                    self.camera_to_roi_centre_real_distances)
+    def _calc_extinction_coefficients_numpy(self):
+        import pandas as pd
+        if self.intensities is None:
+            intensities = np.empty((len(self.channels_to_analyse),) + self.light_roi_values.shape[1:])
+            for i, channel in enumerate(self.channels_to_analyse):
+                file_path = os.path.join(self.results_dir, f"intensities_channel_{channel}.csv")
+                with measure_stage(self.stage_metrics, 'load') as record:
+                    intensities[i] = pd.read_csv(file_path, header=[0, 1, 2], index_col=[0, 1, 2],
+                                                 float_precision='round_trip').to_numpy()
+                    record['bytes_read'] = os.path.getsize(file_path)
+        else:
+            intensities = self.intensities
+        with measure_stage(self.stage_metrics, 'extinction_coefficients'):
+            self.extinction_coefficients = self._calc_extinction_coefficients_from_intensities(
+                intensities, self.camera_to_roi_centre_real_distances)
 
-            extinction_coefficients_df = self.results_dict["light_roi_channel_0"].copy()
-            extinction_coefficients_df.iloc[:, :] = extinction_coefficients
+        light_results_df = self.results_dict["light_roi_channel_0"]
+        for i, channel in enumerate(self.channels_to_analyse):
+            extinction_coefficients_df = pd.DataFrame(self.extinction_coefficients[i], index=light_results_df.index,
+                                                      columns=light_results_df.columns, copy=False)
+            self.extinction_coefficients_dict[f"channel_{channel}"] = extinction_coefficients_df
             file_path = os.path.join(self.results_dir, f"extinction_coefficients_channel_{channel}.csv")
-            extinction_coefficients_df.to_csv(file_path)
+            self._write_result(file_path, extinction_coefficients_df, self.write_extinction_coefficients)
+
+    def calc_results_in_chunks(self):
+        """
+        Calculate the intensities and extinction coefficients of all channels chunk by chunk and append them to the
+        CSV files, so that the memory use is bounded by the chunk size instead of the length of the experiment.
+
+        The baseline means are calculated in a pre-pass reading only the images up to the baseline image bounds. The
+        written files are identical to the ones of calc_intensities and calc_extinction_coefficients, the results are
+        not kept in memory.
+        """
+        import pandas as pd
+        print("Calculating intensities and extinction coefficients in chunks...")
+        self.load_roi_geometry()
+        for channel in self.channels_to_analyse:
+            with measure_stage(self.stage_metrics, 'load'):
+                dark_baseline_values, light_baseline_values = self._read_baseline_values(channel)
+            n_0 = (self._calc_column_means(dark_baseline_values) -
+                   self._calc_column_means(light_baseline_values))
+
+            intensities_file_path = os.path.join(self.results_dir, f"intensities_channel_{channel}.csv")
+            extinction_coefficients_file_path = os.path.join(self.results_dir,
+                                                             f"extinction_coefficients_channel_{channel}.csv")
+            result_chunks = self._iter_result_chunks(channel)
+            chunk = 0
+            while True:
+                with measure_stage(self.stage_metrics, 'load'):
+                    result_chunk = next(result_chunks, None)
+                if result_chunk is None:
+                    break
+                dark_results_df, light_results_df = result_chunk
+                with measure_stage(self.stage_metrics, 'intensities'):
+                    intensities = dark_results_df.to_numpy() - light_results_df.to_numpy()
+                    intensities /= n_0
+                with measure_stage(self.stage_metrics, 'extinction_coefficients'):
+                    extinction_coefficients = self._calc_extinction_coefficients_from_intensities(
+                        intensities, self.camera_to_roi_centre_real_distances)
+
+                mode, header = ('w', True) if chunk == 0 else ('a', False)
+                with measure_stage(self.stage_metrics, 'write'):
+                    pd.DataFrame(intensities, index=dark_results_df.index, columns=dark_results_df.columns,
+                                 copy=False).to_csv(intensities_file_path, mode=mode, header=header)
+                    pd.DataFrame(extinction_coefficients, index=light_results_df.index,
+                                 columns=light_results_df.columns,
+                                 copy=False).to_csv(extinction_coefficients_file_path, mode=mode, header=header)
+                chunk += 1
+        self._write_stage_metrics_summary()
+
+    def _iter_result_chunks(self, channel):
+        import pandas as pd
+        # Yield the dark and light ROI values of one channel as DataFrames of at most chunk_size images
+        if self.result_file_format == 'npy':
+            values_file_path = os.path.join(self.results_dir, f'{self.experiment_name}_roi_values.npy')
+            metadata_file_path = os.path.join(self.results_dir, f'{self.experiment_name}_roi_metadata.npz')
+            roi_values, metadata = load_npy_result_data(values_file_path, metadata_file_path)
+            index, face_columns = self._get_npy_result_labels(metadata)
+            for start in range(0, len(roi_values), self.chunk_size):
+                stop = start + self.chunk_size
+                yield tuple(pd.DataFrame(np.asarray(roi_values[start:stop, channel, face, :], dtype=np.float64),
+                                         index=index[start:stop], columns=face_columns[face], copy=False)
+                            for face in range(2))
+        else:
+            file_paths = [os.path.join(self.results_dir,
+                                       f'{self.experiment_name}_{cb_face}_values_channel_{channel}.csv')
+                          for cb_face in ["dark", "light"]]
+            with pd.read_csv(file_paths[0], header=[0, 1, 2], index_col=[0, 1, 2],
+                             chunksize=self.chunk_size) as dark_reader, \
+                    pd.read_csv(file_paths[1], header=[0, 1, 2], index_col=[0, 1, 2],
+                                chunksize=self.chunk_size) as light_reader:
+                yield from zip(dark_reader, light_reader)
+
+    def _read_baseline_values(self, channel):
+        baseline_image_bounds = slice(*self.baseline_image_bounds)
+        if (baseline_image_bounds.stop is None or baseline_image_bounds.stop < 0 or
+                (baseline_image_bounds.start is not None and baseline_image_bounds.start < 0)):
+            # Bounds relative to the end of the series need the number of images first
+            number_of_images = sum(len(dark_results_df) for dark_results_df, _ in self._iter_result_chunks(channel))
+        else:
+            number_of_images = baseline_image_bounds.stop
+        start, stop, _ = baseline_image_bounds.indices(number_of_images)
+
+        dark_baseline_values, light_baseline_values = [], []
+        position = 0
+        for dark_results_df, light_results_df in self._iter_result_chunks(channel):
+            chunk_start, chunk_stop = max(start - position, 0), max(stop - position, 0)
+            dark_baseline_values.append(dark_results_df.to_numpy()[chunk_start:chunk_stop])
+            light_baseline_values.append(light_results_df.to_numpy()[chunk_start:chunk_stop])
+            position += len(dark_results_df)
+            if position >= stop:
+                break
+        return np.concatenate(dark_baseline_values), np.concatenate(light_baseline_values)
+
+    def _write_result(self, file_path, result_df, write_now):
+        if write_now:
+            with measure_stage(self.stage_metrics, 'write'):
+                result_df.to_csv(file_path)
+            self._unwritten_results.pop(file_path, None)
+        else:
+            self._unwritten_results[file_path] = result_df
+
+    def write_results(self):
+        for file_path, result_df in self._unwritten_results.items():
+            with measure_stage(self.stage_metrics, 'write'):
+                result_df.to_csv(file_path)
+        self._unwritten_results = {}
+        self._write_stage_metrics_summary()
+
+    def add_roi_values(self, image_id, roi_values):
+        """
+        Add the ROI values of one image for incremental analysis, e.g. from DataExtractor.watch_image_dir.
+
+        Images are numbered in the order they are added. Until the last image given by the baseline image bounds is
+        added no results are available; afterwards the results of all buffered images and then of every added image
+        are returned right away. The ROI geometry has to be loaded with load_roi_geometry first. When continuing the
+        ROI value files of an earlier run, call resume_incremental_analysis before adding new images.
+
+        Parameters:
+            image_id (int): The ID of the image.
+            roi_values (numpy.ndarray): The ROI values of the image of shape (channel, face, ROI), face 0 being the
+            dark and face 1 the light ROIs.
+
+        Returns:
+            list: (image_id, intensities, extinction_coefficients) tuples for all images whose results became
+            available, both arrays holding the channels to analyse.
+        """
+        roi_values = np.asarray(roi_values)[self.channels_to_analyse]
+        if self._incremental_n_0 is None:
+            self._incremental_roi_values.append((image_id, roi_values))
+            if len(self._incremental_roi_values) < self.baseline_image_bounds[1]:
+                return []
+            baseline_roi_values = np.array([values for _, values in self._incremental_roi_values[
+                                            self.baseline_image_bounds[0]:self.baseline_image_bounds[1]]])
+            baseline_roi_means = np.nanmean(baseline_roi_values, axis=0)
+            self._incremental_n_0 = baseline_roi_means[:, 0] - baseline_roi_means[:, 1]
+            buffered_roi_values, self._incremental_roi_values = self._incremental_roi_values, []
+        else:
+            buffered_roi_values = [(image_id, roi_values)]
+
+        results = []
+        for buffered_image_id, values in buffered_roi_values:
+            intensities = (values[:, 0] - values[:, 1]) / self._incremental_n_0
+            with np.errstate(invalid='ignore', divide='ignore'):
+                extinction_coefficients = -1 * np.log(intensities) / self.camera_to_roi_centre_real_distances
+            results.append((buffered_image_id, intensities, extinction_coefficients))
+        return results
+
+    def resume_incremental_analysis(self):
+        """
+        Add the ROI values already written to the CSV value files of the experiment, e.g. by an earlier run of
+        DataExtractor.watch_image_dir that is continued, for incremental analysis.
+
+        The written images are added as by add_roi_values, so the baseline is calculated from the same images as in
+        the earlier run. Their results are not returned, except for images still waiting for the baseline, which are
+        returned by add_roi_values once the baseline is complete. Without value files nothing is added.
+
+        Returns:
+            int: The number of images added.
+        """
+        import pandas as pd
+        results_dfs = []
+        for channel in range(3):
+            for cb_face in ["dark", "light"]:
+                file_path = os.path.join(self.results_dir,
+                                         f'{self.experiment_name}_{cb_face}_values_channel_{channel}.csv')
+                if not os.path.exists(file_path):
+                    return 0
+                # Only complete rows, read exactly as written so that the baseline is the one of the earlier run
+                header, data_lines = _read_csv_result_file(file_path, 4)
+                results_dfs.append(pd.read_csv(io.StringIO(header + ''.join(data_lines)), header=[0, 1, 2],
+                                               index_col=[0, 1, 2], float_precision='round_trip'))
+        # Images missing in some of the files of an interrupted run are written again by watch_image_dir
+        image_ids = [image_id for image_id in dict.fromkeys(results_dfs[0].index.get_level_values(0))
+                     if all(image_id in results_df.index.get_level_values(0) for results_df in results_dfs[1:])]
+        # Shape (channel * face, image, ROI), with the first row of every image
+        roi_values = np.array([results_df.droplevel([1, 2]).groupby(level=0).first().loc[image_ids].to_numpy()
+                               for results_df in results_dfs])
+        roi_values = roi_values.reshape((3, 2) + roi_values.shape[1:])
+        for image, image_id in enumerate(image_ids):
+            self.add_roi_values(int(image_id), roi_values[:, :, image])
+        if image_ids:
+            print(f"Resumed the incremental analysis after {len(image_ids)} images")
+        return len(image_ids)
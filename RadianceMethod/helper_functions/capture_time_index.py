@@ -0,0 +1,85 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from RadianceMethod.helper_functions.image_reading import get_capture_date_time
+
+
+class CaptureTimeIndex:
+    """
+    A persistent index of the EXIF capture times of the images of an image series.
+
+    The capture times are read in one batched, threaded pass that only parses the header bytes of every image and are
+    stored in a JSON file together with the modification time and size of every image, so that following runs only
+    read images that are new or have changed.
+
+    Attributes:
+        index_file_path (str or None): The path of the JSON index file, None keeps the index in memory only.
+        subseconds (bool): Whether the capture times include the SubSecTimeOriginal fraction of a second.
+        header_size (int): The number of bytes read from the start of every image to parse its EXIF data.
+
+    Methods:
+        update(file_paths, number_of_threads=8):
+            Read the capture times of all new or changed images and save the index.
+
+        get(file_path, file_bytes=None):
+            Return the capture time of an image, reading it (from file_bytes if given) if it is not indexed yet.
+
+        save():
+            Write the index to its JSON file.
+    """
+
+    def __init__(self, index_file_path=None, subseconds=False, header_size=64 * 1024):
+        self.index_file_path = index_file_path
+        self.subseconds = subseconds
+        self.header_size = header_size
+        self._entries = {}
+        if index_file_path is not None and os.path.exists(index_file_path):
+            with open(index_file_path) as index_file:
+                index = json.load(index_file)
+            if index.get('subseconds') == subseconds:
+                self._entries = index['entries']
+
+    @staticmethod
+    def _get_file_signature(file_path):
+        file_stat = os.stat(file_path)
+        return [file_stat.st_mtime_ns, file_stat.st_size]
+
+    def _is_indexed(self, file_path, file_signature):
+        entry = self._entries.get(os.path.abspath(file_path))
+        return entry is not None and entry[:2] == file_signature
+
+    def _read_capture_time(self, file_path, file_bytes=None):
+        return get_capture_date_time(file_path if file_bytes is None else file_bytes, subseconds=self.subseconds,
+                                     header_size=self.header_size)
+
+    def update(self, file_paths, number_of_threads=8):
+        file_signatures = {file_path: self._get_file_signature(file_path) for file_path in file_paths}
+        unindexed_file_paths = [file_path for file_path, file_signature in file_signatures.items()
+                                if not self._is_indexed(file_path, file_signature)]
+        if not unindexed_file_paths:
+            return
+
+        print(f"Reading capture times of {len(unindexed_file_paths)} images...")
+        with ThreadPoolExecutor(max_workers=number_of_threads) as executor:
+            capture_times = executor.map(self._read_capture_time, unindexed_file_paths)
+            for file_path, capture_time in zip(unindexed_file_paths, capture_times):
+                self._entries[os.path.abspath(file_path)] = file_signatures[file_path] + [capture_time.isoformat()]
+        self.save()
+
+    def get(self, file_path, file_bytes=None):
+        file_signature = self._get_file_signature(file_path)
+        if not self._is_indexed(file_path, file_signature):
+            capture_time = self._read_capture_time(file_path, file_bytes)
+            self._entries[os.path.abspath(file_path)] = file_signature + [capture_time.isoformat()]
+            return capture_time
+        return datetime.fromisoformat(self._entries[os.path.abspath(file_path)][2])
+
+    def save(self):
+        if self.index_file_path is None:
+            return
+        temporary_file_path = self.index_file_path + '.tmp'
+        with open(temporary_file_path, 'w') as index_file:
+            json.dump({'subseconds': self.subseconds, 'entries': self._entries}, index_file)
+        os.replace(temporary_file_path, self.index_file_path)
@@ -1,41 +1,195 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import rawpy
-import exifread
-from datetime import datetime
+import io
+from datetime import datetime, timedelta
 
 
-def get_channel_arrays_from_jpg_file(file):
-    image = plt.imread(file)
+def _decode_jpg_with_pillow(file, reduction_factor=1):
+    from PIL import Image
+    with Image.open(file) as image:
+        if reduction_factor > 1:
+            # Let the JPEG decoder scale the DCT blocks instead of decoding the full resolution
+            image.draft(image.mode, (image.width // reduction_factor, image.height // reduction_factor))
+        return np.asarray(image)
+
+
+def _decode_jpg_with_matplotlib(file, reduction_factor=1):
+    import matplotlib.pyplot as plt
+    if reduction_factor > 1:
+        raise ValueError("The matplotlib JPG decoder does not support reduced resolutions")
+    # File objects carry no extension, without a format matplotlib reads them as PNG
+    return plt.imread(file, format='jpeg')
+
+
+def _get_jpg_image_shape_with_pillow(file, reduction_factor=1):
+    from PIL import Image
+    with Image.open(file) as image:
+        if reduction_factor > 1:
+            image.draft(image.mode, (image.width // reduction_factor, image.height // reduction_factor))
+        return image.height, image.width
+
+
+JPG_DECODERS = {
+    'pillow': (_decode_jpg_with_pillow, _get_jpg_image_shape_with_pillow),
+    'matplotlib': (_decode_jpg_with_matplotlib, _get_jpg_image_shape_with_pillow),
+}
+
+
+def register_jpg_decoder(name, decode_function, shape_function):
+    """
+    Register a JPG decoder backend.
+
+    Parameters:
+        name (str): The name of the decoder.
+        decode_function (callable): Function (file, reduction_factor) returning the decoded image as array of shape
+        (height, width, channel).
+        shape_function (callable): Function (file, reduction_factor) returning the (height, width) of the decoded
+        image without decoding it.
+    """
+    JPG_DECODERS[name] = (decode_function, shape_function)
+
+
+def get_channel_arrays_from_jpg_file(file, windows=None, decoder='pillow', reduction_factor=1, contiguous=False):
+    """
+    Decode a JPG file into channel arrays.
+
+    Parameters:
+        file (str or file object): The path of the JPG file or a binary file object, e.g. an in-memory buffer.
+        windows (list or None): Optional list of (y_start, y_stop, x_start, x_stop) pixel windows. If given, only
+        these windows are returned, each as a contiguous array.
+        decoder (str): The name of the decoder backend, see JPG_DECODERS.
+        reduction_factor (int): Decode at 1/2, 1/4 or 1/8 of the resolution if supported by the decoder.
+        contiguous (bool): Whether the full image is returned as contiguous array instead of a channel-first view.
+
+    Returns:
+        ndarray or list: The channel arrays of shape (3, height, width), or a list with one such array per window.
+    """
+    image = JPG_DECODERS[decoder][0](file, reduction_factor)
     all_channel_array = np.rollaxis(image, -1)
+    if windows is None:
+        return np.ascontiguousarray(all_channel_array) if contiguous else all_channel_array
+    return [np.ascontiguousarray(all_channel_array[:, y_start:y_stop, x_start:x_stop])
+            for y_start, y_stop, x_start, x_stop in windows]
+
+
+def get_jpg_image_shape(file, decoder='pillow', reduction_factor=1):
+    return JPG_DECODERS[decoder][1](file, reduction_factor)
+
+
+def _correct_raw_values(data, black_level, white_level):
+    channel_array = data.astype(np.int16) - black_level
+    channel_array = (channel_array * (white_level / (white_level - black_level))).astype(np.int16)
+    channel_array = np.clip(channel_array, 0, white_level)
+    return channel_array
+
+
+def _split_raw_channels(channel_array, filter_array):
+    channel_0_array = np.where(filter_array == 0, channel_array, 0)
+    channel_1_array = np.where((filter_array == 1) | (filter_array == 3), channel_array, 0)
+    channel_2_array = np.where(filter_array == 2, channel_array, 0)
+    all_channel_array = np.array([channel_0_array, channel_1_array, channel_2_array])
     return all_channel_array
 
 
-def get_channel_arrays_from_raw_file(file):
+def get_channel_arrays_from_raw_file(file, windows=None):
+    """
+    Read the black level corrected and scaled channel arrays of a RAW file, with the pixels of the other Bayer
+    channels set to 0.
+
+    Parameters:
+        file (str or file object): The path of the RAW file or a binary file object, e.g. an in-memory buffer.
+        windows (list or None): Optional list of (y_start, y_stop, x_start, x_stop) pixel windows. If given, only
+        these windows of the visible image are corrected and split into channels.
+
+    Returns:
+        ndarray or list: The channel arrays of shape (3, height, width), or a list with one such array per window.
+    """
+    import rawpy
+    with rawpy.imread(file) as raw:
+        raw_image = raw.raw_image_visible
+        filter_array = raw.raw_colors_visible
+        black_level = raw.black_level_per_channel[0]
+        white_level = raw.white_level
+        if windows is None:
+            channel_array = _correct_raw_values(raw_image.copy(), black_level, white_level)
+            return _split_raw_channels(channel_array, filter_array)
+
+        window_arrays = []
+        for y_start, y_stop, x_start, x_stop in windows:
+            channel_array = _correct_raw_values(raw_image[y_start:y_stop, x_start:x_stop], black_level, white_level)
+            window_arrays.append(_split_raw_channels(channel_array, filter_array[y_start:y_stop, x_start:x_stop]))
+        return window_arrays
+
+
+def get_bayer_windows_from_raw_file(file, windows):
+    """
+    Read the black level corrected and scaled values of pixel windows of a RAW file together with the channel of
+    every pixel, without splitting them into zero-filled channel arrays.
+
+    Parameters:
+        file (str or file object): The path of the RAW file or a binary file object, e.g. an in-memory buffer.
+        windows (list): List of (y_start, y_stop, x_start, x_stop) pixel windows of the visible image.
+
+    Returns:
+        list: One (value_array, channel_index_array) tuple per window, the channel indices being 0, 1 or 2 with both
+        green filter sites mapped to channel 1.
+    """
+    import rawpy
     with rawpy.imread(file) as raw:
-        data = raw.raw_image_visible.copy()
+        raw_image = raw.raw_image_visible
         filter_array = raw.raw_colors_visible
         black_level = raw.black_level_per_channel[0]
         white_level = raw.white_level
-        channel_array = data.astype(np.int16) - black_level
-        channel_array = (channel_array * (white_level / (white_level - black_level))).astype(np.int16)
-        channel_array = np.clip(channel_array, 0, white_level)
-        channel_0_array = np.where(filter_array == 0, channel_array, 0)
-        channel_1_array = np.where((filter_array == 1) | (filter_array == 3), channel_array, 0)
-        channel_2_array = np.where(filter_array == 2, channel_array, 0)
-        all_channel_array = np.array([channel_0_array, channel_1_array, channel_2_array])
-        return all_channel_array
-
-
-def _get_exif_entry(filename, tag):
-    with open(filename, 'rb') as f:
-        exif = exifread.process_file(f, details=False, stop_tag=tag)
-        if f"EXIF {tag}" not in exif:
-            raise ValueError("No EXIF entry")
-        exif_entry = exif[f"EXIF {tag}"]
-    return str(exif_entry)
-
-
-def get_capture_date_time(file):
-    capture_time = _get_exif_entry(file, "DateTimeOriginal")
-    return datetime.strptime(capture_time, '%Y:%m:%d %H:%M:%S')
+        bayer_windows = []
+        for y_start, y_stop, x_start, x_stop in windows:
+            value_array = _correct_raw_values(raw_image[y_start:y_stop, x_start:x_stop], black_level, white_level)
+            channel_index_array = filter_array[y_start:y_stop, x_start:x_stop]
+            channel_index_array = np.where(channel_index_array == 3, 1, channel_index_array)
+            bayer_windows.append((value_array, channel_index_array))
+        return bayer_windows
+
+
+def get_raw_image_shape(file):
+    import rawpy
+    with rawpy.imread(file) as raw:
+        return raw.raw_image_visible.shape
+
+
+def _read_exif_tags(file, stop_tag, header_size=None):
+    import exifread
+    # Images already read into memory are parsed from their bytes instead of being read again
+    with io.BytesIO(file) if isinstance(file, bytes) else open(file, 'rb') as f:
+        if header_size is None:
+            return exifread.process_file(f, details=False, stop_tag=stop_tag)
+        header = io.BytesIO(f.read(header_size))
+    try:
+        return exifread.process_file(header, details=False, stop_tag=stop_tag)
+    except Exception:
+        return {}
+
+
+def get_capture_date_time(file, subseconds=False, header_size=None):
+    """
+    Read the capture date and time of an image from its EXIF data.
+
+    Parameters:
+        file (str or bytes): The path of the image file or its contents.
+        subseconds (bool): Whether to add the fraction of a second from the SubSecTimeOriginal entry, if present.
+        header_size (int or None): If given, only the first header_size bytes of the file are parsed. The whole file is
+        parsed if the entry is not found in these bytes.
+
+    Returns:
+        datetime: The capture date and time.
+    """
+    stop_tag = "SubSecTimeOriginal" if subseconds else "DateTimeOriginal"
+    exif = _read_exif_tags(file, stop_tag, header_size)
+    if "EXIF DateTimeOriginal" not in exif and header_size is not None:
+        exif = _read_exif_tags(file, stop_tag)
+    if "EXIF DateTimeOriginal" not in exif:
+        raise ValueError("No EXIF entry")
+
+    capture_time = datetime.strptime(str(exif["EXIF DateTimeOriginal"]), '%Y:%m:%d %H:%M:%S')
+    if subseconds and "EXIF SubSecTimeOriginal" in exif:
+        subsecond_digits = str(exif["EXIF SubSecTimeOriginal"]).strip()
+        if subsecond_digits.isdigit():
+            capture_time += timedelta(microseconds=int(subsecond_digits[:6].ljust(6, '0')))
+    return capture_time
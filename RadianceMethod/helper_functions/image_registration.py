@@ -0,0 +1,51 @@
+import numpy as np
+
+
+class PhaseCorrelator:
+    """
+    An estimator of the translation of image windows relative to a reference window by FFT phase correlation.
+
+    The windows are reduced to one channel by summing their channels, and a Hann window suppresses the edges, so that
+    only the image content (e.g. the checkerboard) determines the peak of the normalised cross-power spectrum. The
+    spectrum of the reference window is computed once.
+
+    Attributes:
+        max_offset (tuple): The maximum absolute (y, x) offset in pixels searched for.
+
+    Methods:
+        estimate_offset(window):
+            Return the (dy, dx) offset in whole pixels by which the content of a window is moved relative to the
+            reference window.
+    """
+
+    def __init__(self, reference_window, max_offset):
+        self.max_offset = tuple(max_offset)
+        reference_window = self._to_single_channel(reference_window)
+        self._hann_window = np.outer(np.hanning(reference_window.shape[0]), np.hanning(reference_window.shape[1]))
+        self._reference_spectrum = np.conj(self._calc_spectrum(reference_window))
+
+    @staticmethod
+    def _to_single_channel(window):
+        # Channel arrays of shape (channel, height, width) or RAW (value_array, channel_index_array) tuples
+        if isinstance(window, tuple):
+            return np.asarray(window[0], dtype=np.float64)
+        window = np.asarray(window, dtype=np.float64)
+        return window.sum(axis=0) if window.ndim == 3 else window
+
+    def _calc_spectrum(self, window):
+        return np.fft.rfft2((window - window.mean()) * self._hann_window)
+
+    def estimate_offset(self, window):
+        window = self._to_single_channel(window)
+        cross_power_spectrum = self._calc_spectrum(window) * self._reference_spectrum
+        cross_power_spectrum /= np.maximum(np.abs(cross_power_spectrum), np.finfo(np.float64).tiny)
+        correlation = np.fft.irfft2(cross_power_spectrum, s=window.shape)
+
+        # Only offsets up to max_offset are considered, larger ones are wrapped around the window edges
+        height, width = window.shape
+        max_dy, max_dx = min(self.max_offset[0], height // 2), min(self.max_offset[1], width // 2)
+        dy = np.r_[0:max_dy + 1, -max_dy:0]
+        dx = np.r_[0:max_dx + 1, -max_dx:0]
+        search_area = correlation[np.ix_(dy % height, dx % width)]
+        peak_y, peak_x = np.unravel_index(np.argmax(search_area), search_area.shape)
+        return int(dy[peak_y]), int(dx[peak_x])
@@ -0,0 +1,40 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def read_file_bytes(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read()
+
+
+def iter_read_ahead(file_paths, queue_depth=8, number_of_threads=4):
+    """
+    Yield the contents of files in the given order while up to queue_depth following files are read by a thread
+    pool, so that slow (e.g. network) storage is read while the caller decodes earlier files.
+
+    Parameters:
+        file_paths (list): The paths of the files in the order they are consumed.
+        queue_depth (int): The maximum number of files read ahead and held in memory besides the yielded one.
+        number_of_threads (int): The number of threads reading files concurrently.
+
+    Yields:
+        bytes: The contents of every file.
+    """
+    file_paths = iter(file_paths)
+    with ThreadPoolExecutor(max_workers=number_of_threads) as executor:
+        pending_reads = deque()
+        try:
+            for file_path in file_paths:
+                pending_reads.append(executor.submit(read_file_bytes, file_path))
+                if len(pending_reads) >= queue_depth:
+                    break
+            while pending_reads:
+                file_bytes = pending_reads.popleft().result()
+                file_path = next(file_paths, None)
+                if file_path is not None:
+                    pending_reads.append(executor.submit(read_file_bytes, file_path))
+                yield file_bytes
+        finally:
+            # Reads queued when the caller stops early are not needed anymore
+            for pending_read in pending_reads:
+                pending_read.cancel()
@@ -0,0 +1,183 @@
+import numpy as np
+
+
+def calc_roi_pixel_boxes(roi_pixel_coordinates, roi_pixel_dy, roi_pixel_width):
+    """
+    Calculate the pixel slicing bounds of a line of ROIs.
+
+    The bounds follow the slicing convention of DataExtractor: rows are sliced as y_top:y_bottom with
+    y_top = y_bottom + roi_pixel_dy, and columns as x_left:x_right with the ROI centred on its x coordinate.
+
+    Parameters:
+        roi_pixel_coordinates (ndarray): Array of shape (n, 2) with the (x, y) pixel coordinates of the ROIs.
+        roi_pixel_dy (int): The height of the ROIs in pixels.
+        roi_pixel_width (int): The width of the ROIs in pixels.
+
+    Returns:
+        ndarray: Array of shape (n, 4) with the (y_top, y_bottom, x_left, x_right) slicing bounds of every ROI.
+    """
+    roi_pixel_coordinates = np.asarray(roi_pixel_coordinates, dtype=int)
+    y_bottom = roi_pixel_coordinates[:, 1]
+    y_top = y_bottom + roi_pixel_dy
+    x_left = roi_pixel_coordinates[:, 0] - int(roi_pixel_width / 2)
+    x_right = x_left + roi_pixel_width
+    return np.stack([y_top, y_bottom, x_left, x_right], axis=1)
+
+
+def _normalise_slice_bounds(start, stop, length):
+    # Vectorised equivalent of slice(start, stop).indices(length) for a step of 1
+    start = np.clip(np.where(start < 0, start + length, start), 0, length)
+    stop = np.clip(np.where(stop < 0, stop + length, stop), 0, length)
+    return start, np.maximum(stop, start)
+
+
+class RoiReductionPlan:
+    """
+    A precomputed plan for reducing all ROIs of all checkerboard faces of a multi-channel image to their mean values.
+
+    For every face the plan crops the bounding window of its ROIs, builds a summed-area table over all channels of
+    that window and evaluates every ROI sum with four lookups. Integer images are summed exactly, so the means are
+    identical to calling .mean() on every ROI slice. Other dtypes fall back to per-ROI means.
+
+    Attributes:
+        roi_pixel_boxes (ndarray): Array of shape (face, ROI, 4) with the (y_top, y_bottom, x_left, x_right)
+        slicing bounds of every ROI.
+
+    Methods:
+        windows(image_shape):
+            Return the (y_start, y_stop, x_start, x_stop) bounding window of every face for a given image shape.
+
+        reduce(image_array):
+            Reduce an image of shape (channel, height, width) to an array of ROI means of shape (channel, face, ROI).
+
+        reduce_windows(window_arrays, image_shape):
+            Reduce the face windows of an image, as returned by windows(image_shape), to an array of ROI means.
+
+        reduce_bayer_windows(bayer_windows, image_shape):
+            Reduce (value_array, channel_index_array) RAW face windows to per-channel means over the matching Bayer
+            filter sites only.
+    """
+
+    def __init__(self, roi_pixel_boxes):
+        self.roi_pixel_boxes = np.array(roi_pixel_boxes, dtype=int)
+        self._image_shape = None
+        self._boxes = None
+        self._windows = None
+        self._window_boxes = None
+
+    def _prepare(self, image_shape):
+        if self._image_shape == image_shape:
+            return
+        height, width = image_shape
+        y_starts, y_stops = _normalise_slice_bounds(self.roi_pixel_boxes[..., 0], self.roi_pixel_boxes[..., 1], height)
+        x_starts, x_stops = _normalise_slice_bounds(self.roi_pixel_boxes[..., 2], self.roi_pixel_boxes[..., 3], width)
+        boxes = np.stack([y_starts, y_stops, x_starts, x_stops], axis=-1)
+
+        windows = []
+        window_boxes = []
+        for face_boxes in boxes:
+            non_empty = (face_boxes[:, 1] > face_boxes[:, 0]) & (face_boxes[:, 3] > face_boxes[:, 2])
+            if non_empty.any():
+                y_start, y_stop = face_boxes[non_empty, 0].min(), face_boxes[non_empty, 1].max()
+                x_start, x_stop = face_boxes[non_empty, 2].min(), face_boxes[non_empty, 3].max()
+            else:
+                y_start, y_stop, x_start, x_stop = 0, 0, 0, 0
+            windows.append((int(y_start), int(y_stop), int(x_start), int(x_stop)))
+            # Bounds relative to the window, empty ROIs outside of the window stay empty after clipping
+            relative_boxes = face_boxes - np.array([y_start, y_start, x_start, x_start])
+            window_boxes.append(np.clip(relative_boxes, 0, [y_stop - y_start, y_stop - y_start,
+                                                            x_stop - x_start, x_stop - x_start]))
+
+        self._image_shape = image_shape
+        self._boxes = boxes
+        self._windows = windows
+        self._window_boxes = window_boxes
+
+    def windows(self, image_shape):
+        self._prepare(tuple(image_shape))
+        return list(self._windows)
+
+    def reduce(self, image_array):
+        image_shape = tuple(image_array.shape[-2:])
+        window_arrays = [image_array[:, y_start:y_stop, x_start:x_stop]
+                         for y_start, y_stop, x_start, x_stop in self.windows(image_shape)]
+        return self.reduce_windows(window_arrays, image_shape)
+
+    def reduce_windows(self, window_arrays, image_shape):
+        self._prepare(tuple(image_shape))
+        number_of_faces, number_of_rois = self._boxes.shape[:2]
+        roi_means = np.empty((window_arrays[0].shape[0], number_of_faces, number_of_rois))
+        for face, window in enumerate(window_arrays):
+            if np.issubdtype(window.dtype, np.integer):
+                roi_means[:, face, :] = self._reduce_window(window, self._window_boxes[face])
+            else:
+                roi_means[:, face, :] = self._reduce_window_per_roi(window, self._window_boxes[face])
+        return roi_means
+
+    def reduce_bayer_windows(self, bayer_windows, image_shape):
+        """
+        Reduce RAW face windows of a 2x2 Bayer filter array to per-channel means over the matching filter sites.
+
+        Every filter site of the 2x2 pattern forms a sub-lattice of the window, which is summed through a strided view
+        without splitting the window into channel planes. The ROI bounds are mapped to the rows and columns of every
+        sub-lattice, and the sums and pixel counts of the sub-lattices of a channel (both greens) are added up.
+
+        Parameters:
+            bayer_windows (list): One (value_array, channel_index_array) tuple per face window, as returned by
+            image_reading.get_bayer_windows_from_raw_file.
+            image_shape (tuple): The (height, width) of the image.
+
+        Returns:
+            ndarray: The ROI means of shape (channel, face, ROI).
+        """
+        self._prepare(tuple(image_shape))
+        number_of_faces, number_of_rois = self._boxes.shape[:2]
+        roi_means = np.empty((3, number_of_faces, number_of_rois))
+        for face, (value_array, channel_index_array) in enumerate(bayer_windows):
+            top, bottom, left, right = self._window_boxes[face].T
+            roi_sums = np.zeros((3, number_of_rois), dtype=np.int64)
+            roi_pixel_counts = np.zeros((3, number_of_rois), dtype=np.int64)
+            for y_offset in range(2):
+                for x_offset in range(2):
+                    sub_lattice = value_array[y_offset::2, x_offset::2]
+                    if sub_lattice.size == 0:
+                        continue
+                    channel = channel_index_array[y_offset, x_offset]
+                    if np.any(channel_index_array[y_offset::2, x_offset::2] != channel):
+                        raise ValueError("The RAW 'bayer' reduction mode requires a 2x2 Bayer filter array")
+                    # The first and stop rows and columns of the sub-lattice within the ROI bounds
+                    sub_lattice_boxes = np.stack([(top - y_offset + 1) // 2, (bottom - y_offset + 1) // 2,
+                                                  (left - x_offset + 1) // 2, (right - x_offset + 1) // 2], axis=1)
+                    roi_sums[channel] += self._calc_roi_sums(sub_lattice[np.newaxis], sub_lattice_boxes)[0]
+                    sub_top, sub_bottom, sub_left, sub_right = sub_lattice_boxes.T
+                    roi_pixel_counts[channel] += (np.maximum(sub_bottom - sub_top, 0) *
+                                                  np.maximum(sub_right - sub_left, 0))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                roi_means[:, face, :] = roi_sums / roi_pixel_counts
+        return roi_means
+
+    @staticmethod
+    def _calc_roi_sums(window, window_boxes):
+        summed_area_table = np.zeros((window.shape[0], window.shape[1] + 1, window.shape[2] + 1), dtype=np.int64)
+        np.cumsum(window, axis=1, dtype=np.int64, out=summed_area_table[:, 1:, 1:])
+        np.cumsum(summed_area_table[:, 1:, 1:], axis=2, out=summed_area_table[:, 1:, 1:])
+
+        top, bottom, left, right = window_boxes.T
+        return (summed_area_table[:, bottom, right] - summed_area_table[:, top, right]
+                - summed_area_table[:, bottom, left] + summed_area_table[:, top, left])
+
+    @classmethod
+    def _reduce_window(cls, window, window_boxes):
+        roi_sums = cls._calc_roi_sums(window, window_boxes)
+        top, bottom, left, right = window_boxes.T
+        roi_pixel_counts = (bottom - top) * (right - left)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return roi_sums / roi_pixel_counts
+
+    @staticmethod
+    def _reduce_window_per_roi(window, window_boxes):
+        roi_means = np.empty((window.shape[0], len(window_boxes)))
+        for roi, (top, bottom, left, right) in enumerate(window_boxes):
+            for channel in range(window.shape[0]):
+                roi_means[channel, roi] = window[channel, top:bottom, left:right].mean()
+        return roi_means
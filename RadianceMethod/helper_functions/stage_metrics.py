@@ -0,0 +1,121 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+
+class StageMetrics:
+    """
+    A recorder of the wall time, bytes read and peak memory of the processing stages of a run.
+
+    Every measured stage produces a record dictionary with the keys 'stage', 'image_id' (None for stages not belonging
+    to a single image), 'seconds', 'bytes_read' and 'peak_memory_bytes' (None unless memory tracing is enabled). Each
+    record is passed to the callback right away and aggregated per stage for the summary. Records measured in worker
+    processes are buffered in the metrics returned by get_worker_metrics and added to the metrics of the main process
+    with add_records.
+
+    Attributes:
+        callback (callable or None): Function called with every record.
+        trace_memory (bool): Whether the peak memory of every stage is traced with tracemalloc, which slows down
+        Python allocations.
+        stage_summaries (dict): Dictionary mapping the stage names to their count, total seconds, maximum seconds,
+        bytes read and peak memory.
+
+    Methods:
+        measure(stage, image_id=None):
+            Context manager measuring a stage, yielding the record so that 'bytes_read' can be set.
+
+        add_records(records):
+            Add records measured elsewhere, e.g. in a worker process.
+
+        get_worker_metrics():
+            Return empty metrics for a worker process, which buffer their records instead of calling the callback.
+
+        pop_records():
+            Return and clear the records buffered since the last call.
+
+        get_summary():
+            Return the per-stage summary with the mean time and throughput of every stage.
+
+        write_summary(file_path):
+            Write the per-stage summary to a JSON file.
+    """
+
+    def __init__(self, callback=None, trace_memory=False):
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.stage_summaries = {}
+        self._buffer_records = False
+        self._buffered_records = []
+        self._start_time = time.perf_counter()
+
+    def __getstate__(self):
+        # Callbacks are often not picklable and are only called in the main process
+        state = self.__dict__.copy()
+        state['callback'] = None
+        return state
+
+    @contextmanager
+    def measure(self, stage, image_id=None):
+        record = {'stage': stage, 'image_id': image_id, 'seconds': None, 'bytes_read': 0, 'peak_memory_bytes': None}
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        start_time = time.perf_counter()
+        yield record
+        record['seconds'] = time.perf_counter() - start_time
+        if self.trace_memory:
+            record['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1] - start_memory
+        self.add_records([record])
+
+    def add_records(self, records):
+        for record in records:
+            stage_summary = self.stage_summaries.setdefault(record['stage'], {
+                'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'bytes_read': 0, 'peak_memory_bytes': None})
+            stage_summary['count'] += 1
+            stage_summary['total_seconds'] += record['seconds']
+            stage_summary['max_seconds'] = max(stage_summary['max_seconds'], record['seconds'])
+            stage_summary['bytes_read'] += record['bytes_read']
+            if record['peak_memory_bytes'] is not None:
+                stage_summary['peak_memory_bytes'] = max(stage_summary['peak_memory_bytes'] or 0,
+                                                         record['peak_memory_bytes'])
+            if self._buffer_records:
+                self._buffered_records.append(record)
+            if self.callback is not None:
+                self.callback(record)
+
+    def get_worker_metrics(self):
+        worker_metrics = StageMetrics(trace_memory=self.trace_memory)
+        worker_metrics._buffer_records = True
+        return worker_metrics
+
+    def pop_records(self):
+        records, self._buffered_records = self._buffered_records, []
+        return records
+
+    def get_summary(self):
+        summary = {'wall_time_seconds': time.perf_counter() - self._start_time, 'stages': {}}
+        for stage, stage_summary in self.stage_summaries.items():
+            total_seconds = stage_summary['total_seconds']
+            summary['stages'][stage] = dict(
+                stage_summary,
+                mean_seconds=total_seconds / stage_summary['count'],
+                megabytes_per_second=stage_summary['bytes_read'] / 1024 ** 2 / total_seconds
+                if stage_summary['bytes_read'] and total_seconds > 0 else None)
+        return summary
+
+    def write_summary(self, file_path):
+        with open(file_path, 'w') as summary_file:
+            json.dump(self.get_summary(), summary_file, indent=2)
+
+
+def measure_stage(stage_metrics, stage, image_id=None):
+    """
+    Return a context manager measuring a stage with stage_metrics, or doing nothing if stage_metrics is None. Both
+    yield a record dictionary, whose 'bytes_read' is only used in the first case.
+    """
+    if stage_metrics is None:
+        return nullcontext({'stage': stage, 'image_id': image_id, 'bytes_read': 0})
+    return stage_metrics.measure(stage, image_id)
@@ -0,0 +1,84 @@
+import os
+import numpy as np
+from datetime import datetime, timedelta, timezone
+
+
+def _import_av():
+    try:
+        import av
+    except ImportError:
+        raise ImportError("Reading video files requires PyAV, install the optional video requirements with "
+                          "pip install -r RadianceMethod/requirements-video.txt")
+    return av
+
+
+def get_video_frame_shape(file):
+    av = _import_av()
+    with av.open(file) as container:
+        stream = container.streams.video[0]
+        return stream.codec_context.height, stream.codec_context.width
+
+
+def get_video_start_date_time(file):
+    """
+    Return the recording start date and time of a video file in UTC (without time zone), taken from the
+    'creation_time' entry of the container metadata or, if it is missing, from the modification time of the file.
+    """
+    av = _import_av()
+    with av.open(file) as container:
+        creation_time = container.metadata.get('creation_time')
+    if creation_time:
+        start_time = datetime.fromisoformat(creation_time.replace('Z', '+00:00'))
+        if start_time.tzinfo is None:
+            return start_time
+    else:
+        start_time = datetime.fromtimestamp(os.path.getmtime(file), timezone.utc)
+    return start_time.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def iter_video_frames(file, frame_indices, windows=None, number_of_threads=0):
+    """
+    Decode the frames of a video file one at a time and yield the requested ones, so that only a single decoded frame
+    is held in memory. Frames that are not requested are decoded (the following frames depend on them) but not
+    converted to RGB.
+
+    Parameters:
+        file (str): The path of the video file, e.g. MP4 or AVI.
+        frame_indices (iterable): The increasing indices of the requested frames, counted from 0 in presentation order.
+        windows (list or None): Optional list of (y_start, y_stop, x_start, x_stop) pixel windows. If given, only
+        these windows are yielded, each as a contiguous array.
+        number_of_threads (int): The number of decoder threads, 0 lets the decoder choose.
+
+    Yields:
+        tuple: The frame index, the presentation time of the frame since the start of the video as timedelta, and the
+        channel arrays of shape (3, height, width) of the frame or a list with one such array per window.
+    """
+    av = _import_av()
+    frame_indices = iter(frame_indices)
+    next_frame_index = next(frame_indices, None)
+    if next_frame_index is None:
+        return
+    with av.open(file) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = 'AUTO'
+        stream.codec_context.thread_count = number_of_threads
+        start_pts = stream.start_time or 0
+        for frame_index, frame in enumerate(container.decode(stream)):
+            if frame_index < next_frame_index:
+                continue
+            # The presentation time stamp of the container, streams without one are assumed to have a constant rate
+            if frame.pts is None:
+                frame_time = frame_index / stream.average_rate
+            else:
+                frame_time = (frame.pts - start_pts) * stream.time_base
+            all_channel_array = np.rollaxis(frame.to_ndarray(format='rgb24'), -1)
+            if windows is None:
+                frame_data = all_channel_array
+            else:
+                frame_data = [np.ascontiguousarray(all_channel_array[:, y_start:y_stop, x_start:x_stop])
+                              for y_start, y_stop, x_start, x_stop in windows]
+            yield frame_index, timedelta(seconds=float(frame_time)), frame_data
+            next_frame_index = next(frame_indices, None)
+            if next_frame_index is None:
+                return
+        raise ValueError(f"The video file {file} has no frame {next_frame_index}")
@@ -1,29 +1,145 @@
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import os
+from matplotlib.collections import LineCollection
 
-def plot_ec_all(results_dir, exp_name, x_min, x_max, y_min, y_max):
+def plot_ec_all(results_dir, exp_name, x_min, x_max, y_min, y_max, mode='lines', data_analysis=None):
+    """
+    Plot the extinction coefficients of all channels, read from the CSV files in results_dir or taken from the
+    extinction_coefficients_dict of a DataAnalysis instance if given. See plot_ec for the modes.
+
+    A DataAnalysis without the extinction coefficients in memory, e.g. after calc_results_in_chunks, is plotted from
+    the CSV files in its results directory.
+    """
+    if data_analysis is not None:
+        for channel in data_analysis.channels_to_analyse:
+            ec_data = None
+            data_path = os.path.join(data_analysis.results_dir, f'extinction_coefficients_channel_{channel}.csv')
+            if (data_analysis.extinction_coefficients_dict is not None and
+                    f"channel_{channel}" in data_analysis.extinction_coefficients_dict):
+                ec_data = data_analysis.extinction_coefficients_dict[f"channel_{channel}"]
+            elif not os.path.exists(data_path):
+                raise ValueError(f"The extinction coefficients of channel {channel} are neither calculated nor "
+                                 f"written to {data_path}, call plot_ec_all without data_analysis and with the "
+                                 f"results directory of the extinction coefficient files instead")
+            plot_ec(data_path, results_dir, exp_name, channel, x_min, x_max, y_min, y_max, mode=mode,
+                    ec_data=ec_data)
+        return
     for channel in [0,1,2]:
         data_path = os.path.join(results_dir,f'extinction_coefficients_channel_{channel}.csv')
-        plot_ec(data_path, results_dir, exp_name, channel, x_min, x_max, y_min, y_max)
+        plot_ec(data_path, results_dir, exp_name, channel, x_min, x_max, y_min, y_max, mode=mode)
+
+def plot_ec(data_path, results_dir, exp_name, channel, x_min, x_max, y_min, y_max, mode='lines', ec_data=None,
+            number_of_buckets=None):
+    """
+    Plot the extinction coefficients of one channel over time to a PDF file.
 
-def plot_ec(data_path, results_dir, exp_name, channel, x_min, x_max, y_min, y_max):
-    data = pd.read_csv(data_path, skiprows=3)
-    data['Timedelta'] = pd.to_timedelta(data['Timedelta'])
-    data['Timedelta_seconds'] = data['Timedelta'].dt.total_seconds()
-    x = data['Timedelta_seconds']
-    y = data.iloc[:, 3:]
-    plt.plot(x, y)
+    Parameters:
+        mode (str): 'lines' draws one line per ROI, 'collection' draws all ROIs as one LineCollection decimated to the
+        minimum and maximum of every pixel column, 'heatmap' shows the ROI height over time coloured by the
+        extinction coefficient (limited to y_min and y_max).
+        ec_data (DataFrame or None): The extinction coefficients as calculated by DataAnalysis, read from data_path
+        if None.
+        number_of_buckets (int or None): The number of time buckets of the 'collection' and 'heatmap' modes, the
+        width of the axes in pixels if None.
+    """
+    if mode not in ['lines', 'collection', 'heatmap']:
+        raise ValueError(f"Unknown plot mode '{mode}'")
+    if mode == 'lines' and ec_data is None:
+        data = pd.read_csv(data_path, skiprows=3)
+        data['Timedelta'] = pd.to_timedelta(data['Timedelta'])
+        data['Timedelta_seconds'] = data['Timedelta'].dt.total_seconds()
+        x = data['Timedelta_seconds']
+        y = data.iloc[:, 3:]
+        plt.plot(x, y)
+    else:
+        if ec_data is None:
+            ec_data = pd.read_csv(data_path, header=[0, 1, 2], index_col=[0, 1, 2], float_precision='round_trip')
+        x = pd.to_timedelta(ec_data.index.get_level_values('Timedelta')).total_seconds().to_numpy()
+        y = ec_data.to_numpy()
+        if number_of_buckets is None:
+            number_of_buckets = int(plt.gca().bbox.width)
+        if mode == 'lines':
+            plt.plot(x, y)
+        elif mode == 'collection':
+            _plot_line_collection(x, y, number_of_buckets)
+        else:
+            roi_heights = ec_data.columns.get_level_values(0).astype(float).to_numpy()
+            _plot_heatmap(x, y, roi_heights, x_min, x_max, y_min, y_max, number_of_buckets)
 
     plt.xlabel('Time [s]')
-    plt.ylabel('Extinction Coefficient [1/m]')
+    plt.ylabel('ROI height [m]' if mode == 'heatmap' else 'Extinction Coefficient [1/m]')
     plt.title(f'{exp_name} EC Ch{channel}'.replace('_',' '))
-    plt.grid()
+    if mode != 'heatmap':
+        plt.grid()
     plt.xlim(x_min, x_max)
-    plt.ylim(y_min, y_max)
+    if mode != 'heatmap':
+        plt.ylim(y_min, y_max)
 
-    output_file_path = os.path.join(results_dir,f'{exp_name}_plot_ec_channel_{channel}.pdf')
+    plot_name = 'plot_ec' if mode == 'lines' else f'plot_ec_{mode}'
+    output_file_path = os.path.join(results_dir,f'{exp_name}_{plot_name}_channel_{channel}.pdf')
     plt.savefig(output_file_path)
     plt.close()
     print(f'Plot_EC_Ch{channel} complete')
 
+def decimate_min_max(x, y, number_of_buckets):
+    """
+    Reduce traces to the minimum and maximum of every bucket of consecutive samples, in the order they occur, so that
+    the drawn envelope is the same as with all samples when a bucket is not wider than a pixel.
+
+    Parameters:
+        x (ndarray): The sample positions of shape (sample,).
+        y (ndarray): The traces of shape (sample, trace), NaNs are kept if a bucket contains only NaNs.
+        number_of_buckets (int): The maximum number of buckets.
+
+    Returns:
+        tuple: The positions and values of the decimated traces, both of shape (sample, trace).
+    """
+    number_of_samples = len(x)
+    if number_of_samples <= 2 * number_of_buckets:
+        return np.broadcast_to(x[:, np.newaxis], y.shape), y
+    bucket_size = -(-number_of_samples // number_of_buckets)
+    number_of_buckets = -(-number_of_samples // bucket_size)
+    padded_y = np.full((number_of_buckets * bucket_size, y.shape[1]), np.nan)
+    padded_y[:number_of_samples] = y
+    padded_y = padded_y.reshape(number_of_buckets, bucket_size, -1)
+    nan_mask = np.isnan(padded_y)
+    min_indices = np.argmin(np.where(nan_mask, np.inf, padded_y), axis=1)
+    max_indices = np.argmax(np.where(nan_mask, -np.inf, padded_y), axis=1)
+    bucket_starts = np.arange(number_of_buckets)[:, np.newaxis] * bucket_size
+    indices = np.stack([np.minimum(min_indices, max_indices), np.maximum(min_indices, max_indices)], axis=1)
+    indices = np.minimum(indices + bucket_starts[:, np.newaxis], number_of_samples - 1).reshape(-1, y.shape[1])
+    return x[indices], np.take_along_axis(y, indices, axis=0)
+
+def _plot_line_collection(x, y, number_of_buckets):
+    decimated_x, decimated_y = decimate_min_max(x, y, number_of_buckets)
+    segments = np.stack([decimated_x.T, decimated_y.T], axis=-1)
+    # Same colours as one plt.plot call per ROI
+    colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+    line_collection = LineCollection(segments, colors=[colors[i % len(colors)] for i in range(len(segments))],
+                                     linewidths=plt.rcParams['lines.linewidth'])
+    plt.gca().add_collection(line_collection)
+    plt.gca().autoscale_view()
+
+def _plot_heatmap(x, y, roi_heights, x_min, x_max, y_min, y_max, number_of_buckets):
+    # Average the samples of every time bucket, buckets without samples stay empty
+    x_start = np.nanmin(x) if x_min is None else x_min
+    x_stop = np.nanmax(x) if x_max is None else x_max
+    bucket_indices = np.floor((x - x_start) / (x_stop - x_start) * number_of_buckets).astype(int)
+    in_range = (bucket_indices >= 0) & (bucket_indices < number_of_buckets)
+    bucket_sums = np.zeros((number_of_buckets, y.shape[1]))
+    bucket_counts = np.zeros((number_of_buckets, y.shape[1]))
+    valid_y = np.where(np.isnan(y), 0, y)[in_range]
+    np.add.at(bucket_sums, bucket_indices[in_range], valid_y)
+    np.add.at(bucket_counts, bucket_indices[in_range], ~np.isnan(y[in_range]))
+    with np.errstate(invalid='ignore'):
+        bucket_means = bucket_sums / bucket_counts
+
+    order = np.argsort(roi_heights)
+    roi_heights = roi_heights[order]
+    half_roi_height = (roi_heights[-1] - roi_heights[0]) / max(len(roi_heights) - 1, 1) / 2
+    image = plt.imshow(bucket_means[:, order].T, aspect='auto', origin='lower', interpolation='nearest',
+                       extent=(x_start, x_stop, roi_heights[0] - half_roi_height, roi_heights[-1] + half_roi_height),
+                       vmin=y_min, vmax=y_max)
+    plt.colorbar(image, label='Extinction Coefficient [1/m]')
@@ -1,15 +1,195 @@
 import os
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.widgets import Button
-from matplotlib import patches
-import matplotlib.gridspec as gridspec
+import copy
 import csv
-from tqdm import tqdm
-
+import hashlib
+import io
+import json
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+
+from RadianceMethod.helper_functions.capture_time_index import CaptureTimeIndex
 from RadianceMethod.helper_functions.distance_calculations import calc_distance_3d, divide_line_2d, divide_line_3d
-from RadianceMethod.helper_functions.image_reading import get_capture_date_time, get_channel_arrays_from_jpg_file, \
-    get_channel_arrays_from_raw_file
+from RadianceMethod.helper_functions.image_registration import PhaseCorrelator
+from RadianceMethod.helper_functions.image_reading import JPG_DECODERS, get_channel_arrays_from_jpg_file, \
+    get_jpg_image_shape, get_channel_arrays_from_raw_file, get_raw_image_shape, get_bayer_windows_from_raw_file
+from RadianceMethod.helper_functions.read_ahead import iter_read_ahead, read_file_bytes
+from RadianceMethod.helper_functions.roi_reduction import RoiReductionPlan, calc_roi_pixel_boxes
+from RadianceMethod.helper_functions.stage_metrics import StageMetrics, measure_stage
+from RadianceMethod.helper_functions.video_reading import get_video_frame_shape, get_video_start_date_time, \
+    iter_video_frames
+from RadianceMethod.processing.result_cache import RoiResultCache
+from RadianceMethod.processing.shard_merge import get_shard_result_name
+from RadianceMethod.processing.roi_strip_stack import RoiStripStack, calc_roi_strip_box
+from RadianceMethod.processing.result_writers import CsvResultWriter, NpyResultWriter, get_csv_result_image_ids, \
+    keep_csv_result_rows
+
+
+_worker_data_extractor = None
+
+
+def _init_worker(data_extractor):
+    global _worker_data_extractor
+    _worker_data_extractor = data_extractor
+    if data_extractor.stage_metrics is not None:
+        data_extractor.stage_metrics = data_extractor.stage_metrics.get_worker_metrics()
+
+
+def _process_image_in_worker(image_id):
+    image_result = _worker_data_extractor._process_image(image_id)
+    # The stage records and image offset of the worker are sent back with the result and kept by the main process
+    stage_records = None
+    if _worker_data_extractor.stage_metrics is not None:
+        stage_records = _worker_data_extractor.stage_metrics.pop_records()
+    return image_result, stage_records, _worker_data_extractor.image_offsets.pop(image_id, None)
+
+
+_worker_data_extractor_groups = None
+
+
+def _init_group_worker(data_extractor_groups):
+    global _worker_data_extractor_groups
+    _worker_data_extractor_groups = data_extractor_groups
+
+
+def _reduce_group_image_in_worker(group_index, image_id, needed):
+    return _reduce_group_image(_worker_data_extractor_groups[group_index], image_id, needed)
+
+
+def _crop_window(window_data, window):
+    y_start, y_stop, x_start, x_stop = window
+    if isinstance(window_data, tuple):
+        return tuple(array[y_start:y_stop, x_start:x_stop] for array in window_data)
+    return window_data[:, y_start:y_stop, x_start:x_stop]
+
+
+def _reduce_group_image(data_extractors, image_id, needed, image_bytes=None):
+    """
+    Reduce one image for all data extractors of a group that read the same image files, from its file or from its
+    contents if given as image_bytes.
+
+    An image needed by a single extractor is read as usual, only the ROI windows of that extractor are decoded. If
+    several extractors need it, the whole image is decoded once and every extractor reduces its own windows of it.
+
+    Returns:
+        tuple: The list of the ROI values of shape (channel, face, ROI) for every extractor, None where not needed, and
+        the list of the time in seconds spent on the image for every extractor.
+    """
+    needed_data_extractors = [data_extractor for data_extractor, is_needed in zip(data_extractors, needed)
+                              if is_needed]
+    image_file_path = needed_data_extractors[0]._get_image_file_path(image_id)
+    image_shape = needed_data_extractors[0]._get_image_shape()
+    image_data = None
+    decode_time_share = 0.0
+    if len(needed_data_extractors) > 1:
+        start_time = time.perf_counter()
+        image_file = image_file_path if image_bytes is None else io.BytesIO(image_bytes)
+        image_data = needed_data_extractors[0]._read_image_windows(image_file,
+                                                                   [(0, image_shape[0], 0, image_shape[1])])[0]
+        # The shared decoding counts in equal parts for every extractor needing the image
+        decode_time_share = (time.perf_counter() - start_time) / len(needed_data_extractors)
+
+    group_roi_values = []
+    group_times = []
+    for data_extractor, is_needed in zip(data_extractors, needed):
+        if not is_needed:
+            group_roi_values.append(None)
+            group_times.append(0.0)
+            continue
+        start_time = time.perf_counter()
+        windows = data_extractor._get_image_roi_reduction_plan().windows(image_shape)
+        if image_data is None:
+            image_file = image_file_path if image_bytes is None else io.BytesIO(image_bytes)
+            window_data = data_extractor._read_image_windows(image_file, windows)
+        else:
+            window_data = [_crop_window(image_data, window) for window in windows]
+        group_roi_values.append(data_extractor._reduce_image_windows(window_data, image_shape))
+        group_times.append(decode_time_share + time.perf_counter() - start_time)
+    return group_roi_values, group_times
+
+
+def process_group_image_data(data_extractors, executor=None, group_index=0, number_of_workers=1):
+    """
+    Process the image series of several data extractors reading the same image files in one pass, decoding every
+    image once, and write the ROI values of every extractor to its own result files. Images found in the ROI result
+    cache of an extractor are only decoded for the other extractors. Without a process pool, the image files are
+    read ahead by a thread pool if any extractor has read-ahead enabled.
+
+    The time spent on the images of every extractor, with an equal part of the decoding shared with other extractors,
+    is summed in its progress['processing_time'].
+
+    Parameters:
+        data_extractors (list): The DataExtractor instances of the group.
+        executor (ProcessPoolExecutor or None): A process pool initialised with _init_group_worker, None processes
+        serially.
+        group_index (int): The index of the group in the data extractor groups the pool was initialised with.
+        number_of_workers (int): The number of workers of the pool, used to size the chunks sent to the workers.
+    """
+    from tqdm import tqdm
+
+    if any(data_extractor.image_file_format == 'video' for data_extractor in data_extractors):
+        raise ValueError("Video files can only be processed by a single data extractor without ROI geometries")
+    if any(data_extractor.roi_strip_padding is not None for data_extractor in data_extractors):
+        raise ValueError("The ROI strip stack is not supported for ROI geometries and batch runs")
+    if any(data_extractor.shake_compensation_max_offset is not None for data_extractor in data_extractors):
+        raise ValueError("Shake compensation is not supported for ROI geometries and batch runs")
+    needed_image_ids = [set(data_extractor._prepare_image_processing()) for data_extractor in data_extractors]
+    image_ids = sorted(set().union(*needed_image_ids))
+    # Images are only decoded for the extractors without a cached result
+    cached_image_results = [data_extractor._get_cached_image_results(sorted(image_id_set))
+                            for data_extractor, image_id_set in zip(data_extractors, needed_image_ids)]
+    needed = [tuple(image_id in image_id_set and image_id not in cached
+                    for image_id_set, cached in zip(needed_image_ids, cached_image_results))
+              for image_id in image_ids]
+    decoded_image_ids = [image_id for image_id, is_needed in zip(image_ids, needed) if any(is_needed)]
+    decoded_needed = [is_needed for is_needed in needed if any(is_needed)]
+    cache_keys = [data_extractor._get_roi_result_cache_key() for data_extractor in data_extractors]
+
+    with ExitStack() as stack:
+        result_writers = [data_extractor._create_result_writers(
+            stack, resume=bool(data_extractor.progress['resumed_images'])) for data_extractor in data_extractors]
+        print("Processing images...")
+        read_ahead_queue_depth = max(data_extractor.read_ahead_queue_depth for data_extractor in data_extractors)
+        if executor is None and read_ahead_queue_depth > 0:
+            # The worker processes of a process pool read their image files concurrently already
+            image_file_bytes = iter_read_ahead([data_extractors[0]._get_image_file_path(image_id)
+                                                for image_id in decoded_image_ids], read_ahead_queue_depth,
+                                               max(data_extractor.number_of_read_ahead_threads
+                                                   for data_extractor in data_extractors))
+            stack.callback(image_file_bytes.close)
+            group_results = map(_reduce_group_image, [data_extractors] * len(decoded_image_ids), decoded_image_ids,
+                                decoded_needed, image_file_bytes)
+        elif executor is None:
+            group_results = map(_reduce_group_image, [data_extractors] * len(decoded_image_ids), decoded_image_ids,
+                                decoded_needed)
+        else:
+            chunksize = max(1, len(decoded_image_ids) // (number_of_workers * 8))
+            group_results = executor.map(_reduce_group_image_in_worker, [group_index] * len(decoded_image_ids),
+                                         decoded_image_ids, decoded_needed, chunksize=chunksize)
+        for image_id, is_needed in tqdm(zip(image_ids, needed), total=len(image_ids)):
+            if any(is_needed):
+                group_roi_values, group_times = next(group_results)
+            else:
+                group_roi_values, group_times = [None] * len(data_extractors), [0.0] * len(data_extractors)
+            for data_extractor, writers, cached, cache_key, roi_values, image_time in zip(
+                    data_extractors, result_writers, cached_image_results, cache_keys, group_roi_values, group_times):
+                start_time = time.perf_counter()
+                image_file_path = data_extractor._get_image_file_path(image_id)
+                if image_id in cached:
+                    capture_time, roi_values = cached.pop(image_id)
+                elif roi_values is None:
+                    continue
+                else:
+                    capture_time = data_extractor._get_capture_time_index().get(image_file_path)
+                    if data_extractor.roi_result_cache is not None:
+                        data_extractor.roi_result_cache.put(image_file_path, cache_key, capture_time, roi_values)
+                data_extractor._write_image_result(writers, image_id, capture_time, roi_values)
+                data_extractor.progress['processing_time'] += image_time + time.perf_counter() - start_time
+
+    for data_extractor in data_extractors:
+        data_extractor._finish_image_processing()
 
 
 class DataExtractor:
@@ -20,14 +200,24 @@ class DataExtractor:
         dark_roi_pixel_dy (int): The height of the dark ROI in pixels.
         dark_roi_real_dx (float): The horizontal distance between dark ROIs in real-world units.
         image_dir (str): The directory where the image files are located.
-        image_file_format (str): The format of the image files ('jpg' or 'raw').
+        image_file_format (str): The format of the image files ('jpg' or 'raw'), or 'video' for the frames of a
+        video file (e.g. MP4 or AVI) whose name is given as image_name_string, with the frame indices as image IDs.
+        raw_reduction_mode (str): How RAW ROIs are reduced, 'zero_filled' averages the channel arrays with the other
+        Bayer sites set to 0, 'bayer' averages over the Bayer sites of each channel only.
+        jpg_decoder (str): The name of the JPG decoder backend, see image_reading.JPG_DECODERS.
+        jpg_reduction_factor (int): The factor by which JPG images are downscaled while decoding (1, 2, 4 or 8), the
+        ROI pixel bounds are scaled accordingly.
         results_dir (str): The directory where the result files will be saved.
         reference_image_id (int): The ID of the reference image used for time delta calculation.
         first_image_id (int): The ID of the first image in the image series.
         last_image_id (int): The ID of the last image in the image series.
         skip_n_images (int): The number of images to skip when processing the image series.
         image_name_string (str): The template string for forming image filenames with image IDs.
-        image_series (range): A range object containing the image IDs in the image series.
+        image_series (range): A range object containing the image IDs in the image series (of the shard if sharded).
+        shard_index (int): The index of the contiguous part of the image series processed by this extractor.
+        number_of_shards (int): The number of parts the image series is split into, e.g. to process it on several
+        machines. Every shard writes its own result files, named after the experiment with a '_shard_<index>_of_<count>'
+        suffix, which are combined by shard_merge.merge_shard_results.
         dark_roi_pixel_bounds (tuple): Tuple containing the lower and upper bounds of the dark ROI in pixels.
         light_roi_pixel_bounds (tuple): Tuple containing the lower and upper bounds of the light ROI in pixels.
         dark_roi_real_bounds (tuple): Tuple containing the lower and upper bounds of the dark ROI in real-world units.
@@ -39,11 +229,41 @@ class DataExtractor:
         dark_roi_camera_real_distances (list): List containing the distances between the dark ROIs and the camera.
         light_roi_camera_real_distances (list): List containing the distances between the light ROIs and the camera.
         height_marker_heights (list): List of height marker heights in real-world units.
+        roi_reduction_plan (RoiReductionPlan): The precomputed plan reducing all dark and light ROIs of an image at once.
+        roi_geometry_hash (str): A hash of the ROI pixel geometry, used to key the ROI result cache.
+        roi_result_cache (RoiResultCache or None): The on-disk cache of per-image ROI values, None if disabled.
+        subsecond_capture_times (bool): Whether capture times include the EXIF SubSecTimeOriginal fraction of a second.
+        number_of_exif_threads (int): The number of threads reading the capture times of the image series.
+        resume (bool): Whether process_image_data continues from existing results instead of overwriting them.
+        progress (dict): The progress of the running or last image processing run.
+        number_of_workers (int): The number of worker processes used to process the image series.
+        flush_row_count (int): The number of processed images after which buffered result rows are written.
+        flush_interval (float): The time in seconds after which buffered result rows are written.
+        result_file_formats (list): The formats the ROI values are written in, 'csv' and/or the binary 'npy' store.
+        roi_geometries (dict): Additional named ROI geometries, mapping their names to their pixel and real bounds,
+        ROI pixel width and number of ROIs. The results of every geometry are written to a subdirectory of the results
+        directory named after the geometry.
+        stage_metrics (StageMetrics or None): The recorder of the time, bytes read and peak memory of the file read,
+        decode, ROI reduction, EXIF and write stages of every image, None if disabled.
+        stage_metrics_file_path (str or None): The path of the JSON file the stage summary is written to at the end
+        of process_image_data.
+        read_ahead_queue_depth (int): The number of image files read into memory ahead of the one being decoded when
+        processing serially, 0 reads every file when it is processed.
+        number_of_read_ahead_threads (int): The number of threads reading image files ahead.
+        roi_strip_padding (int or None): The padding in pixels of the ROI strip stack around the ROI windows, None if
+        the ROI strip stack is disabled.
+        shake_compensation_max_offset (int or None): The maximum camera shake in pixels compensated by shifting the
+        ROIs of every image by its offset to the reference image, None if shake compensation is disabled.
+        image_offsets (dict): The (y, x) pixel offsets of processed images to the reference image that are not logged
+        yet, keyed by image ID.
 
     Methods:
         set_image_series(first_image_id, last_image_id, skip_n_images=0):
             Set the image series range for processing.
 
+        set_shard(shard_index=0, number_of_shards=1):
+            Process only one of number_of_shards contiguous parts of the image series, writing partial results.
+
         set_image_name_string(image_name_string):
             Set the template string for forming image filenames with image IDs.
 
@@ -54,7 +274,14 @@ class DataExtractor:
             Set the directory where the image files are located.
 
         set_image_file_format(image_file_format):
-            Set the format of the image files ('jpg' or 'raw').
+            Set the format of the image files ('jpg', 'raw' or 'video').
+
+        set_raw_reduction_mode(raw_reduction_mode):
+            Set how RAW ROIs are reduced ('zero_filled' for backward-compatible values or 'bayer' for true
+            per-channel means).
+
+        set_jpg_decoder(jpg_decoder='pillow', reduction_factor=1):
+            Set the JPG decoder backend and decode JPG images at 1/2, 1/4 or 1/8 of their resolution if requested.
 
         set_results_dir(results_dir):
             Set the directory where the result files will be saved.
@@ -83,8 +310,51 @@ class DataExtractor:
         set_camera_position(x, y, z):
             Set the real-world position of the camera (x, y, z).
 
+        set_number_of_workers(number_of_workers):
+            Set the number of worker processes used to process the image series (1 processes serially).
+
+        set_write_buffering(flush_row_count=100, flush_interval=10.0):
+            Set after how many images or seconds buffered result rows are written to the result files.
+
+        set_result_file_formats(result_file_formats):
+            Set the formats the ROI values are written in: 'csv' text files and/or an 'npy' binary store.
+
+        set_roi_result_cache(enabled=True, max_size_mb=512):
+            Enable or disable the on-disk cache of per-image ROI values and capture times in the results directory.
+
+        invalidate_roi_result_cache():
+            Remove all entries of the ROI result cache.
+
+        set_capture_time_options(subsecond_capture_times=False, number_of_exif_threads=8):
+            Set whether capture times include fractions of a second and how many threads index them.
+
+        set_resume(resume):
+            Set whether process_image_data continues from existing results, processing the images from the first
+            missing one on.
+
+        set_stage_metrics(enabled=True, callback=None, trace_memory=False, summary_file_path=None):
+            Enable or disable the per-stage timing of process_image_data, see StageMetrics.
+
+        set_read_ahead(queue_depth=8, number_of_threads=4):
+            Set how many image files are read ahead while earlier images are decoded (0 disables reading ahead).
+
+        set_shake_compensation(enabled=True, max_offset=16):
+            Enable or disable the compensation of camera shake by phase correlation of the padded ROI windows of
+            every image with the reference image. Not supported together with named ROI geometries or for video files.
+
+        set_roi_strip_stack(enabled=True, padding=64):
+            Enable or disable the memory-mapped stack of padded pixel strips around the ROIs, from which later runs
+            with a different ROI layout inside the strips are reduced without decoding the images again. Not
+            supported together with named ROI geometries.
+
+        add_roi_geometry(name, dark_roi_pixel_bounds, light_roi_pixel_bounds, dark_roi_real_bounds,
+                         light_roi_real_bounds, roi_pixel_width, number_of_rois):
+            Register an additional named ROI geometry that is reduced from the same decoded images. Not supported
+            together with the ROI strip stack, shake compensation or video files.
+
         calc_geometrics():
-            Calculate the positions and distances of ROIs in both pixel and real-world units.
+            Calculate the positions and distances of ROIs in both pixel and real-world units and build the ROI
+            reduction plan.
 
         write_roi_real_coordinates():
             Write the real-world coordinates of ROIs to CSV files.
@@ -95,6 +365,10 @@ class DataExtractor:
         process_image_data():
             Process the image series, extract ROI values, and write the results to CSV files.
 
+        watch_image_dir(callback=None, poll_interval=0.25, idle_timeout=None, max_images=None):
+            Process new images as soon as they are completely written to the image directory and append their ROI
+            values to the CSV files.
+
         show_reference_image(channel, upscale=True):
             Show the reference image for a specified channel with optional upscaling.
 
@@ -109,6 +383,9 @@ class DataExtractor:
             self.dark_roi_real_dx = None
             self.image_dir = None
             self.image_file_format = 'jpg'
+            self.raw_reduction_mode = 'zero_filled'
+            self.jpg_decoder = 'pillow'
+            self.jpg_reduction_factor = 1
             self.results_dir = None
             self.reference_image_id = None
             self.first_image_id = None
@@ -116,6 +393,8 @@ class DataExtractor:
             self.skip_n_images = None
             self.image_name_string = None
             self.image_series = None
+            self.shard_index = 0
+            self.number_of_shards = 1
             self.dark_roi_pixel_bounds = None
             self.light_roi_pixel_bounds = None
             self.dark_roi_real_bounds = None
@@ -127,12 +406,51 @@ class DataExtractor:
             self.dark_roi_camera_real_distances = None
             self.light_roi_camera_real_distances = None
             self.height_marker_heights = None
+            self.roi_reduction_plan = None
+            self.roi_geometry_hash = None
+            self.roi_result_cache = None
+            self.subsecond_capture_times = False
+            self.number_of_exif_threads = 8
+            self._capture_time_index = None
+            self.resume = False
+            self.progress = None
+            self._raw_image_shape = None
+            self._jpg_image_shape = None
+            self._jpg_roi_reduction_plan = None
+            self._video_frame_shape = None
+            self._video_start_date_time = None
+            self._reference_image_capture_time = None
+            self._last_checkpoint_time = None
+            self._unsaved_image_count = 0
+            self.number_of_workers = 1
+            self.flush_row_count = 100
+            self.flush_interval = 10.0
+            self.result_file_formats = ['csv']
+            self.roi_geometries = {}
+            self._roi_geometry_data_extractors = None
+            self.stage_metrics = None
+            self.stage_metrics_file_path = None
+            self.read_ahead_queue_depth = 0
+            self.number_of_read_ahead_threads = 4
+            self.roi_strip_padding = None
+            self._roi_strip_stack = None
+            self.shake_compensation_max_offset = None
+            self.image_offsets = {}
+            self._phase_correlator = None
+            self._shifted_roi_reduction_plans = {}
 
     def set_image_series(self, first_image_id, last_image_id, skip_n_images=0):
         self.first_image_id = first_image_id
         self.last_image_id = last_image_id
         self.skip_n_images = skip_n_images
 
+    def set_shard(self, shard_index=0, number_of_shards=1):
+        if number_of_shards < 1 or not 0 <= shard_index < number_of_shards:
+            raise ValueError("The shard index must be at least 0 and less than the number of shards")
+        self.shard_index = shard_index
+        self.number_of_shards = number_of_shards
+        self._roi_geometry_data_extractors = None
+
     def set_image_name_string(self, image_name_string):
         self.image_name_string = image_name_string
 
@@ -143,8 +461,25 @@ class DataExtractor:
         self.image_dir = image_dir
 
     def set_image_file_format(self, image_file_format):
+        if image_file_format not in ['jpg', 'raw', 'video']:
+            raise ValueError(f"Unknown image file format '{image_file_format}'")
         self.image_file_format = image_file_format
 
+    def set_raw_reduction_mode(self, raw_reduction_mode):
+        if raw_reduction_mode not in ['zero_filled', 'bayer']:
+            raise ValueError(f"Unknown RAW reduction mode '{raw_reduction_mode}'")
+        self.raw_reduction_mode = raw_reduction_mode
+
+    def set_jpg_decoder(self, jpg_decoder='pillow', reduction_factor=1):
+        if jpg_decoder not in JPG_DECODERS:
+            raise ValueError(f"Unknown JPG decoder '{jpg_decoder}'")
+        if reduction_factor not in [1, 2, 4, 8]:
+            raise ValueError("The JPG reduction factor must be 1, 2, 4 or 8")
+        self.jpg_decoder = jpg_decoder
+        self.jpg_reduction_factor = reduction_factor
+        self._jpg_image_shape = None
+        self._jpg_roi_reduction_plan = None
+
     def set_results_dir(self, results_dir):
         self.results_dir = results_dir
         if not os.path.exists(results_dir):
@@ -175,6 +510,132 @@ class DataExtractor:
     def set_camera_position(self, x, y, z):
         self.camera_real_position = np.array([x, y, z])
 
+    def set_number_of_workers(self, number_of_workers):
+        if number_of_workers < 1:
+            raise ValueError("The number of workers must be at least 1")
+        self.number_of_workers = number_of_workers
+
+    def set_write_buffering(self, flush_row_count=100, flush_interval=10.0):
+        self.flush_row_count = flush_row_count
+        self.flush_interval = flush_interval
+
+    def set_roi_result_cache(self, enabled=True, max_size_mb=512):
+        if enabled:
+            cache_dir = os.path.join(self.results_dir, 'roi_cache')
+            self.roi_result_cache = RoiResultCache(cache_dir, int(max_size_mb * 1024 ** 2))
+        else:
+            self.roi_result_cache = None
+
+    def invalidate_roi_result_cache(self):
+        if self.roi_result_cache is not None:
+            self.roi_result_cache.invalidate()
+
+    def set_capture_time_options(self, subsecond_capture_times=False, number_of_exif_threads=8):
+        self.subsecond_capture_times = subsecond_capture_times
+        self.number_of_exif_threads = number_of_exif_threads
+        self._capture_time_index = None
+
+    def set_resume(self, resume):
+        self.resume = resume
+
+    def set_stage_metrics(self, enabled=True, callback=None, trace_memory=False, summary_file_path=None):
+        if enabled:
+            self.stage_metrics = StageMetrics(callback, trace_memory)
+        else:
+            self.stage_metrics = None
+        self.stage_metrics_file_path = summary_file_path
+
+    def set_read_ahead(self, queue_depth=8, number_of_threads=4):
+        if queue_depth < 0 or number_of_threads < 1:
+            raise ValueError("The read-ahead queue depth must not be negative and the number of threads at least 1")
+        self.read_ahead_queue_depth = queue_depth
+        self.number_of_read_ahead_threads = number_of_threads
+
+    def set_shake_compensation(self, enabled=True, max_offset=16):
+        if max_offset < 1:
+            raise ValueError("The maximum shake offset must be at least 1 pixel")
+        if enabled and self.roi_geometries:
+            raise ValueError("Shake compensation is not supported together with named ROI geometries")
+        self.shake_compensation_max_offset = max_offset if enabled else None
+        self._phase_correlator = None
+
+    def set_roi_strip_stack(self, enabled=True, padding=64):
+        if padding < 0:
+            raise ValueError("The ROI strip padding must not be negative")
+        if enabled and self.roi_geometries:
+            raise ValueError("The ROI strip stack is not supported together with named ROI geometries")
+        self.roi_strip_padding = padding if enabled else None
+
+    def set_result_file_formats(self, result_file_formats):
+        for result_file_format in result_file_formats:
+            if result_file_format not in ['csv', 'npy']:
+                raise ValueError(f"Unknown result file format '{result_file_format}'")
+        self.result_file_formats = list(result_file_formats)
+
+    def add_roi_geometry(self, name, dark_roi_pixel_bounds, light_roi_pixel_bounds, dark_roi_real_bounds,
+                         light_roi_real_bounds, roi_pixel_width, number_of_rois):
+        """
+        Register an additional named ROI geometry. Every decoded image is reduced against the ROI geometry set with the
+        set_*_bounds and set_roi_parameters methods (if any) and all named geometries in one pass. The results of a
+        named geometry, including its ROI coordinates and distances, are written to results_dir/name.
+
+        The images are then processed by process_group_image_data like the experiments of a batch run. It supports
+        the worker pool, read-ahead (without workers), the ROI result cache, resume, checkpoints and all result file
+        formats, but not the ROI strip stack, shake compensation and video files, which raise a ValueError.
+
+        Parameters:
+            name (str): The name of the geometry, used as name of its results subdirectory.
+            dark_roi_pixel_bounds (tuple): The lower and upper pixel bounds of the dark ROIs.
+            light_roi_pixel_bounds (tuple): The lower and upper pixel bounds of the light ROIs.
+            dark_roi_real_bounds (tuple): The lower and upper real-world bounds of the dark ROIs.
+            light_roi_real_bounds (tuple): The lower and upper real-world bounds of the light ROIs.
+            roi_pixel_width (int): The width of each ROI in pixels.
+            number_of_rois (int): The number of ROIs.
+        """
+        if self.roi_strip_padding is not None or self.shake_compensation_max_offset is not None:
+            raise ValueError("Named ROI geometries are not supported together with the ROI strip stack or shake "
+                             "compensation")
+        if self.image_file_format == 'video':
+            raise ValueError("Named ROI geometries are not supported for video files")
+        self.roi_geometries[name] = {'dark_roi_pixel_bounds': tuple(dark_roi_pixel_bounds),
+                                     'light_roi_pixel_bounds': tuple(light_roi_pixel_bounds),
+                                     'dark_roi_real_bounds': tuple(dark_roi_real_bounds),
+                                     'light_roi_real_bounds': tuple(light_roi_real_bounds),
+                                     'roi_pixel_width': roi_pixel_width,
+                                     'number_of_rois': number_of_rois}
+        self._roi_geometry_data_extractors = None
+
+    def _get_roi_geometry_data_extractors(self):
+        """
+        Return one DataExtractor per named ROI geometry, sharing all settings and the capture time index of this
+        extractor but writing to the results subdirectory of the geometry.
+        """
+        if self._roi_geometry_data_extractors is None:
+            capture_time_index = self._get_capture_time_index() if self.roi_geometries else None
+            self._roi_geometry_data_extractors = []
+            for name, roi_geometry in self.roi_geometries.items():
+                data_extractor = copy.copy(self)
+                data_extractor.roi_geometries = {}
+                data_extractor._roi_geometry_data_extractors = []
+                data_extractor._capture_time_index = capture_time_index
+                data_extractor.set_results_dir(os.path.join(self.results_dir, name))
+                data_extractor.set_dark_roi_pixel_bounds(*roi_geometry['dark_roi_pixel_bounds'])
+                data_extractor.set_light_roi_pixel_bounds(*roi_geometry['light_roi_pixel_bounds'])
+                data_extractor.set_dark_roi_real_bounds(*roi_geometry['dark_roi_real_bounds'])
+                data_extractor.set_light_roi_real_bounds(*roi_geometry['light_roi_real_bounds'])
+                data_extractor.set_roi_parameters(roi_geometry['roi_pixel_width'], roi_geometry['number_of_rois'])
+                data_extractor.calc_geometrics()
+                self._roi_geometry_data_extractors.append(data_extractor)
+        return self._roi_geometry_data_extractors
+
+    def _has_primary_roi_geometry(self):
+        return self.dark_roi_pixel_bounds is not None
+
+    def _get_group_data_extractors(self):
+        # The extractors of all ROI geometries reduced from the same decoded images
+        data_extractors = [self] if self._has_primary_roi_geometry() else []
+        return data_extractors + self._get_roi_geometry_data_extractors()
+
     def _calc_roi_pixel_positions(self):
         print("Calculating ROI pixel positions...")
         self.dark_roi_pixel_coordinates, self.dark_roi_pixel_dx, self.dark_roi_pixel_dy = divide_line_2d(
@@ -205,9 +666,11 @@ class DataExtractor:
         file_path = self._get_image_file_path(image_id)
         image_array = None
         if self.image_file_format == 'jpg':
-            image_array = get_channel_arrays_from_jpg_file(file_path)
+            image_array = get_channel_arrays_from_jpg_file(file_path, decoder=self.jpg_decoder)
         elif self.image_file_format == 'raw':
             image_array = get_channel_arrays_from_raw_file(file_path)
+        elif self.image_file_format == 'video':
+            image_array = next(iter_video_frames(file_path, [image_id]))[2]
         if channel == 'all':
             return image_array
         return image_array[channel]
@@ -218,25 +681,34 @@ class DataExtractor:
         return file_path
 
     def _extract_pixel_values(self, image_array,  roi_pixel_coordinates, roi_pixel_dy):
-
-        roi_pixel_values = []
-        for coord in roi_pixel_coordinates:
-            y_bottom = coord[1]
-            y_top = y_bottom + roi_pixel_dy
-            x_left = coord[0] - int(self.roi_pixel_width / 2)
-            x_right = x_left + self.roi_pixel_width
-            roi = image_array[y_top:y_bottom, x_left:x_right]
-            roi_mean = roi.mean()
-            roi_pixel_values.append(roi_mean)
-
-        return roi_pixel_values
+        roi_pixel_boxes = calc_roi_pixel_boxes(roi_pixel_coordinates, roi_pixel_dy, self.roi_pixel_width)
+        roi_reduction_plan = RoiReductionPlan([roi_pixel_boxes])
+        roi_pixel_values = roi_reduction_plan.reduce(image_array[np.newaxis])[0, 0]
+        return list(roi_pixel_values)
+
+    def _build_roi_reduction_plan(self):
+        dark_roi_pixel_boxes = calc_roi_pixel_boxes(self.dark_roi_pixel_coordinates, self.dark_roi_pixel_dy,
+                                                    self.roi_pixel_width)
+        light_roi_pixel_boxes = calc_roi_pixel_boxes(self.light_roi_pixel_coordinates, self.light_roi_pixel_dy,
+                                                     self.roi_pixel_width)
+        self.roi_reduction_plan = RoiReductionPlan([dark_roi_pixel_boxes, light_roi_pixel_boxes])
+        self.roi_geometry_hash = hashlib.sha1(self.roi_reduction_plan.roi_pixel_boxes.tobytes()).hexdigest()
+        self._jpg_roi_reduction_plan = None
 
     def calc_geometrics(self):
+        self._roi_geometry_data_extractors = None
+        if not self._has_primary_roi_geometry() and self.roi_geometries:
+            return
         self._calc_roi_pixel_positions()
         self._calc_roi_real_positions()
         self._calc_roi_camera_real_distances()
+        self._build_roi_reduction_plan()
 
     def write_roi_real_coordinates(self):
+        for data_extractor in self._get_roi_geometry_data_extractors():
+            data_extractor.write_roi_real_coordinates()
+        if not self._has_primary_roi_geometry():
+            return
         dark_roi_real_center_coordinates = self.dark_roi_real_coordinates + np.array([0, 0, self.light_roi_real_dz / 2])
         light_roi_real_center_coordinates = self.light_roi_real_coordinates + np.array(
             [0, 0, self.light_roi_real_dz / 2])
@@ -246,6 +718,10 @@ class DataExtractor:
         np.savetxt(file_2_path, light_roi_real_center_coordinates, header='X, Y, Z', delimiter=',')
 
     def write_roi_camera_to_roi_real_distances(self):
+        for data_extractor in self._get_roi_geometry_data_extractors():
+            data_extractor.write_roi_camera_to_roi_real_distances()
+        if not self._has_primary_roi_geometry():
+            return
         file_1_path = os.path.join(self.results_dir, 'dark_roi_to_camera_real_distances.csv')
         file_2_path = os.path.join(self.results_dir, 'light_roi_to_camera_real_distances.csv')
         np.savetxt(file_1_path, self.dark_roi_camera_real_distances)
@@ -253,52 +729,668 @@ class DataExtractor:
 
 
     def process_image_data(self):
+        from tqdm import tqdm
+
+        if self.image_file_format == 'video' and self.shake_compensation_max_offset is not None:
+            raise ValueError("Shake compensation is not supported for video files")
+        if self.roi_geometries:
+            # All ROI geometries are reduced from the same decoded images in one pass
+            data_extractors = self._get_group_data_extractors()
+            if self.number_of_workers == 1:
+                process_group_image_data(data_extractors)
+            else:
+                with ProcessPoolExecutor(max_workers=self.number_of_workers, initializer=_init_group_worker,
+                                         initargs=([data_extractors],)) as executor:
+                    process_group_image_data(data_extractors, executor, 0, self.number_of_workers)
+            return
+
+        # Read-ahead images are read completely anyway, their capture times are parsed from the same bytes
+        image_ids = self._prepare_image_processing(index_capture_times=not self._uses_read_ahead())
+        with ExitStack() as stack:
+            result_writers = self._create_result_writers(stack, resume=bool(self.progress['resumed_images']))
+            self._roi_strip_stack = self._open_roi_strip_stack()
+            stack.callback(self._close_roi_strip_stack)
+            image_offset_writer = None
+            if self.shake_compensation_max_offset is not None:
+                image_offset_writer = self._create_image_offset_writer(stack,
+                                                                       resume=bool(self.progress['resumed_images']))
+            print("Processing images...")
+            image_results = self._iter_image_results(image_ids)
+            for image_id, (capture_time, roi_values) in tqdm(image_results, total=len(self.image_series),
+                                                             initial=self.progress['resumed_images']):
+                self._write_image_result(result_writers, image_id, capture_time, roi_values)
+                if image_offset_writer is not None:
+                    # Images taken from the ROI result cache have no logged offset
+                    image_offset_writer.writerow([image_id, *self.image_offsets.pop(image_id, ('', ''))])
+        self._finish_image_processing()
+
+    def _prepare_image_processing(self, index_capture_times=True):
+        """
+        Index the capture times of the image series (only of the reference image unless index_capture_times is set),
+        determine the images already processed when resuming and reset the progress.
+
+        Returns:
+            list: The IDs of the images that still have to be processed.
+        """
         self.image_series = range(self.first_image_id, self.last_image_id, self.skip_n_images + 1)
         print(f"Processing {self.last_image_id - self.first_image_id} images...")
+        if self.number_of_shards > 1:
+            # Contiguous parts keep the files (or video frames) read by a shard together
+            number_of_images = len(self.image_series)
+            self.image_series = self.image_series[number_of_images * self.shard_index // self.number_of_shards:
+                                                  number_of_images * (self.shard_index + 1) // self.number_of_shards]
+            print(f"Processing shard {self.shard_index} of {self.number_of_shards} with {len(self.image_series)} "
+                  f"images...")
+
+        if self.image_file_format == 'video':
+            # The capture times of the frames are given by their presentation time stamps instead of EXIF data
+            self._reference_image_capture_time = next(self._iter_video_frame_capture_times([self.reference_image_id]))
+        else:
+            capture_time_index = self._get_capture_time_index()
+            image_file_paths = [self._get_image_file_path(image_id) for image_id in self.image_series]
+            reference_image_file_path = self._get_image_file_path(self.reference_image_id)
+            with measure_stage(self.stage_metrics, 'exif_index'):
+                capture_time_index.update([reference_image_file_path] +
+                                          (image_file_paths if index_capture_times else []),
+                                          self.number_of_exif_threads)
+            self._reference_image_capture_time = capture_time_index.get(reference_image_file_path)
+
+        completed_image_ids = self._get_completed_image_ids() if self.resume else set()
+        image_ids = [image_id for image_id in self.image_series if image_id not in completed_image_ids]
+        self.progress = {'total_images': len(self.image_series), 'processed_images': len(completed_image_ids),
+                         'resumed_images': len(completed_image_ids), 'last_processed_image_id': None, 'complete': False,
+                         'processing_time': 0.0}
+        if completed_image_ids:
+            print(f"Resuming after {len(completed_image_ids)} already processed images...")
+        self._last_checkpoint_time = time.monotonic()
+        self._unsaved_image_count = 0
+        return image_ids
+
+    def _write_image_result(self, result_writers, image_id, capture_time, roi_values):
+        time_delta = capture_time - self._reference_image_capture_time
+        with measure_stage(self.stage_metrics, 'write', image_id):
+            for result_writer in result_writers:
+                result_writer.write_roi_values(image_id, capture_time, time_delta, roi_values)
+
+        self.progress['processed_images'] += 1
+        self.progress['last_processed_image_id'] = image_id
+        self._unsaved_image_count += 1
+        if (self._unsaved_image_count >= self.flush_row_count or
+                time.monotonic() - self._last_checkpoint_time >= self.flush_interval):
+            for result_writer in result_writers:
+                result_writer.flush()
+            if self._roi_strip_stack is not None:
+                self._roi_strip_stack.flush()
+            self._write_checkpoint()
+            self._last_checkpoint_time = time.monotonic()
+            self._unsaved_image_count = 0
+
+    def _finish_image_processing(self):
+        self.progress['complete'] = True
+        self._write_checkpoint()
+        # Capture times read while processing, e.g. from read-ahead image bytes
+        if self.image_file_format != 'video':
+            self._get_capture_time_index().save()
+        if self.stage_metrics is not None and self.stage_metrics_file_path is not None:
+            self.stage_metrics.write_summary(self.stage_metrics_file_path)
+        print("All images processed!")
 
-        reference_image_file_path = self._get_image_file_path(self.reference_image_id)
-        reference_image_capture_time = get_capture_date_time(reference_image_file_path)
-        
+    def watch_image_dir(self, callback=None, poll_interval=0.25, idle_timeout=None, max_images=None):
+        """
+        Watch the image directory and process every new image of the image series as soon as it is completely
+        written, i.e. its size and modification time did not change between two polls. The reference image is waited
+        for in the same way. The ROI values are appended to the CSV value files right away, existing value files are
+        continued without the images missing in some of them. Watching stops after max_images new images, after
+        idle_timeout seconds without a new image, or on KeyboardInterrupt. A live DataAnalysis continuing the value
+        files of an earlier run has to be resumed with DataAnalysis.resume_incremental_analysis.
+
+        Parameters:
+            callback (callable or None): Called as callback(image_id, capture_time, time_delta, roi_values) for every
+            processed image, roi_values being an array of shape (channel, face, ROI).
+            poll_interval (float): The time in seconds between two scans of the image directory.
+            idle_timeout (float or None): The time in seconds without new images after which watching stops.
+            max_images (int or None): The number of new images after which watching stops.
+        """
+        if self.number_of_shards > 1:
+            raise ValueError("A growing image series cannot be split into shards")
+        image_name_pattern = self._get_image_name_pattern()
+        roi_value_file_paths = {}
+        written_image_ids = []
         for channel in range(3):
-            dark_file_path = os.path.join(self.results_dir, f'{self.experiment_name}_dark_values_channel_{channel}.csv')
-            light_file_path = os.path.join(self.results_dir, f'{self.experiment_name}_light_values_channel_{channel}.csv')
-            self._create_roi_value_file(dark_file_path, self.dark_roi_real_coordinates, self.dark_roi_real_dz, self.dark_roi_camera_real_distances)
-            self._create_roi_value_file(light_file_path, self.light_roi_real_coordinates, self.light_roi_real_dz, self.light_roi_camera_real_distances)
-            print(f"Channel {channel} ROI value files created!")
-
-        print("Processing images...")
-        for image_id in tqdm(self.image_series):
-            all_channel_image_array = self._get_image_data(image_id)
-            image_file_path = self._get_image_file_path(image_id)
-            capture_time = get_capture_date_time(image_file_path)
-            time_delta = capture_time - reference_image_capture_time
-
+            for face, cb_face in enumerate(['dark', 'light']):
+                file_path = self._get_roi_value_file_path(cb_face, channel)
+                header_rows = self._get_roi_value_file_header_rows(cb_face)
+                if not os.path.exists(file_path):
+                    with open(file_path, 'w') as csvfile:
+                        csv.writer(csvfile).writerows(header_rows)
+                written_image_ids.append(set(get_csv_result_image_ids(file_path, header_rows)))
+                roi_value_file_paths[(channel, face)] = file_path
+        # Images written to only some of the files and partial rows of an interrupted run are removed
+        processed_image_ids = set.intersection(*written_image_ids)
+        for file_path in roi_value_file_paths.values():
+            keep_csv_result_rows(file_path, len(header_rows), processed_image_ids)
+
+        print(f"Watching {self.image_dir} for new images...")
+        capture_time_index = self._get_capture_time_index()
+        reference_image_file_path = self._get_image_file_path(self.reference_image_id)
+        reference_image_capture_time = None
+        reference_image_file_signature = None
+        file_signatures = {}
+        new_image_count = 0
+        last_new_image_time = time.monotonic()
+        try:
+            with CsvResultWriter(roi_value_file_paths, flush_row_count=1) as result_writer:
+                while max_images is None or new_image_count < max_images:
+                    ready_image_ids = []
+                    for filename in os.listdir(self.image_dir):
+                        match = image_name_pattern.match(filename)
+                        if match is None:
+                            continue
+                        image_id = int(match.group(1))
+                        if filename != self.image_name_string.format(image_id):
+                            continue
+                        if image_id in processed_image_ids or not self._is_in_image_series(image_id):
+                            continue
+                        file_stat = os.stat(os.path.join(self.image_dir, filename))
+                        file_signature = (file_stat.st_size, file_stat.st_mtime_ns)
+                        if file_signatures.get(image_id) == file_signature:
+                            ready_image_ids.append(image_id)
+                        file_signatures[image_id] = file_signature
+
+                    if reference_image_capture_time is None and os.path.exists(reference_image_file_path):
+                        # The reference image is only read once it is completely written, like the other images
+                        file_stat = os.stat(reference_image_file_path)
+                        file_signature = (file_stat.st_size, file_stat.st_mtime_ns)
+                        if (self.reference_image_id in processed_image_ids or
+                                file_signature == reference_image_file_signature):
+                            reference_image_capture_time = capture_time_index.get(reference_image_file_path)
+                        reference_image_file_signature = file_signature
+                    if reference_image_capture_time is not None:
+                        for image_id in sorted(ready_image_ids)[:None if max_images is None else
+                                                                 max_images - new_image_count]:
+                            capture_time, roi_values = self._process_image(image_id)
+                            time_delta = capture_time - reference_image_capture_time
+                            result_writer.write_roi_values(image_id, capture_time, time_delta, roi_values)
+                            processed_image_ids.add(image_id)
+                            new_image_count += 1
+                            last_new_image_time = time.monotonic()
+                            if callback is not None:
+                                callback(image_id, capture_time, time_delta, roi_values)
+
+                    if idle_timeout is not None and time.monotonic() - last_new_image_time > idle_timeout:
+                        break
+                    if max_images is None or new_image_count < max_images:
+                        time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            capture_time_index.save()
+        print(f"Stopped watching, {new_image_count} new images processed!")
+
+    def _get_image_name_pattern(self):
+        match = re.match(r'^(.*?)\{[^}]*\}(.*)$', self.image_name_string)
+        return re.compile(re.escape(match.group(1)) + r'(\d+)' + re.escape(match.group(2)) + '$')
+
+    def _is_in_image_series(self, image_id):
+        if self.first_image_id is not None and image_id < self.first_image_id:
+            return False
+        if self.last_image_id is not None and image_id >= self.last_image_id:
+            return False
+        if self.first_image_id is not None and self.skip_n_images is not None:
+            return (image_id - self.first_image_id) % (self.skip_n_images + 1) == 0
+        return True
+
+    def _process_image(self, image_id, image_bytes=None):
+        """
+        Decode a single image, read from its file unless its contents are given as image_bytes, and reduce it to its
+        ROI mean values.
+
+        Returns:
+            tuple: The capture time of the image and an array of shape (channel, face, ROI) holding the dark (face 0)
+            and light (face 1) ROI mean values.
+        """
+        image_file_path = self._get_image_file_path(image_id)
+        image_shape = self._get_image_shape()
+        roi_reduction_plan = self._get_image_roi_reduction_plan()
+        windows = roi_reduction_plan.windows(image_shape)
+        if self.shake_compensation_max_offset is not None:
+            # The padded box around the ROI windows is read to register it with the reference image
+            registration_box = self._get_registration_box()
+            windows = [registration_box]
+        roi_strip_stack = self._roi_strip_stack
+        if roi_strip_stack is not None and roi_strip_stack.has_strip(image_id, image_file_path):
+            # The windows are sliced from the memory-mapped strip of the image, its file is not read
+            with measure_stage(self.stage_metrics, 'strip_read', image_id):
+                window_data = roi_strip_stack.get_windows(image_id, windows)
+        else:
+            # The file is read into memory first, so that the time spent on I/O and on decoding can be told apart
+            if image_bytes is None:
+                with measure_stage(self.stage_metrics, 'file_read', image_id) as record:
+                    image_bytes = read_file_bytes(image_file_path)
+                    record['bytes_read'] = len(image_bytes)
+            # Only the bounding windows of the dark and light ROIs (or their strip) are decoded (RAW) or copied
+            with measure_stage(self.stage_metrics, 'decode', image_id):
+                if roi_strip_stack is None:
+                    window_data = self._read_image_windows(io.BytesIO(image_bytes), windows)
+                else:
+                    strip_data = self._read_image_windows(io.BytesIO(image_bytes), [roi_strip_stack.strip_box])[0]
+                    roi_strip_stack.put_strip(image_id, strip_data)
+                    window_data = roi_strip_stack.get_windows(image_id, windows)
+        if self.shake_compensation_max_offset is not None:
+            with measure_stage(self.stage_metrics, 'registration', image_id):
+                image_offset = self._estimate_image_offset(window_data[0], registration_box)
+                self.image_offsets[image_id] = image_offset
+                roi_reduction_plan = self._get_shifted_roi_reduction_plan(image_offset)
+                y_offset, x_offset = registration_box[0], registration_box[2]
+                window_data = [_crop_window(window_data[0], (y_start - y_offset, y_stop - y_offset,
+                                                             x_start - x_offset, x_stop - x_offset))
+                               for y_start, y_stop, x_start, x_stop in roi_reduction_plan.windows(image_shape)]
+        with measure_stage(self.stage_metrics, 'roi_reduction', image_id):
+            roi_values = self._reduce_image_windows(window_data, image_shape, roi_reduction_plan)
+        with measure_stage(self.stage_metrics, 'exif', image_id):
+            capture_time = self._get_capture_time_index().get(image_file_path, image_bytes)
+        return capture_time, roi_values
+
+    def _read_image_windows(self, image_file, windows):
+        """
+        Read (y_start, y_stop, x_start, x_stop) pixel windows of an image file path or file object in the form
+        expected by _reduce_image_windows: channel arrays, or (value_array, channel_index_array) tuples in the RAW
+        'bayer' mode.
+        """
+        if self.image_file_format == 'raw':
+            if self.raw_reduction_mode == 'bayer':
+                return get_bayer_windows_from_raw_file(image_file, windows)
+            return get_channel_arrays_from_raw_file(image_file, windows)
+        return get_channel_arrays_from_jpg_file(image_file, windows, self.jpg_decoder, self.jpg_reduction_factor)
+
+    def _reduce_image_windows(self, window_data, image_shape, roi_reduction_plan=None):
+        if roi_reduction_plan is None:
+            roi_reduction_plan = self._get_image_roi_reduction_plan()
+        if self.image_file_format == 'raw' and self.raw_reduction_mode == 'bayer':
+            return roi_reduction_plan.reduce_bayer_windows(window_data, image_shape)
+        return roi_reduction_plan.reduce_windows(window_data, image_shape)
+
+    def _get_registration_box(self):
+        # Inside a ROI strip stack the strips are the largest boxes available without decoding again
+        if self._roi_strip_stack is not None:
+            return self._roi_strip_stack.strip_box
+        image_shape = self._get_image_shape()
+        return calc_roi_strip_box(self._get_image_roi_reduction_plan().windows(image_shape), image_shape,
+                                  self.shake_compensation_max_offset)
+
+    def _get_phase_correlator(self, registration_box):
+        if self._phase_correlator is None or self._phase_correlator[0] != registration_box:
+            reference_window = self._read_image_windows(self._get_image_file_path(self.reference_image_id),
+                                                        [registration_box])[0]
+            max_offset = (self.shake_compensation_max_offset, self.shake_compensation_max_offset)
+            self._phase_correlator = (registration_box, PhaseCorrelator(reference_window, max_offset))
+        return self._phase_correlator[1]
+
+    def _estimate_image_offset(self, registration_window, registration_box):
+        """
+        Estimate the (y, x) pixel offset of an image to the reference image from its registration window, limited so
+        that the shifted ROI windows stay inside the registration box.
+        """
+        dy, dx = self._get_phase_correlator(registration_box).estimate_offset(registration_window)
+        windows = [window for window in self._get_image_roi_reduction_plan().windows(self._get_image_shape())
+                   if window[1] > window[0] and window[3] > window[2]]
+        dy = min(max(dy, registration_box[0] - min(window[0] for window in windows)),
+                 registration_box[1] - max(window[1] for window in windows))
+        dx = min(max(dx, registration_box[2] - min(window[2] for window in windows)),
+                 registration_box[3] - max(window[3] for window in windows))
+        return dy, dx
+
+    def _get_shifted_roi_reduction_plan(self, image_offset):
+        if image_offset == (0, 0):
+            return self._get_image_roi_reduction_plan()
+        if image_offset not in self._shifted_roi_reduction_plans:
+            dy, dx = image_offset
+            self._shifted_roi_reduction_plans[image_offset] = RoiReductionPlan(
+                self._get_image_roi_reduction_plan().roi_pixel_boxes + np.array([dy, dy, dx, dx]))
+        return self._shifted_roi_reduction_plans[image_offset]
+
+    def _create_image_offset_writer(self, stack, resume=False):
+        file_path = os.path.join(self.results_dir, f'{self._get_result_name()}_image_offsets.csv')
+        append = resume and os.path.exists(file_path)
+        image_offset_file = stack.enter_context(open(file_path, 'a' if append else 'w', newline=''))
+        image_offset_writer = csv.writer(image_offset_file)
+        if not append:
+            image_offset_writer.writerow(['Image ID', 'Offset y [px]', 'Offset x [px]'])
+        return image_offset_writer
+
+    def _get_image_shape(self):
+        if self.image_file_format == 'raw':
+            return self._get_raw_image_shape()
+        if self.image_file_format == 'video':
+            return self._get_video_frame_shape()
+        return self._get_jpg_image_shape()
+
+    def _get_image_roi_reduction_plan(self):
+        if self.image_file_format in ['raw', 'video']:
+            return self.roi_reduction_plan
+        return self._get_jpg_roi_reduction_plan()
+
+    def _get_capture_time_index(self):
+        if self._capture_time_index is None:
+            index_file_path = None
+            if self.results_dir is not None:
+                index_file_path = os.path.join(self.results_dir, f'{self._get_result_name()}_capture_times.json')
+            self._capture_time_index = CaptureTimeIndex(index_file_path, self.subsecond_capture_times)
+        return self._capture_time_index
+
+    def _get_raw_image_shape(self):
+        if self._raw_image_shape is None:
+            self._raw_image_shape = get_raw_image_shape(self._get_image_file_path(self.reference_image_id))
+        return self._raw_image_shape
+
+    def _get_video_frame_shape(self):
+        if self._video_frame_shape is None:
+            self._video_frame_shape = get_video_frame_shape(self._get_image_file_path(self.reference_image_id))
+        return self._video_frame_shape
+
+    def _get_video_start_date_time(self):
+        if self._video_start_date_time is None:
+            self._video_start_date_time = get_video_start_date_time(
+                self._get_image_file_path(self.reference_image_id))
+        return self._video_start_date_time
+
+    def _iter_video_frame_capture_times(self, frame_indices):
+        for _, frame_time, _ in iter_video_frames(self._get_image_file_path(self.reference_image_id), frame_indices,
+                                                  windows=[]):
+            yield self._get_video_start_date_time() + frame_time
+
+    def _get_jpg_image_shape(self):
+        if self._jpg_image_shape is None:
+            self._jpg_image_shape = get_jpg_image_shape(self._get_image_file_path(self.reference_image_id),
+                                                        self.jpg_decoder, self.jpg_reduction_factor)
+        return self._jpg_image_shape
+
+    def _get_jpg_roi_reduction_plan(self):
+        if self.jpg_reduction_factor == 1:
+            return self.roi_reduction_plan
+        if self._jpg_roi_reduction_plan is None:
+            self._jpg_roi_reduction_plan = RoiReductionPlan(self.roi_reduction_plan.roi_pixel_boxes //
+                                                            self.jpg_reduction_factor)
+        return self._jpg_roi_reduction_plan
+
+    def _iter_image_results(self, image_ids):
+        """
+        Return an iterator over (image_id, (capture_time, roi_values)) for every image ID in the given order, taking
+        the results of unchanged images from the ROI result cache if it is enabled.
+        """
+        if not self._uses_roi_result_cache():
+            return self._iter_processed_image_results(image_ids)
+        cached_image_results = self._get_cached_image_results(image_ids)
+        return self._iter_cached_and_processed_image_results(image_ids, cached_image_results,
+                                                             self._get_roi_result_cache_key())
+
+    def _uses_roi_result_cache(self):
+        # All frames of a video share one file, which cannot identify their cached results
+        return self.roi_result_cache is not None and self.image_file_format != 'video'
+
+    def _get_cached_image_results(self, image_ids):
+        """
+        Return a dictionary mapping the IDs of the images found in the ROI result cache to their (capture_time,
+        roi_values), empty if the cache is disabled.
+        """
+        if not self._uses_roi_result_cache():
+            return {}
+        cache_key = self._get_roi_result_cache_key()
+        cached_image_results = {}
+        for image_id in image_ids:
+            image_result = self.roi_result_cache.get(self._get_image_file_path(image_id), cache_key)
+            if image_result is not None:
+                cached_image_results[image_id] = image_result
+        print(f"{len(cached_image_results)} of {len(image_ids)} images found in the ROI result cache")
+        return cached_image_results
+
+    def _iter_cached_and_processed_image_results(self, image_ids, cached_image_results, cache_key):
+        missing_image_ids = [image_id for image_id in image_ids if image_id not in cached_image_results]
+        processed_image_results = self._iter_processed_image_results(missing_image_ids)
+        for image_id in image_ids:
+            if image_id in cached_image_results:
+                yield image_id, cached_image_results.pop(image_id)
+                continue
+            image_id, (capture_time, roi_values) = next(processed_image_results)
+            self.roi_result_cache.put(self._get_image_file_path(image_id), cache_key, capture_time, roi_values)
+            yield image_id, (capture_time, roi_values)
+
+    def _get_roi_result_cache_key(self):
+        cache_key = (f"{self.roi_geometry_hash}|{self.image_file_format}|{self.raw_reduction_mode}|"
+                     f"{self.subsecond_capture_times}|{self.jpg_decoder}|{self.jpg_reduction_factor}")
+        # Keys of runs without shake compensation stay those of earlier versions
+        if self.shake_compensation_max_offset is not None:
+            cache_key += f"|{self.shake_compensation_max_offset}"
+        return cache_key
+
+    def _iter_processed_image_results(self, image_ids):
+        """
+        Yield (image_id, (capture_time, roi_values)) for every image ID in the given order and mark the strips stored
+        in the ROI strip stack as written.
+        """
+        for image_id, image_result in self._iter_decoded_image_results(image_ids):
+            if self._roi_strip_stack is not None:
+                self._roi_strip_stack.mark_written(image_id, self._get_image_file_path(image_id))
+            yield image_id, image_result
+
+    def _iter_decoded_image_results(self, image_ids):
+        """
+        Yield (image_id, (capture_time, roi_values)) for every image ID in the given order. With more than one worker
+        the images are decoded and reduced in a process pool while the caller consumes (e.g. writes) earlier results,
+        otherwise the image files are read ahead by a thread pool if enabled. The frames of a video file are decoded
+        in order by the multithreaded video decoder of the main process.
+        """
+        if self.image_file_format == 'video':
+            yield from self._iter_video_frame_results(image_ids)
+            return
+
+        if self._uses_read_ahead():
+            # Images with a stored ROI strip are not read at all
+            roi_strip_image_ids = set()
+            if self._roi_strip_stack is not None:
+                roi_strip_image_ids = {image_id for image_id in image_ids if self._roi_strip_stack.has_strip(
+                    image_id, self._get_image_file_path(image_id))}
+            image_file_bytes = iter_read_ahead([self._get_image_file_path(image_id) for image_id in image_ids
+                                                if image_id not in roi_strip_image_ids],
+                                               self.read_ahead_queue_depth, self.number_of_read_ahead_threads)
+            for image_id in image_ids:
+                if image_id in roi_strip_image_ids:
+                    yield image_id, self._process_image(image_id)
+                    continue
+                # Only the time spent waiting for a file that was not read ahead in time is measured
+                with measure_stage(self.stage_metrics, 'file_read', image_id) as record:
+                    image_bytes = next(image_file_bytes)
+                    record['bytes_read'] = len(image_bytes)
+                yield image_id, self._process_image(image_id, image_bytes)
+            return
+
+        if self.number_of_workers == 1:
+            for image_id in image_ids:
+                yield image_id, self._process_image(image_id)
+            return
+
+        chunksize = max(1, len(image_ids) // (self.number_of_workers * 8))
+        with ProcessPoolExecutor(max_workers=self.number_of_workers, initializer=_init_worker,
+                                 initargs=(self,)) as executor:
+            for image_id, (image_result, stage_records, image_offset) in zip(
+                    image_ids, executor.map(_process_image_in_worker, image_ids, chunksize=chunksize)):
+                if stage_records is not None:
+                    self.stage_metrics.add_records(stage_records)
+                if image_offset is not None:
+                    self.image_offsets[image_id] = image_offset
+                yield image_id, image_result
+
+    def _iter_video_frame_results(self, image_ids):
+        image_shape = self._get_image_shape()
+        windows = self.roi_reduction_plan.windows(image_shape)
+        video_start_date_time = self._get_video_start_date_time()
+        video_frames = iter_video_frames(self._get_image_file_path(self.reference_image_id), image_ids, windows)
+        for image_id in image_ids:
+            with measure_stage(self.stage_metrics, 'decode', image_id):
+                _, frame_time, window_data = next(video_frames)
+            with measure_stage(self.stage_metrics, 'roi_reduction', image_id):
+                roi_values = self._reduce_image_windows(window_data, image_shape)
+            yield image_id, (video_start_date_time + frame_time, roi_values)
+
+    def _open_roi_strip_stack(self):
+        """
+        Open the ROI strip stack of the image series if it contains the current ROI windows, otherwise create a new
+        one around them. Returns None if the ROI strip stack is disabled or the images are video frames.
+        """
+        if self.roi_strip_padding is None or self.image_file_format == 'video':
+            return None
+        image_shape = self._get_image_shape()
+        windows = self._get_image_roi_reduction_plan().windows(image_shape)
+        roi_strip_stack = RoiStripStack(os.path.join(self.results_dir, f'{self._get_result_name()}_roi_strips.npy'),
+                                        os.path.join(self.results_dir, f'{self._get_result_name()}_roi_strips.npz'))
+        settings_key = (f"{os.path.abspath(self.image_dir)}|{self.image_name_string}|{self.image_file_format}|"
+                        f"{self.raw_reduction_mode}|{self.jpg_decoder}|{self.jpg_reduction_factor}")
+        if roi_strip_stack.open(self.image_series, settings_key, image_shape, windows):
+            print("Reducing the ROIs from the ROI strip stack...")
+            return roi_strip_stack
+
+        print("Creating the ROI strip stack...")
+        strip_box = calc_roi_strip_box(windows, image_shape, self.roi_strip_padding)
+        # The strip of the reference image gives the shape and dtype of all strips
+        strip_data = self._read_image_windows(self._get_image_file_path(self.reference_image_id), [strip_box])[0]
+        roi_strip_stack.create(self.image_series, settings_key, image_shape, strip_box, strip_data)
+        return roi_strip_stack
+
+    def _close_roi_strip_stack(self):
+        if self._roi_strip_stack is not None:
+            self._roi_strip_stack.flush()
+            self._roi_strip_stack = None
+
+    def _uses_read_ahead(self):
+        # The worker processes of a process pool read their image files concurrently already
+        return self.read_ahead_queue_depth > 0 and self.number_of_workers == 1
+
+    def _get_completed_image_ids(self):
+        """
+        Return the IDs of the images at the start of the image series that are completely written to all result files
+        of a previous run with the same ROI geometry, and drop the rows of all other images from the CSV value files.
+        """
+        checkpoint_file_path = self._get_checkpoint_file_path()
+        if os.path.exists(checkpoint_file_path):
+            with open(checkpoint_file_path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            if checkpoint['roi_geometry_key'] != self._get_roi_result_cache_key():
+                raise ValueError("The ROI geometry changed since the last run, the results cannot be resumed")
+
+        completed_image_ids = set(self.image_series)
+        roi_value_file_paths = [self._get_roi_value_file_path(cb_face, channel)
+                                for channel in range(3) for cb_face in ['dark', 'light']]
+        if 'csv' in self.result_file_formats:
+            if not all(os.path.exists(file_path) for file_path in roi_value_file_paths):
+                return set()
             for channel in range(3):
-                image_array = all_channel_image_array[channel]
-                dark_file_path = os.path.join(self.results_dir, f'{self.experiment_name}_dark_values_channel_{channel}.csv')
-                light_file_path = os.path.join(self.results_dir, f'{self.experiment_name}_light_values_channel_{channel}.csv')
-                dark_roi_pixel_values = self._extract_pixel_values(image_array, self.dark_roi_pixel_coordinates, self.dark_roi_pixel_dy)
-                light_roi_pixel_values = self._extract_pixel_values(image_array, self.light_roi_pixel_coordinates, self.light_roi_pixel_dy)
-                self._write_roi_values_to_file(dark_file_path, image_id, capture_time, time_delta, dark_roi_pixel_values)
-                self._write_roi_values_to_file(light_file_path, image_id, capture_time, time_delta, light_roi_pixel_values)
-
-        print("All images processed!")
+                for cb_face in ['dark', 'light']:
+                    file_path = self._get_roi_value_file_path(cb_face, channel)
+                    image_ids = get_csv_result_image_ids(file_path, self._get_roi_value_file_header_rows(cb_face))
+                    if not set(image_ids) <= set(self.image_series):
+                        raise ValueError(f"{file_path} contains images outside of the image series")
+                    completed_image_ids &= set(image_ids)
+
+        if 'npy' in self.result_file_formats:
+            if not all(os.path.exists(file_path) for file_path in self._get_npy_result_file_paths()):
+                return set()
+            with self._create_npy_result_writer(resume=True) as npy_result_writer:
+                completed_image_ids &= set(npy_result_writer.get_written_image_ids())
+
+        # Images after the first missing one are processed again, so that the results stay in the image series order
+        completed_prefix_image_ids = set()
+        for image_id in self.image_series:
+            if image_id not in completed_image_ids:
+                break
+            completed_prefix_image_ids.add(image_id)
+
+        if 'csv' in self.result_file_formats:
+            for file_path in roi_value_file_paths:
+                keep_csv_result_rows(file_path, 4, completed_prefix_image_ids)
+        return completed_prefix_image_ids
+
+    def _get_result_name(self):
+        # Shards write their own partial result files, merged by shard_merge.merge_shard_results
+        if self.number_of_shards == 1:
+            return self.experiment_name
+        return get_shard_result_name(self.experiment_name, self.shard_index, self.number_of_shards)
+
+    def _get_checkpoint_file_path(self):
+        return os.path.join(self.results_dir, f'{self._get_result_name()}_checkpoint.json')
+
+    def _write_checkpoint(self):
+        checkpoint = {'roi_geometry_key': self._get_roi_result_cache_key(), 'first_image_id': self.first_image_id,
+                      'last_image_id': self.last_image_id, 'skip_n_images': self.skip_n_images,
+                      'shard_index': self.shard_index, 'number_of_shards': self.number_of_shards}
+        checkpoint.update(self.progress)
+        checkpoint_file_path = self._get_checkpoint_file_path()
+        with open(checkpoint_file_path + '.tmp', 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(checkpoint_file_path + '.tmp', checkpoint_file_path)
+
+    def _create_result_writers(self, stack, resume=False):
+        result_writers = []
+        if 'csv' in self.result_file_formats:
+            roi_value_file_paths = {}
+            for channel in range(3):
+                dark_file_path = self._get_roi_value_file_path('dark', channel)
+                light_file_path = self._get_roi_value_file_path('light', channel)
+                if not resume:
+                    self._create_roi_value_file(dark_file_path, self.dark_roi_real_coordinates, self.dark_roi_real_dz, self.dark_roi_camera_real_distances)
+                    self._create_roi_value_file(light_file_path, self.light_roi_real_coordinates, self.light_roi_real_dz, self.light_roi_camera_real_distances)
+                    print(f"Channel {channel} ROI value files created!")
+                roi_value_file_paths[(channel, 0)] = dark_file_path
+                roi_value_file_paths[(channel, 1)] = light_file_path
+            result_writers.append(stack.enter_context(
+                CsvResultWriter(roi_value_file_paths, self.flush_row_count, self.flush_interval)))
+
+        if 'npy' in self.result_file_formats:
+            result_writers.append(stack.enter_context(self._create_npy_result_writer(resume)))
+            if not resume:
+                print("Binary ROI value store created!")
+        return result_writers
+
+    def _create_npy_result_writer(self, resume=False):
+        roi_heights = [self.dark_roi_real_coordinates[:, 2] + self.dark_roi_real_dz / 2,
+                       self.light_roi_real_coordinates[:, 2] + self.light_roi_real_dz / 2]
+        roi_camera_real_distances = [self.dark_roi_camera_real_distances, self.light_roi_camera_real_distances]
+        values_file_path, metadata_file_path = self._get_npy_result_file_paths()
+        return NpyResultWriter(values_file_path, metadata_file_path, self.image_series, roi_heights,
+                               roi_camera_real_distances, self.flush_row_count, self.flush_interval, resume)
+
+    def _get_npy_result_file_paths(self):
+        values_file_path = os.path.join(self.results_dir, f'{self._get_result_name()}_roi_values.npy')
+        metadata_file_path = os.path.join(self.results_dir, f'{self._get_result_name()}_roi_metadata.npz')
+        return values_file_path, metadata_file_path
+
+    def _get_roi_value_file_path(self, cb_face, channel):
+        return os.path.join(self.results_dir, f'{self._get_result_name()}_{cb_face}_values_channel_{channel}.csv')
 
     def _create_roi_value_file(self, file_path, roi_real_coordinates, roi_real_dz, roi_camera_real_distances):
         with open(file_path, 'w') as csvfile:
             writer = csv.writer(csvfile)
-            writer.writerow( ["ROI height [m]", "", ""] + list(roi_real_coordinates[:, 2] + roi_real_dz / 2))
-            writer.writerow(["Camera to ROI real distances [m]", "", ""] + list(roi_camera_real_distances))
-            writer.writerow(["", "", ""] + [f"ROI {i}" for i in range(self.number_of_rois)])
-            writer.writerow(["Image ID", "Time", "Timedelta"])
-            
-    def _write_roi_values_to_file(self, file_path, image_id, capture_time, time_delta, roi_values):
-        with open(file_path, 'a') as csvfile:
-            writer = csv.writer(csvfile)
-            data_row = [image_id, capture_time, time_delta] + roi_values
-            writer.writerow(data_row)
+            writer.writerows(self._format_roi_value_file_header_rows(roi_real_coordinates, roi_real_dz,
+                                                                     roi_camera_real_distances))
+
+    def _format_roi_value_file_header_rows(self, roi_real_coordinates, roi_real_dz, roi_camera_real_distances):
+        return [["ROI height [m]", "", ""] + list(roi_real_coordinates[:, 2] + roi_real_dz / 2),
+                ["Camera to ROI real distances [m]", "", ""] + list(roi_camera_real_distances),
+                ["", "", ""] + [f"ROI {i}" for i in range(self.number_of_rois)],
+                ["Image ID", "Time", "Timedelta"]]
+
+    def _get_roi_value_file_header_rows(self, cb_face):
+        if cb_face == 'dark':
+            return self._format_roi_value_file_header_rows(self.dark_roi_real_coordinates, self.dark_roi_real_dz,
+                                                           self.dark_roi_camera_real_distances)
+        return self._format_roi_value_file_header_rows(self.light_roi_real_coordinates, self.light_roi_real_dz,
+                                                       self.light_roi_camera_real_distances)
+
 
     def show_reference_image(self, channel, upscale=True):
+        # matplotlib is only imported by the interactive and plotting methods to keep headless imports fast
+        import matplotlib.pyplot as plt
+        import matplotlib.gridspec as gridspec
+        from matplotlib.widgets import Button
 
         def close_figure(event):
             plt.close()
@@ -316,6 +1408,9 @@ class DataExtractor:
             ax.imshow(image_array, cmap='gray', vmax=np.percentile(image_array, 99))
         else:
             ax.imshow(image_array, cmap='gray')
+        reference_image_file_path = self._get_image_file_path(self.reference_image_id)
+        ax.set_title(f"Reference image {self.reference_image_id}, "
+                     f"captured {self._get_capture_time_index().get(reference_image_file_path)}")
 
         ax_button = plt.subplot(gs[1])
         ax_button.axis('off')  # turn off the axis
@@ -335,6 +1430,9 @@ class DataExtractor:
 
 
     def plot_reference_image_with_rois(self, channel=0, upscale=True, show_height_markers=True):
+        import matplotlib.pyplot as plt
+        from matplotlib import patches
+
         def draw_roi(x_pos, y_pos, width, height, color, label):
             rect = patches.Rectangle((x_pos, y_pos), width, height, linewidth=0.1, edgecolor=color, facecolor='none',
                                      label=label)
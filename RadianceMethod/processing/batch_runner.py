@@ -0,0 +1,332 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+
+from RadianceMethod.analysis.DataAnalysis import DataAnalysis
+from RadianceMethod.processing.DataExtractor import DataExtractor, _init_group_worker, process_group_image_data
+
+
+# (config key, setter, whether list values are passed as positional and dict values as keyword arguments)
+DATA_EXTRACTOR_OPTIONS = [
+    ('experiment_name', 'set_experiment_name', False),
+    ('image_dir', 'set_image_dir', False),
+    ('results_dir', 'set_results_dir', False),
+    ('image_file_format', 'set_image_file_format', False),
+    ('raw_reduction_mode', 'set_raw_reduction_mode', False),
+    ('jpg_decoder', 'set_jpg_decoder', True),
+    ('image_name_string', 'set_image_name_string', False),
+    ('image_series', 'set_image_series', True),
+    ('shard', 'set_shard', True),
+    ('reference_image_id', 'set_reference_image_id', False),
+    ('camera_position', 'set_camera_position', True),
+    ('dark_roi_pixel_bounds', 'set_dark_roi_pixel_bounds', True),
+    ('light_roi_pixel_bounds', 'set_light_roi_pixel_bounds', True),
+    ('dark_roi_real_bounds', 'set_dark_roi_real_bounds', True),
+    ('light_roi_real_bounds', 'set_light_roi_real_bounds', True),
+    ('roi_parameters', 'set_roi_parameters', True),
+    ('height_marker_heights', 'set_height_marker_heights', False),
+    ('capture_time_options', 'set_capture_time_options', True),
+    ('write_buffering', 'set_write_buffering', True),
+    ('result_file_formats', 'set_result_file_formats', False),
+    ('roi_result_cache', 'set_roi_result_cache', True),
+    ('resume', 'set_resume', False),
+    ('read_ahead', 'set_read_ahead', True),
+    ('stage_metrics', 'set_stage_metrics', True),
+]
+
+DATA_ANALYSIS_OPTIONS = [
+    ('channels_to_analyse', 'set_channels_to_analyse', False),
+    ('baseline_image_bounds', 'set_baseline_image_bounds', False),
+    ('result_file_format', 'set_result_file_format', False),
+    ('analysis_engine', 'set_analysis_engine', False),
+    ('chunk_size', 'set_chunk_size', False),
+    ('output_options', 'set_output_options', True),
+    ('stage_metrics', 'set_stage_metrics', True),
+]
+
+def _apply_options(instance, config, options):
+    for key, setter, unpack in options:
+        if key not in config:
+            continue
+        value = config[key]
+        if unpack and isinstance(value, dict):
+            getattr(instance, setter)(**value)
+        elif unpack and isinstance(value, list):
+            getattr(instance, setter)(*value)
+        else:
+            getattr(instance, setter)(value)
+
+
+def load_batch_config(config_file_path):
+    """
+    Load a batch configuration from a JSON, TOML or YAML file, chosen by the file extension.
+
+    Relative image and results directories are resolved relative to the directory of the configuration file, and the
+    'defaults' section is merged into every experiment (the 'analysis' sections are merged key by key).
+
+    Returns:
+        dict: The configuration with the merged list of experiments.
+    """
+    extension = os.path.splitext(config_file_path)[1].lower()
+    if extension == '.json':
+        with open(config_file_path) as config_file:
+            config = json.load(config_file)
+    elif extension == '.toml':
+        import tomllib
+        with open(config_file_path, 'rb') as config_file:
+            config = tomllib.load(config_file)
+    elif extension in ['.yaml', '.yml']:
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("Reading YAML batch configurations requires PyYAML")
+        with open(config_file_path) as config_file:
+            config = yaml.safe_load(config_file)
+    else:
+        raise ValueError(f"Unknown batch configuration format '{extension}'")
+
+    config_dir = os.path.dirname(os.path.abspath(config_file_path))
+    defaults = config.get('defaults', {})
+    experiments = []
+    for experiment_config in config.get('experiments', []):
+        merged_config = dict(defaults, **experiment_config)
+        if isinstance(defaults.get('analysis'), dict) and isinstance(experiment_config.get('analysis'), dict):
+            merged_config['analysis'] = dict(defaults['analysis'], **experiment_config['analysis'])
+        for key in ['image_dir', 'results_dir']:
+            if key in merged_config:
+                merged_config[key] = os.path.join(config_dir, merged_config[key])
+        experiments.append(merged_config)
+    config['experiments'] = experiments
+    if 'summary_file' in config:
+        config['summary_file'] = os.path.join(config_dir, config['summary_file'])
+    return config
+
+
+def analyse_experiment(results_dirs, analysis_config):
+    """
+    Analyse the extracted ROI values of an experiment, in the main process or on the worker pool of a batch run.
+
+    Parameters:
+        results_dirs (list): The experiment name and results directory of every ROI geometry of the experiment.
+        analysis_config (dict or bool): The analysis section of the experiment configuration.
+
+    Returns:
+        float or None: The analysis time in seconds, None if there was nothing to analyse.
+    """
+    if not results_dirs:
+        return None
+    start_time = time.perf_counter()
+    for experiment_name, results_dir in results_dirs:
+        data_analysis = DataAnalysis()
+        data_analysis.set_experiment_name(experiment_name)
+        data_analysis.set_results_dir(results_dir)
+        if isinstance(analysis_config, dict):
+            _apply_options(data_analysis, analysis_config, DATA_ANALYSIS_OPTIONS)
+        if isinstance(analysis_config, dict) and analysis_config.get('chunked', False):
+            data_analysis.calc_results_in_chunks()
+        else:
+            data_analysis.load_result_data()
+            data_analysis.calc_intensities()
+            data_analysis.calc_extinction_coefficients()
+            data_analysis.write_results()
+    return time.perf_counter() - start_time
+
+
+class BatchRunner:
+    """
+    A class for extracting and analysing many experiments described by a configuration file in one run.
+
+    Every experiment is configured with the keys of DATA_EXTRACTOR_OPTIONS, named after the DataExtractor setters, and
+    an optional 'analysis' section with the keys of DATA_ANALYSIS_OPTIONS (plus 'chunked' to analyse with
+    calc_results_in_chunks), and needs its own results directory. Additional named ROI geometries of an experiment are
+    given as 'roi_geometries' mapping names to the arguments of DataExtractor.add_roi_geometry. Experiments reading
+    the same image files with the same decoding settings, e.g. several camera or ROI setups on one image series, form
+    a group: every image of a group is decoded once and reduced for all ROI geometries of its experiments. All groups
+    are processed by one shared worker pool, which also analyses the experiments of a group while the next groups are
+    extracted.
+
+    The summary gives the extraction time of every experiment as its part of the extraction time of its group, in
+    proportion to the time spent on its images including an equal part of the shared decoding.
+
+    Attributes:
+        experiments (list): List of dictionaries with the name, DataExtractor and analysis configuration of every
+        experiment.
+        number_of_workers (int): The number of worker processes shared by all experiments (1 processes serially).
+        summary_file_path (str or None): The path of the JSON file the run summary is written to.
+        summary (list or None): The throughput summary of the last run, one dictionary per experiment.
+
+    Methods:
+        load_config(config_file_path):
+            Load the experiments, number of workers and summary file of a JSON, TOML or YAML configuration file.
+
+        add_experiment(experiment_config):
+            Configure a DataExtractor for an experiment and add it to the batch.
+
+        set_number_of_workers(number_of_workers):
+            Set the number of worker processes shared by all experiments.
+
+        run():
+            Extract and analyse all experiments and return the throughput summary.
+    """
+
+    def __init__(self):
+        self.experiments = []
+        self.number_of_workers = 1
+        self.summary_file_path = None
+        self.summary = None
+
+    def load_config(self, config_file_path):
+        config = load_batch_config(config_file_path)
+        for experiment_config in config['experiments']:
+            self.add_experiment(experiment_config)
+        if 'number_of_workers' in config:
+            self.set_number_of_workers(config['number_of_workers'])
+        self.summary_file_path = config.get('summary_file')
+
+    def set_number_of_workers(self, number_of_workers):
+        if number_of_workers < 1:
+            raise ValueError("The number of workers must be at least 1")
+        self.number_of_workers = number_of_workers
+
+    def add_experiment(self, experiment_config):
+        known_keys = {key for key, _, _ in DATA_EXTRACTOR_OPTIONS} | {'roi_geometries', 'analysis'}
+        unknown_keys = set(experiment_config) - known_keys
+        if unknown_keys:
+            raise ValueError(f"Unknown experiment configuration keys {sorted(unknown_keys)}")
+
+        data_extractor = DataExtractor()
+        _apply_options(data_extractor, experiment_config, DATA_EXTRACTOR_OPTIONS)
+        for name, roi_geometry in experiment_config.get('roi_geometries', {}).items():
+            data_extractor.add_roi_geometry(name, **roi_geometry)
+        # The analysis results and ROI geometry files are not named after the experiment
+        for experiment in self.experiments:
+            if os.path.abspath(experiment['data_extractor'].results_dir) == os.path.abspath(data_extractor.results_dir):
+                raise ValueError(f"The experiments {experiment['experiment_name']} and "
+                                 f"{data_extractor.experiment_name} use the same results directory")
+        data_extractor.calc_geometrics()
+        self.experiments.append({'experiment_name': data_extractor.experiment_name,
+                                 'data_extractor': data_extractor,
+                                 'analysis': experiment_config.get('analysis')})
+        return data_extractor
+
+    def _group_experiments(self):
+        groups = {}
+        for experiment in self.experiments:
+            data_extractor = experiment['data_extractor']
+            key = (os.path.abspath(data_extractor.image_dir), data_extractor.image_name_string,
+                   data_extractor.image_file_format, data_extractor.raw_reduction_mode, data_extractor.jpg_decoder,
+                   data_extractor.jpg_reduction_factor)
+            groups.setdefault(key, []).append(experiment)
+        return list(groups.values())
+
+    def run(self):
+        groups = self._group_experiments()
+        self.summary = []
+        with ExitStack() as stack:
+            executor = None
+            if self.number_of_workers > 1:
+                data_extractor_groups = [self._get_group_data_extractors(group) for group in groups]
+                executor = stack.enter_context(ProcessPoolExecutor(max_workers=self.number_of_workers,
+                                                                   initializer=_init_group_worker,
+                                                                   initargs=(data_extractor_groups,)))
+            analysis_results = []
+            for group_index, group in enumerate(groups):
+                group_extraction_time = self._extract_group(group_index, group, executor)
+                # The analyses run on the pool while the next groups are extracted
+                for experiment in group:
+                    analysis_arguments = (self._get_analysis_results_dirs(experiment), experiment['analysis'])
+                    if executor is None:
+                        analysis_results.append(analyse_experiment(*analysis_arguments))
+                    else:
+                        analysis_results.append(executor.submit(analyse_experiment, *analysis_arguments))
+                self._add_group_summary(group, group_extraction_time)
+            for experiment_summary, analysis_result in zip(self.summary, analysis_results):
+                experiment_summary['analysis_time'] = (analysis_result if executor is None else
+                                                       analysis_result.result())
+
+        self._print_summary()
+        if self.summary_file_path is not None:
+            with open(self.summary_file_path, 'w') as summary_file:
+                json.dump(self.summary, summary_file, indent=2)
+        return self.summary
+
+    def _add_group_summary(self, group, group_extraction_time):
+        # The extraction time of the group is divided among its experiments by the time spent on their images
+        processing_times = [sum(data_extractor.progress['processing_time']
+                                for data_extractor in experiment['data_extractor']._get_group_data_extractors())
+                            for experiment in group]
+        number_of_roi_sets = len(self._get_group_data_extractors(group))
+        for experiment, processing_time in zip(group, processing_times):
+            if sum(processing_times) > 0:
+                extraction_time = group_extraction_time * processing_time / sum(processing_times)
+            else:
+                extraction_time = group_extraction_time / len(group)
+            progress = experiment['data_extractor']._get_group_data_extractors()[0].progress
+            processed_images = progress['processed_images'] - progress['resumed_images']
+            self.summary.append({
+                'experiment_name': experiment['experiment_name'],
+                'processed_images': processed_images,
+                'resumed_images': progress['resumed_images'],
+                'shared_decoding_roi_sets': number_of_roi_sets,
+                'extraction_time': extraction_time,
+                'group_extraction_time': group_extraction_time,
+                'images_per_second': processed_images / extraction_time if extraction_time > 0 else None,
+                'analysis_time': None,
+            })
+
+    def _extract_group(self, group_index, group, executor):
+        start_time = time.perf_counter()
+        print(f"Extracting {', '.join(experiment['experiment_name'] for experiment in group)}...")
+        data_extractors = self._get_group_data_extractors(group)
+        process_group_image_data(data_extractors, executor, group_index, self.number_of_workers)
+        for experiment in group:
+            experiment['data_extractor'].write_roi_real_coordinates()
+            experiment['data_extractor'].write_roi_camera_to_roi_real_distances()
+        return time.perf_counter() - start_time
+
+    @staticmethod
+    def _get_group_data_extractors(group):
+        return [data_extractor for experiment in group
+                for data_extractor in experiment['data_extractor']._get_group_data_extractors()]
+
+    @staticmethod
+    def _get_analysis_results_dirs(experiment):
+        # Shards hold partial results, which are analysed after merging
+        if not experiment['analysis'] or experiment['data_extractor'].number_of_shards > 1:
+            return []
+        # Every ROI geometry of an experiment has its own results directory
+        return [(data_extractor.experiment_name, data_extractor.results_dir)
+                for data_extractor in experiment['data_extractor']._get_group_data_extractors()]
+
+    def _print_summary(self):
+        print(f"{'Experiment':<30} {'Images':>8} {'Shared':>7} {'Extraction [s]':>15} {'Images/s':>9} "
+              f"{'Analysis [s]':>13}")
+        for experiment_summary in self.summary:
+            images_per_second = experiment_summary['images_per_second']
+            analysis_time = experiment_summary['analysis_time']
+            print(f"{experiment_summary['experiment_name']:<30} {experiment_summary['processed_images']:>8} "
+                  f"{experiment_summary['shared_decoding_roi_sets']:>7} "
+                  f"{experiment_summary['extraction_time']:>15.2f} "
+                  f"{'-' if images_per_second is None else f'{images_per_second:.2f}':>9} "
+                  f"{'-' if analysis_time is None else f'{analysis_time:.2f}':>13}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Extract and analyse the experiments of a batch configuration file.")
+    parser.add_argument('config_file', help="JSON, TOML or YAML batch configuration file")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes, overrides the config")
+    parser.add_argument('--shard', type=int, nargs=2, default=None, metavar=('INDEX', 'COUNT'),
+                        help="process only shard INDEX of COUNT of every image series, overrides the config")
+    args = parser.parse_args()
+
+    batch_runner = BatchRunner()
+    batch_runner.load_config(args.config_file)
+    if args.workers is not None:
+        batch_runner.set_number_of_workers(args.workers)
+    if args.shard is not None:
+        for experiment in batch_runner.experiments:
+            experiment['data_extractor'].set_shard(*args.shard)
+    batch_runner.run()
@@ -0,0 +1,88 @@
+import os
+import hashlib
+import numpy as np
+
+
+class RoiResultCache:
+    """
+    An on-disk cache of the ROI values and capture times of single images.
+
+    Entries are keyed by the image file path, its modification time and size and a hash of the ROI geometry, so a
+    changed image or ROI layout never hits a stale entry. Every entry is a small .npz file in the cache directory.
+    Reading an entry refreshes its modification time, and the least recently used entries are evicted once the total
+    size of the cache exceeds its limit, down to 90 % of the limit so that eviction is not repeated on every write.
+
+    Attributes:
+        cache_dir (str): The directory holding the cache entries.
+        max_size_bytes (int): The maximum total size of all cache entries in bytes.
+
+    Methods:
+        get(image_file_path, geometry_hash):
+            Return the cached (capture_time, roi_values) of an image or None if there is no valid entry.
+
+        put(image_file_path, geometry_hash, capture_time, roi_values):
+            Store the capture time and ROI values of an image and evict old entries if needed.
+
+        invalidate():
+            Remove all cache entries.
+    """
+
+    def __init__(self, cache_dir, max_size_bytes=512 * 1024 ** 2):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._cache_size = sum(os.path.getsize(entry_path) for entry_path in self._get_entry_paths())
+
+    def _get_entry_path(self, image_file_path, geometry_hash):
+        file_stat = os.stat(image_file_path)
+        key = f"{os.path.abspath(image_file_path)}|{file_stat.st_mtime_ns}|{file_stat.st_size}|{geometry_hash}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npz')
+
+    def _get_entry_paths(self):
+        return [os.path.join(self.cache_dir, filename) for filename in os.listdir(self.cache_dir)
+                if filename.endswith('.npz')]
+
+    def get(self, image_file_path, geometry_hash):
+        entry_path = self._get_entry_path(image_file_path, geometry_hash)
+        try:
+            with np.load(entry_path) as entry:
+                capture_time = entry['capture_time'].item()
+                roi_values = entry['roi_values']
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(entry_path)
+        return capture_time, roi_values
+
+    def put(self, image_file_path, geometry_hash, capture_time, roi_values):
+        entry_path = self._get_entry_path(image_file_path, geometry_hash)
+        temporary_entry_path = entry_path + '.tmp'
+        with open(temporary_entry_path, 'wb') as entry_file:
+            np.savez(entry_file, capture_time=np.datetime64(capture_time, 'us'), roi_values=roi_values)
+        if os.path.exists(entry_path):
+            self._cache_size -= os.path.getsize(entry_path)
+        os.replace(temporary_entry_path, entry_path)
+        self._cache_size += os.path.getsize(entry_path)
+        if self._cache_size > self.max_size_bytes:
+            self._evict(0.9 * self.max_size_bytes)
+
+    def _evict(self, target_size_bytes):
+        entries = []
+        for entry_path in self._get_entry_paths():
+            try:
+                entry_stat = os.stat(entry_path)
+            except FileNotFoundError:
+                continue
+            entries.append((entry_stat.st_mtime_ns, entry_stat.st_size, entry_path))
+
+        self._cache_size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, entry_path in sorted(entries):
+            if self._cache_size <= target_size_bytes:
+                break
+            os.remove(entry_path)
+            self._cache_size -= entry_size
+
+    def invalidate(self):
+        for entry_path in self._get_entry_paths():
+            os.remove(entry_path)
+        self._cache_size = 0
@@ -0,0 +1,253 @@
+import csv
+import io
+import os
+import time
+
+import numpy as np
+
+
+class CsvResultWriter:
+    """
+    A buffered writer appending the ROI values of an image series to the dark and light value files of all channels.
+
+    All files are opened once and kept open for the whole run. The rows of an image are formatted for every file
+    before they are buffered, and buffers are only ever written out as whole rows, so an interrupted run never leaves
+    partial rows behind. The writer is a context manager and flushes and closes its files on exit, including on errors
+    and KeyboardInterrupt.
+
+    Attributes:
+        file_paths (dict): Dictionary mapping (channel, face) tuples to the file paths of the value files, with face 0
+        being the dark and face 1 being the light ROIs.
+        flush_row_count (int): The number of buffered images after which the buffers are written to the files.
+        flush_interval (float): The time in seconds after which buffered rows are written to the files.
+
+    Methods:
+        write_roi_values(image_id, capture_time, time_delta, roi_values):
+            Buffer the rows of one image, roi_values being an array of shape (channel, face, ROI).
+
+        flush():
+            Write all buffered rows to the files.
+
+        close():
+            Flush the buffers and close all files.
+    """
+
+    def __init__(self, file_paths, flush_row_count=100, flush_interval=10.0):
+        self.file_paths = file_paths
+        self.flush_row_count = flush_row_count
+        self.flush_interval = flush_interval
+        self._files = {key: open(file_path, 'a') for key, file_path in file_paths.items()}
+        self._buffers = {key: [] for key in file_paths}
+        self._buffered_row_count = 0
+        self._last_flush_time = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_roi_values(self, image_id, capture_time, time_delta, roi_values):
+        rows = {}
+        for (channel, face) in self._files:
+            data_row = [image_id, capture_time, time_delta] + list(roi_values[channel, face])
+            rows[(channel, face)] = format_csv_rows([data_row])
+
+        for key, row in rows.items():
+            self._buffers[key].append(row)
+        self._buffered_row_count += 1
+
+        if (self._buffered_row_count >= self.flush_row_count or
+                time.monotonic() - self._last_flush_time >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        for key, csvfile in self._files.items():
+            if self._buffers[key]:
+                csvfile.write(''.join(self._buffers[key]))
+                self._buffers[key] = []
+            csvfile.flush()
+        self._buffered_row_count = 0
+        self._last_flush_time = time.monotonic()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            for csvfile in self._files.values():
+                csvfile.close()
+
+
+def format_csv_rows(rows):
+    row_buffer = io.StringIO()
+    csv.writer(row_buffer).writerows(rows)
+    return row_buffer.getvalue()
+
+
+def _read_csv_result_file(file_path, header_row_count):
+    with open(file_path, newline='') as csvfile:
+        lines = csvfile.readlines()
+    header_lines, data_lines = lines[:header_row_count], lines[header_row_count:]
+    # A last line without line break is a partially written row
+    if data_lines and not data_lines[-1].endswith('\n'):
+        data_lines = data_lines[:-1]
+    return ''.join(header_lines), data_lines
+
+
+def get_csv_result_image_ids(file_path, header_rows):
+    """
+    Return the IDs of the completely written images of a CSV value file, ignoring a partially written last row.
+
+    Raises:
+        ValueError: If the header of the file differs from the given header rows.
+    """
+    header, data_lines = _read_csv_result_file(file_path, len(header_rows))
+    if header.replace('\r', '') != format_csv_rows(header_rows).replace('\r', ''):
+        raise ValueError(f"The header of {file_path} does not match the current ROI geometry")
+    return [int(line.split(',', 1)[0]) for line in data_lines]
+
+
+def keep_csv_result_rows(file_path, header_row_count, image_ids):
+    """
+    Atomically rewrite a CSV value file, keeping only the first complete row of each of the given image IDs.
+    """
+    header, data_lines = _read_csv_result_file(file_path, header_row_count)
+    kept_lines = []
+    kept_image_ids = set()
+    for line in data_lines:
+        image_id = int(line.split(',', 1)[0])
+        if image_id in image_ids and image_id not in kept_image_ids:
+            kept_lines.append(line)
+            kept_image_ids.add(image_id)
+    temporary_file_path = file_path + '.tmp'
+    with open(temporary_file_path, 'w', newline='') as csvfile:
+        csvfile.write(header + ''.join(kept_lines))
+    os.replace(temporary_file_path, file_path)
+
+
+class NpyResultWriter:
+    """
+    A writer storing the ROI values of an image series in a binary store that can be loaded without parsing.
+
+    The ROI values are kept in one dense, memory-mapped float32 .npy array of shape (image, channel, face, ROI), with
+    face 0 being the dark and face 1 being the light ROIs. An accompanying .npz file holds the image IDs, capture
+    times, time deltas, a mask of the written images and the ROI heights and camera to ROI distances of both faces.
+    Images are stored at their position in the image series, the metadata file is replaced atomically on every flush.
+    With resume set, an existing store of the same image series and ROI geometry is opened and extended.
+
+    Attributes:
+        values_file_path (str): The path of the .npy file holding the ROI values.
+        metadata_file_path (str): The path of the .npz file holding the metadata.
+        image_ids (list): The IDs of all images of the image series.
+        flush_row_count (int): The number of written images after which the store is flushed to disk.
+        flush_interval (float): The time in seconds after which the store is flushed to disk.
+
+    Methods:
+        write_roi_values(image_id, capture_time, time_delta, roi_values):
+            Store the ROI values of one image, roi_values being an array of shape (channel, face, ROI).
+
+        flush():
+            Flush the ROI values and write the metadata file.
+
+        close():
+            Flush the store and release the memory map.
+    """
+
+    def __init__(self, values_file_path, metadata_file_path, image_ids, roi_heights, roi_camera_real_distances,
+                 flush_row_count=100, flush_interval=10.0, resume=False):
+        self.values_file_path = values_file_path
+        self.metadata_file_path = metadata_file_path
+        self.image_ids = list(image_ids)
+        self.flush_row_count = flush_row_count
+        self.flush_interval = flush_interval
+        self._positions = {image_id: position for position, image_id in enumerate(self.image_ids)}
+        roi_heights = np.asarray(roi_heights, dtype=float)
+        roi_camera_real_distances = np.asarray(roi_camera_real_distances, dtype=float)
+        if resume:
+            self._open_existing_store(roi_heights, roi_camera_real_distances)
+        else:
+            self._create_store(roi_heights, roi_camera_real_distances)
+        self._unflushed_row_count = 0
+        self._last_flush_time = time.monotonic()
+
+    def _create_store(self, roi_heights, roi_camera_real_distances):
+        self._roi_values = np.lib.format.open_memmap(self.values_file_path, mode='w+', dtype=np.float32,
+                                                     shape=(len(self.image_ids), 3) + roi_heights.shape)
+        self._roi_values[:] = np.nan
+        self._metadata = {
+            'image_ids': np.array(self.image_ids, dtype=np.int64),
+            'capture_times': np.full(len(self.image_ids), np.datetime64('NaT'), dtype='datetime64[us]'),
+            'time_deltas': np.full(len(self.image_ids), np.timedelta64('NaT'), dtype='timedelta64[us]'),
+            'written': np.zeros(len(self.image_ids), dtype=bool),
+            'roi_heights': roi_heights,
+            'roi_camera_real_distances': roi_camera_real_distances,
+        }
+
+    def _open_existing_store(self, roi_heights, roi_camera_real_distances):
+        with np.load(self.metadata_file_path) as metadata_file:
+            self._metadata = {key: metadata_file[key] for key in metadata_file.files}
+        if (not np.array_equal(self._metadata['image_ids'], self.image_ids) or
+                not np.array_equal(self._metadata['roi_heights'], roi_heights) or
+                not np.array_equal(self._metadata['roi_camera_real_distances'], roi_camera_real_distances)):
+            raise ValueError(f"{self.values_file_path} does not match the current image series and ROI geometry")
+        self._roi_values = np.lib.format.open_memmap(self.values_file_path, mode='r+')
+
+    def get_written_image_ids(self):
+        return [int(image_id) for image_id in self._metadata['image_ids'][self._metadata['written']]]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_roi_values(self, image_id, capture_time, time_delta, roi_values):
+        position = self._positions[image_id]
+        self._roi_values[position] = roi_values
+        self._metadata['capture_times'][position] = np.datetime64(capture_time, 'us')
+        self._metadata['time_deltas'][position] = np.timedelta64(time_delta, 'us')
+        self._metadata['written'][position] = True
+        self._unflushed_row_count += 1
+
+        if (self._unflushed_row_count >= self.flush_row_count or
+                time.monotonic() - self._last_flush_time >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        self._roi_values.flush()
+        temporary_file_path = self.metadata_file_path + '.tmp'
+        with open(temporary_file_path, 'wb') as metadata_file:
+            np.savez(metadata_file, **self._metadata)
+        os.replace(temporary_file_path, self.metadata_file_path)
+        self._unflushed_row_count = 0
+        self._last_flush_time = time.monotonic()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            del self._roi_values
+
+
+def load_npy_result_data(values_file_path, metadata_file_path, mmap_mode='r'):
+    """
+    Load a binary ROI value store written by NpyResultWriter.
+
+    Parameters:
+        values_file_path (str): The path of the .npy file holding the ROI values.
+        metadata_file_path (str): The path of the .npz file holding the metadata.
+        mmap_mode (str or None): The memory-map mode passed to numpy.load, None loads the values into memory.
+
+    Returns:
+        tuple: The ROI values of all written images as array of shape (image, channel, face, ROI) and a dictionary
+        with the metadata of these images.
+    """
+    with np.load(metadata_file_path) as metadata_file:
+        metadata = {key: metadata_file[key] for key in metadata_file.files}
+    written = metadata.pop('written')
+    roi_values = np.load(values_file_path, mmap_mode=mmap_mode)
+    if not written.all():
+        roi_values = roi_values[written]
+        for key in ['image_ids', 'capture_times', 'time_deltas']:
+            metadata[key] = metadata[key][written]
+    return roi_values, metadata
@@ -0,0 +1,157 @@
+import os
+import numpy as np
+
+
+def calc_roi_strip_box(windows, image_shape, padding):
+    """
+    Return the (y_start, y_stop, x_start, x_stop) box enclosing all non-empty windows, grown by padding pixels on every
+    side and clipped to the image.
+    """
+    windows = [window for window in windows if window[1] > window[0] and window[3] > window[2]]
+    height, width = image_shape
+    return (max(min(window[0] for window in windows) - padding, 0),
+            min(max(window[1] for window in windows) + padding, height),
+            max(min(window[2] for window in windows) - padding, 0),
+            min(max(window[3] for window in windows) + padding, width))
+
+
+class RoiStripStack:
+    """
+    A memory-mapped stack of the pixel strips around the ROIs of every image of an image series.
+
+    The strip is a padded box around the dark and light ROI windows, stored as decoded by DataExtractor (channel
+    arrays, or the corrected values in the RAW 'bayer' mode with the Bayer channel indices kept once in the metadata)
+    in one .npy array of shape (image, ...). The windows of any ROI layout inside the strip are then sliced from the
+    memory map without decoding the images again. An accompanying .npz file holds the image IDs, the strip box, the
+    image shape, a key of the decoding settings and the modification time and size of every stored image, so that
+    strips of changed images are decoded again.
+
+    Attributes:
+        stack_file_path (str): The path of the .npy file holding the strips.
+        metadata_file_path (str): The path of the .npz file holding the metadata.
+        strip_box (tuple or None): The (y_start, y_stop, x_start, x_stop) box of the strips in image pixels.
+
+    Methods:
+        open(image_ids, settings_key, image_shape, windows):
+            Open an existing stack of the same image series and settings whose strips contain the windows.
+
+        create(image_ids, settings_key, image_shape, strip_box, strip_data):
+            Create a new, empty stack with strips of the shape and dtype of strip_data.
+
+        has_strip(image_id, image_file_path):
+            Return whether the strip of an unchanged image is stored.
+
+        put_strip(image_id, strip_data):
+            Store the strip of an image.
+
+        get_windows(image_id, windows):
+            Return views of image pixel windows in the strip of an image, in the form of strip_data.
+
+        mark_written(image_id, image_file_path):
+            Mark the stored strip of an image as complete, to be called in the process owning the stack.
+
+        flush():
+            Flush the strips and write the metadata file.
+    """
+
+    def __init__(self, stack_file_path, metadata_file_path):
+        self.stack_file_path = stack_file_path
+        self.metadata_file_path = metadata_file_path
+        self.strip_box = None
+        self._metadata = None
+        self._positions = None
+        self._strips = None
+
+    def __getstate__(self):
+        # Worker processes map the stack file themselves instead of receiving a copy of the strips
+        state = self.__dict__.copy()
+        state['_strips'] = None
+        return state
+
+    def open(self, image_ids, settings_key, image_shape, windows):
+        if not os.path.exists(self.stack_file_path) or not os.path.exists(self.metadata_file_path):
+            return False
+        with np.load(self.metadata_file_path) as metadata_file:
+            metadata = {key: metadata_file[key] for key in metadata_file.files}
+        strip_box = tuple(int(bound) for bound in metadata['strip_box'])
+        if (str(metadata['settings_key']) != settings_key or
+                not np.array_equal(metadata['image_ids'], list(image_ids)) or
+                tuple(metadata['image_shape']) != tuple(image_shape)):
+            return False
+        for y_start, y_stop, x_start, x_stop in windows:
+            if y_stop > y_start and x_stop > x_start and (y_start < strip_box[0] or y_stop > strip_box[1] or
+                                                          x_start < strip_box[2] or x_stop > strip_box[3]):
+                return False
+        self._set_metadata(metadata)
+        return True
+
+    def create(self, image_ids, settings_key, image_shape, strip_box, strip_data):
+        values = strip_data[0] if isinstance(strip_data, tuple) else strip_data
+        image_ids = list(image_ids)
+        strips = np.lib.format.open_memmap(self.stack_file_path, mode='w+', dtype=values.dtype,
+                                           shape=(len(image_ids),) + values.shape)
+        del strips
+        metadata = {
+            'image_ids': np.array(image_ids, dtype=np.int64),
+            'settings_key': np.array(settings_key),
+            'image_shape': np.array(image_shape, dtype=np.int64),
+            'strip_box': np.array(strip_box, dtype=np.int64),
+            'file_signatures': np.zeros((len(image_ids), 2), dtype=np.int64),
+            'written': np.zeros(len(image_ids), dtype=bool),
+        }
+        if isinstance(strip_data, tuple):
+            metadata['channel_indices'] = strip_data[1]
+        self._set_metadata(metadata)
+        self.flush()
+
+    def _set_metadata(self, metadata):
+        self._metadata = metadata
+        self._positions = {int(image_id): position for position, image_id in enumerate(metadata['image_ids'])}
+        self.strip_box = tuple(int(bound) for bound in metadata['strip_box'])
+
+    def _get_strips(self):
+        if self._strips is None:
+            self._strips = np.load(self.stack_file_path, mmap_mode='r+')
+        return self._strips
+
+    @staticmethod
+    def _get_file_signature(image_file_path):
+        file_stat = os.stat(image_file_path)
+        return [file_stat.st_mtime_ns, file_stat.st_size]
+
+    def has_strip(self, image_id, image_file_path):
+        position = self._positions.get(image_id)
+        return (position is not None and bool(self._metadata['written'][position]) and
+                list(self._metadata['file_signatures'][position]) == self._get_file_signature(image_file_path))
+
+    def put_strip(self, image_id, strip_data):
+        self._get_strips()[self._positions[image_id]] = strip_data[0] if isinstance(strip_data, tuple) else strip_data
+
+    def get_windows(self, image_id, windows):
+        strip = self._get_strips()[self._positions[image_id]]
+        y_offset, x_offset = self.strip_box[0], self.strip_box[2]
+        window_data = []
+        for y_start, y_stop, x_start, x_stop in windows:
+            if y_stop <= y_start or x_stop <= x_start:
+                y_start = y_stop = y_offset
+                x_start = x_stop = x_offset
+            window = (slice(y_start - y_offset, y_stop - y_offset), slice(x_start - x_offset, x_stop - x_offset))
+            if 'channel_indices' in self._metadata:
+                window_data.append((strip[window], self._metadata['channel_indices'][window]))
+            else:
+                window_data.append(strip[(slice(None),) + window])
+        return window_data
+
+    def mark_written(self, image_id, image_file_path):
+        # Strips are stored by worker processes too, the metadata is only kept by the process owning the stack
+        position = self._positions[image_id]
+        self._metadata['written'][position] = True
+        self._metadata['file_signatures'][position] = self._get_file_signature(image_file_path)
+
+    def flush(self):
+        if self._strips is not None:
+            self._strips.flush()
+        temporary_file_path = self.metadata_file_path + '.tmp'
+        with open(temporary_file_path, 'wb') as metadata_file:
+            np.savez(metadata_file, **self._metadata)
+        os.replace(temporary_file_path, self.metadata_file_path)
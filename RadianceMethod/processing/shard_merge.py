@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+from collections import Counter
+
+from RadianceMethod.processing.result_writers import NpyResultWriter, _read_csv_result_file, load_npy_result_data
+
+
+def get_shard_result_name(experiment_name, shard_index, number_of_shards):
+    return f'{experiment_name}_shard_{shard_index}_of_{number_of_shards}'
+
+
+def _read_shard_checkpoints(results_dir, experiment_name, number_of_shards):
+    checkpoints = []
+    for shard_index in range(number_of_shards):
+        shard_result_name = get_shard_result_name(experiment_name, shard_index, number_of_shards)
+        checkpoint_file_path = os.path.join(results_dir, f'{shard_result_name}_checkpoint.json')
+        if not os.path.exists(checkpoint_file_path):
+            raise ValueError(f"Shard {shard_index} of {experiment_name} has not been processed")
+        with open(checkpoint_file_path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if not checkpoint['complete']:
+            raise ValueError(f"Shard {shard_index} of {experiment_name} is not complete")
+        checkpoints.append(checkpoint)
+    image_series_keys = {(checkpoint['roi_geometry_key'], checkpoint['first_image_id'], checkpoint['last_image_id'],
+                          checkpoint['skip_n_images']) for checkpoint in checkpoints}
+    if len(image_series_keys) > 1:
+        raise ValueError(f"The shards of {experiment_name} were processed with different image series or settings")
+    return checkpoints
+
+
+def _check_image_ids(image_ids, image_series, description):
+    image_id_counts = Counter(image_ids)
+    duplicate_image_ids = sorted(image_id for image_id, count in image_id_counts.items() if count > 1)
+    if duplicate_image_ids:
+        raise ValueError(f"{description} contains the images {duplicate_image_ids[:10]} more than once")
+    unexpected_image_ids = sorted(set(image_id_counts) - set(image_series))
+    if unexpected_image_ids:
+        raise ValueError(f"{description} contains the images {unexpected_image_ids[:10]} outside of the image series")
+    missing_image_ids = [image_id for image_id in image_series if image_id not in image_id_counts]
+    if missing_image_ids:
+        raise ValueError(f"{description} is missing {len(missing_image_ids)} images, e.g. {missing_image_ids[:10]}")
+
+
+def _read_csv_shard_files(shard_file_paths, file_path, image_series):
+    header = None
+    data_lines = {}
+    image_ids = []
+    for shard_file_path in shard_file_paths:
+        shard_header, shard_data_lines = _read_csv_result_file(shard_file_path, 4)
+        if header is None:
+            header = shard_header
+        elif shard_header != header:
+            raise ValueError(f"The header of {shard_file_path} differs from the other shards")
+        for line in shard_data_lines:
+            image_id = int(line.split(',', 1)[0])
+            image_ids.append(image_id)
+            data_lines[image_id] = line
+    _check_image_ids(image_ids, image_series, os.path.basename(file_path))
+    return header + ''.join(data_lines[image_id] for image_id in image_series)
+
+
+def _write_csv_file(file_path, content):
+    temporary_file_path = file_path + '.tmp'
+    with open(temporary_file_path, 'w', newline='') as csvfile:
+        csvfile.write(content)
+    os.replace(temporary_file_path, file_path)
+
+
+def _read_npy_shard_files(shard_file_paths, file_paths, image_series):
+    shard_results = [load_npy_result_data(values_file_path, metadata_file_path)
+                     for values_file_path, metadata_file_path in shard_file_paths]
+    image_ids = [int(image_id) for _, metadata in shard_results for image_id in metadata['image_ids']]
+    _check_image_ids(image_ids, image_series, os.path.basename(file_paths[0]))
+    return shard_results
+
+
+def _write_npy_files(file_paths, shard_results, image_series):
+    roi_heights = shard_results[0][1]['roi_heights']
+    roi_camera_real_distances = shard_results[0][1]['roi_camera_real_distances']
+    with NpyResultWriter(*file_paths, image_series, roi_heights, roi_camera_real_distances,
+                         flush_row_count=len(image_series)) as npy_result_writer:
+        for roi_values, metadata in shard_results:
+            for position, image_id in enumerate(metadata['image_ids']):
+                npy_result_writer.write_roi_values(int(image_id), metadata['capture_times'][position],
+                                                   metadata['time_deltas'][position], roi_values[position])
+
+
+def merge_shard_results(results_dir, experiment_name, number_of_shards, result_file_formats=('csv',)):
+    """
+    Merge the partial results written by the shards of an image series (see DataExtractor.set_shard) into the result
+    files of the whole experiment, with the images in the order of the image series.
+
+    All shards have to be complete and processed with the same image series and ROI geometry. The merged files are
+    only written if every image of the image series occurs exactly once in the shard results.
+
+    Parameters:
+        results_dir (str): The results directory of the shards.
+        experiment_name (str): The experiment name of the shards.
+        number_of_shards (int): The number of shards the image series was split into.
+        result_file_formats (iterable): The result file formats to merge, 'csv' and/or 'npy'.
+
+    Raises:
+        ValueError: If a shard is missing or incomplete, or images are missing or duplicated.
+    """
+    checkpoints = _read_shard_checkpoints(results_dir, experiment_name, number_of_shards)
+    image_series = range(checkpoints[0]['first_image_id'], checkpoints[0]['last_image_id'],
+                         checkpoints[0]['skip_n_images'] + 1)
+    shard_result_names = [get_shard_result_name(experiment_name, shard_index, number_of_shards)
+                          for shard_index in range(number_of_shards)]
+
+    # All shard files are checked before any merged file is written
+    merged_csv_files = {}
+    if 'csv' in result_file_formats:
+        for channel in range(3):
+            for cb_face in ['dark', 'light']:
+                file_name = f'{cb_face}_values_channel_{channel}.csv'
+                file_path = os.path.join(results_dir, f'{experiment_name}_{file_name}')
+                merged_csv_files[file_path] = _read_csv_shard_files(
+                    [os.path.join(results_dir, f'{shard_result_name}_{file_name}')
+                     for shard_result_name in shard_result_names], file_path, image_series)
+    npy_shard_results = None
+    npy_file_paths = (os.path.join(results_dir, f'{experiment_name}_roi_values.npy'),
+                      os.path.join(results_dir, f'{experiment_name}_roi_metadata.npz'))
+    if 'npy' in result_file_formats:
+        npy_shard_results = _read_npy_shard_files([(os.path.join(results_dir, f'{shard_result_name}_roi_values.npy'),
+                                                    os.path.join(results_dir, f'{shard_result_name}_roi_metadata.npz'))
+                                                   for shard_result_name in shard_result_names],
+                                                  npy_file_paths, image_series)
+
+    for file_path, content in merged_csv_files.items():
+        _write_csv_file(file_path, content)
+    if merged_csv_files:
+        print("CSV ROI value files merged!")
+    if npy_shard_results is not None:
+        _write_npy_files(npy_file_paths, npy_shard_results, image_series)
+        print("Binary ROI value store merged!")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merge the partial results of the shards of an image series.")
+    parser.add_argument('results_dir', help="results directory of the shards")
+    parser.add_argument('experiment_name', help="experiment name of the shards")
+    parser.add_argument('number_of_shards', type=int, help="number of shards the image series was split into")
+    parser.add_argument('--formats', nargs='+', default=['csv'], choices=['csv', 'npy'],
+                        help="result file formats to merge")
+    args = parser.parse_args()
+
+    merge_shard_results(args.results_dir, args.experiment_name, args.number_of_shards, args.formats)
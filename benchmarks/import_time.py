@@ -0,0 +1,69 @@
+"""
+Benchmark the import time of the extraction and analysis APIs.
+
+Every module is imported in a fresh interpreter several times and the median import time is reported, together with
+any heavy optional dependency (matplotlib, pandas, rawpy, ...) that was loaded at import time. The script exits with
+status 1 if such a dependency is loaded or if an import takes longer than --max-ms.
+
+Usage:
+    python benchmarks/import_time.py [--repeat 5] [--max-ms 500]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = [
+    'RadianceMethod.processing.DataExtractor',
+    'RadianceMethod.analysis.DataAnalysis',
+]
+
+# Dependencies that must only be imported when the functionality needing them is used
+LAZY_DEPENDENCIES = ['matplotlib', 'pandas', 'rawpy', 'exifread', 'tqdm', 'PIL', 'av']
+
+IMPORT_SCRIPT = """
+import json, sys, time
+import numpy
+start = time.perf_counter()
+import {module}
+import_time = time.perf_counter() - start
+print(json.dumps({{'import_time': import_time,
+                  'loaded': [name for name in {lazy_dependencies!r} if name in sys.modules]}}))
+"""
+
+
+def measure_import(module, repeat):
+    repository_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([repository_dir, os.environ.get('PYTHONPATH', '')]))
+    import_times = []
+    loaded = set()
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT.format(module=module,
+                                                                            lazy_dependencies=LAZY_DEPENDENCIES)],
+                                env=env, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output)
+        import_times.append(result['import_time'])
+        loaded.update(result['loaded'])
+    return statistics.median(import_times), sorted(loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='number of fresh interpreters per module')
+    parser.add_argument('--max-ms', type=float, default=None, help='fail if an import takes longer')
+    args = parser.parse_args()
+
+    failed = False
+    for module in MODULES:
+        import_time, loaded = measure_import(module, args.repeat)
+        print(f"{module}: {import_time * 1000:.1f} ms (numpy preloaded)"
+              + (f", loaded {', '.join(loaded)}" if loaded else ""))
+        if loaded or (args.max_ms is not None and import_time * 1000 > args.max_ms):
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
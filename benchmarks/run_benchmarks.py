@@ -0,0 +1,226 @@
+"""
+Benchmark the extraction and analysis hot paths on synthetic image series.
+
+Every stage is timed separately and reported as frames/s and MB/s (of the data the stage reads or writes) together
+with its peak traced memory. The results are saved as JSON and can be compared with the results of another version:
+
+    python benchmarks/run_benchmarks.py --output results_new.json --compare results_old.json
+
+The comparison prints the relative change of every stage and exits with status 1 if a stage got slower than the
+--threshold factor allows.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic_data import generate_image_series, get_face_pixel_bounds, get_image_name_string  # noqa: E402
+from RadianceMethod.analysis.DataAnalysis import DataAnalysis  # noqa: E402
+from RadianceMethod.helper_functions.image_reading import get_capture_date_time, \
+    get_channel_arrays_from_jpg_file, get_channel_arrays_from_raw_file  # noqa: E402
+from RadianceMethod.processing.DataExtractor import DataExtractor  # noqa: E402
+from RadianceMethod.processing.result_writers import CsvResultWriter  # noqa: E402
+
+
+def measure(function, number_of_frames, number_of_bytes, repeat):
+    """
+    Time a function, which processes number_of_frames frames of number_of_bytes bytes in total per call (None if the
+    amount of data is not known, e.g. for partially read files).
+
+    The best of repeat timed calls is reported, the peak memory is traced in an additional, untimed call.
+    """
+    durations = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    duration = min(durations)
+    return {'seconds': duration,
+            'frames_per_second': number_of_frames / duration,
+            'megabytes_per_second': None if number_of_bytes is None else number_of_bytes / 1024 ** 2 / duration,
+            'peak_memory_mb': peak_memory / 1024 ** 2}
+
+
+def _create_data_extractor(image_dir, results_dir, image_file_format, number_of_images, width, height,
+                           number_of_rois):
+    dark_roi_pixel_bounds, light_roi_pixel_bounds = get_face_pixel_bounds(width, height)
+    data_extractor = DataExtractor()
+    data_extractor.set_experiment_name('Benchmark')
+    data_extractor.set_image_dir(image_dir)
+    data_extractor.set_results_dir(results_dir)
+    data_extractor.set_camera_position(0, 0, 0)
+    data_extractor.set_image_series(0, number_of_images)
+    data_extractor.set_image_file_format(image_file_format)
+    data_extractor.set_image_name_string(get_image_name_string(image_file_format))
+    data_extractor.set_reference_image_id(0)
+    data_extractor.set_dark_roi_pixel_bounds(*dark_roi_pixel_bounds)
+    data_extractor.set_light_roi_pixel_bounds(*light_roi_pixel_bounds)
+    data_extractor.set_roi_parameters(max(1, int(width * 0.01)), number_of_rois)
+    data_extractor.set_dark_roi_real_bounds((0, 4, 0), (0, 4, 3.37))
+    data_extractor.set_light_roi_real_bounds((0, 4, 0), (0, 4, 3.37))
+    data_extractor.calc_geometrics()
+    return data_extractor
+
+
+def run_benchmarks(work_dir, number_of_images=10, width=6000, height=4000, number_of_rois=100, repeat=3,
+                   number_of_result_rows=2000):
+    stages = {}
+    jpg_dir = os.path.join(work_dir, 'jpg')
+    raw_dir = os.path.join(work_dir, 'raw')
+    print("Generating synthetic images...")
+    jpg_file_paths = generate_image_series(jpg_dir, 'jpg', number_of_images, width, height)
+    raw_file_paths = generate_image_series(raw_dir, 'raw', number_of_images, width, height)
+    jpg_bytes = sum(os.path.getsize(file_path) for file_path in jpg_file_paths)
+    raw_bytes = sum(os.path.getsize(file_path) for file_path in raw_file_paths)
+
+    print("Benchmarking image reading...")
+    stages['get_channel_arrays_from_jpg_file'] = measure(
+        lambda: [get_channel_arrays_from_jpg_file(file_path) for file_path in jpg_file_paths],
+        number_of_images, jpg_bytes, repeat)
+    stages['get_channel_arrays_from_raw_file'] = measure(
+        lambda: [get_channel_arrays_from_raw_file(file_path) for file_path in raw_file_paths],
+        number_of_images, raw_bytes, repeat)
+    stages['get_capture_date_time'] = measure(
+        lambda: [get_capture_date_time(file_path) for file_path in jpg_file_paths],
+        number_of_images, None, repeat)
+
+    print("Benchmarking ROI reduction...")
+    data_extractor = _create_data_extractor(jpg_dir, os.path.join(work_dir, 'results_jpg'), 'jpg', number_of_images,
+                                            width, height, number_of_rois)
+    image_arrays = [get_channel_arrays_from_jpg_file(file_path) for file_path in jpg_file_paths]
+    image_bytes = sum(image_array.nbytes for image_array in image_arrays)
+    stages['_extract_pixel_values'] = measure(
+        lambda: [data_extractor._extract_pixel_values(image_array[channel], data_extractor.dark_roi_pixel_coordinates,
+                                                      data_extractor.dark_roi_pixel_dy)
+                 for image_array in image_arrays for channel in range(3)],
+        number_of_images, image_bytes, repeat)
+    stages['roi_reduction_plan'] = measure(
+        lambda: [data_extractor.roi_reduction_plan.reduce(image_array) for image_array in image_arrays],
+        number_of_images, image_bytes, repeat)
+    del image_arrays
+
+    print("Benchmarking CSV writing...")
+    csv_dir = os.path.join(work_dir, 'csv')
+    os.makedirs(csv_dir, exist_ok=True)
+    csv_file_paths = {(channel, face): os.path.join(csv_dir, f'values_{channel}_{face}.csv')
+                      for channel in range(3) for face in range(2)}
+    roi_values = np.random.default_rng(0).uniform(0, 255, (3, 2, number_of_rois))
+    capture_time = datetime(2024, 1, 1, 12, 0, 0)
+
+    def write_csv_rows():
+        for file_path in csv_file_paths.values():
+            open(file_path, 'w').close()
+        with CsvResultWriter(csv_file_paths) as csv_result_writer:
+            for image_id in range(number_of_result_rows):
+                csv_result_writer.write_roi_values(image_id, capture_time, capture_time - capture_time, roi_values)
+
+    write_csv_rows()
+    csv_bytes = sum(os.path.getsize(file_path) for file_path in csv_file_paths.values())
+    stages['csv_writing'] = measure(write_csv_rows, number_of_result_rows, csv_bytes, repeat)
+
+    print("Benchmarking extraction and analysis...")
+    for image_file_format, file_paths, file_bytes in [('jpg', jpg_file_paths, jpg_bytes),
+                                                      ('raw', raw_file_paths, raw_bytes)]:
+        image_dir = os.path.dirname(file_paths[0])
+        results_dir = os.path.join(work_dir, f'results_{image_file_format}')
+        data_extractor = _create_data_extractor(image_dir, results_dir, image_file_format, number_of_images, width,
+                                                height, number_of_rois)
+        stages[f'process_image_data_{image_file_format}'] = measure(data_extractor.process_image_data,
+                                                                    number_of_images, file_bytes, 1)
+    data_extractor.write_roi_real_coordinates()
+    data_extractor.write_roi_camera_to_roi_real_distances()
+
+    data_analysis = DataAnalysis()
+    data_analysis.set_experiment_name('Benchmark')
+    data_analysis.set_results_dir(results_dir)
+    data_analysis.load_result_data()
+    result_bytes = sum(result_df.memory_usage().sum() for result_df in data_analysis.results_dict.values())
+    stages['DataAnalysis.load_result_data'] = measure(data_analysis.load_result_data, number_of_images,
+                                                      result_bytes, repeat)
+    stages['DataAnalysis.calc_intensities'] = measure(data_analysis.calc_intensities, number_of_images,
+                                                      result_bytes, repeat)
+    stages['DataAnalysis.calc_extinction_coefficients'] = measure(data_analysis.calc_extinction_coefficients,
+                                                                  number_of_images, result_bytes, repeat)
+    return stages
+
+
+def compare_results(results, baseline_results, threshold):
+    """
+    Print the relative duration of every stage compared with the baseline and return the names of the stages that are
+    slower than threshold times the baseline.
+    """
+    regressions = []
+    print(f"{'Stage':<45} {'Baseline [s]':>13} {'Current [s]':>12} {'Ratio':>7}")
+    for stage, stage_results in results['stages'].items():
+        if stage not in baseline_results['stages']:
+            continue
+        baseline_duration = baseline_results['stages'][stage]['seconds']
+        ratio = stage_results['seconds'] / baseline_duration
+        print(f"{stage:<45} {baseline_duration:>13.4f} {stage_results['seconds']:>12.4f} {ratio:>7.2f}"
+              + ("  REGRESSION" if ratio > threshold else ""))
+        if ratio > threshold:
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=10, help='number of synthetic frames per format')
+    parser.add_argument('--width', type=int, default=6000)
+    parser.add_argument('--height', type=int, default=4000)
+    parser.add_argument('--rois', type=int, default=100, help='number of ROIs per face')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs per stage, the best is reported')
+    parser.add_argument('--work-dir', default=None, help='directory for the synthetic data (default: temporary)')
+    parser.add_argument('--output', default=None, help='JSON file the results are written to')
+    parser.add_argument('--compare', default=None, help='JSON results of a baseline version to compare with')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown factor reported as regression')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        stages = run_benchmarks(args.work_dir or temporary_dir, args.images, args.width, args.height, args.rois,
+                                args.repeat)
+    results = {'created': datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'platform': platform.platform(),
+               'parameters': {'images': args.images, 'width': args.width, 'height': args.height,
+                              'rois': args.rois, 'repeat': args.repeat},
+               'stages': stages}
+
+    print(f"{'Stage':<45} {'Frames/s':>10} {'MB/s':>9} {'Peak memory [MB]':>17}")
+    for stage, stage_results in stages.items():
+        megabytes_per_second = stage_results['megabytes_per_second']
+        print(f"{stage:<45} {stage_results['frames_per_second']:>10.2f} "
+              f"{'-' if megabytes_per_second is None else f'{megabytes_per_second:.1f}':>9} "
+              f"{stage_results['peak_memory_mb']:>17.1f}")
+
+    if args.output is not None:
+        with open(args.output, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline_results = json.load(baseline_file)
+        if baseline_results['parameters'] != results['parameters']:
+            print("Warning: the baseline was run with different parameters")
+        if compare_results(results, baseline_results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
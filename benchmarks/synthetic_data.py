@@ -0,0 +1,169 @@
+"""
+Generate synthetic image series for benchmarks.
+
+JPG frames are written with Pillow and RAW frames as minimal uncompressed DNG files with an RGGB Bayer pattern that
+rawpy can read. Both carry EXIF DateTimeOriginal and SubSecTimeOriginal entries. Every frame shows a vertical
+checkerboard column with a dark and a light face whose contrast slowly decreases over the series, so the extraction and
+analysis produce meaningful values.
+
+Usage:
+    python benchmarks/synthetic_data.py OUTPUT_DIR [--format jpg|raw] [--images 20] [--width 6000] [--height 4000]
+"""
+import argparse
+import os
+import struct
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Pixel columns of the dark and light checkerboard faces, relative to the image width
+DARK_FACE_POSITION = 0.40
+LIGHT_FACE_POSITION = 0.42
+FACE_WIDTH = 0.015
+
+
+def get_image_name_string(image_file_format):
+    return 'SYN{:05d}.JPG' if image_file_format == 'jpg' else 'SYN{:05d}.dng'
+
+
+def get_face_pixel_bounds(width, height):
+    """
+    Return the lower and upper pixel bounds of the dark and light faces, as passed to DataExtractor.
+    """
+    dark_x = int(width * (DARK_FACE_POSITION + FACE_WIDTH / 2))
+    light_x = int(width * (LIGHT_FACE_POSITION + FACE_WIDTH / 2))
+    return ((dark_x, int(height * 0.9)), (dark_x, int(height * 0.1))), \
+        ((light_x, int(height * 0.9)), (light_x, int(height * 0.1)))
+
+
+def _render_frame(width, height, contrast, rng):
+    frame = rng.normal(110, 6, (height, width))
+    face_width = int(width * FACE_WIDTH)
+    dark_x = int(width * DARK_FACE_POSITION)
+    light_x = int(width * LIGHT_FACE_POSITION)
+    frame[:, dark_x:dark_x + face_width] -= 80 * contrast
+    frame[:, light_x:light_x + face_width] += 120 * contrast
+    return np.clip(frame, 0, 255)
+
+
+def _format_exif_date_time(capture_time):
+    return capture_time.strftime('%Y:%m:%d %H:%M:%S'), f"{capture_time.microsecond // 1000:03d}"
+
+
+def write_synthetic_jpg(file_path, frame, capture_time, quality=90):
+    from PIL import Image
+    date_time, subsec = _format_exif_date_time(capture_time)
+    rgb_frame = np.repeat(frame.astype(np.uint8)[:, :, np.newaxis], 3, axis=2)
+    rgb_frame[:, :, 2] = np.clip(frame * 1.1, 0, 255).astype(np.uint8)
+    image = Image.fromarray(rgb_frame)
+    exif = Image.Exif()
+    exif[0x0132] = date_time
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x9003] = date_time
+    exif_ifd[0x9291] = subsec
+    image.save(file_path, quality=quality, exif=exif)
+
+
+def write_synthetic_dng(file_path, data, capture_time, black_level=512, white_level=16383):
+    """
+    Write a minimal uncompressed single-strip DNG file with an RGGB colour filter array.
+    """
+    height, width = data.shape
+    date_time, subsec = _format_exif_date_time(capture_time)
+
+    def entry(tag, field_type, values):
+        if field_type == 2:
+            value_bytes = values.encode() + b'\0'
+            count = len(value_bytes)
+        elif field_type in (5, 10):
+            value_format = '<II' if field_type == 5 else '<ii'
+            value_bytes = b''.join(struct.pack(value_format, *value) for value in values)
+            count = len(values)
+        else:
+            value_format = {1: 'B', 3: 'H', 4: 'I'}[field_type]
+            value_bytes = struct.pack(f'<{len(values)}{value_format}', *values)
+            count = len(values)
+        return [tag, field_type, count, value_bytes]
+
+    def build_ifd(entries, offset):
+        ifd = bytearray(struct.pack('<H', len(entries)))
+        data_offset = offset + 2 + len(entries) * 12 + 4
+        blob = bytearray()
+        for tag, field_type, count, value_bytes in sorted(entries):
+            if len(value_bytes) <= 4:
+                ifd += struct.pack('<HHI', tag, field_type, count) + value_bytes.ljust(4, b'\0')
+            else:
+                ifd += struct.pack('<HHII', tag, field_type, count, data_offset + len(blob))
+                blob += value_bytes
+                if len(blob) % 2:
+                    blob += b'\0'
+        ifd += struct.pack('<I', 0)
+        return bytes(ifd + blob)
+
+    pixel_bytes = data.astype('<u2').tobytes()
+    pixel_offset = 8
+    ifd0_offset = pixel_offset + len(pixel_bytes)
+    exif_entries = [entry(36867, 2, date_time), entry(37521, 2, subsec)]
+    ifd0_entries = [
+        entry(254, 4, [0]), entry(256, 4, [width]), entry(257, 4, [height]), entry(258, 3, [16]),
+        entry(259, 3, [1]), entry(262, 3, [32803]), entry(271, 2, 'Synthetic'), entry(272, 2, 'Camera'),
+        entry(273, 4, [pixel_offset]), entry(274, 3, [1]), entry(277, 3, [1]), entry(278, 4, [height]),
+        entry(279, 4, [len(pixel_bytes)]), entry(284, 3, [1]), entry(306, 2, date_time), entry(33421, 3, [2, 2]),
+        entry(33422, 1, [0, 1, 1, 2]), entry(50706, 1, [1, 4, 0, 0]), entry(50707, 1, [1, 1, 0, 0]),
+        entry(50708, 2, 'Synthetic Camera'), entry(50714, 4, [black_level]), entry(50717, 4, [white_level]),
+        entry(50721, 10, [(1, 1), (0, 1), (0, 1), (0, 1), (1, 1), (0, 1), (0, 1), (0, 1), (1, 1)]),
+        entry(50728, 5, [(1, 1), (1, 1), (1, 1)]), entry(50778, 3, [21]), entry(34665, 4, [0]),
+    ]
+    # The offset of the EXIF IFD depends on the size of IFD0, which does not change when the offset is set
+    exif_offset = ifd0_offset + len(build_ifd(ifd0_entries, ifd0_offset))
+    ifd0_entries[-1] = entry(34665, 4, [exif_offset])
+    with open(file_path, 'wb') as dng_file:
+        dng_file.write(b'II*\0' + struct.pack('<I', ifd0_offset))
+        dng_file.write(pixel_bytes)
+        dng_file.write(build_ifd(ifd0_entries, ifd0_offset))
+        dng_file.write(build_ifd(exif_entries, exif_offset))
+
+
+def generate_image_series(output_dir, image_file_format='jpg', number_of_images=20, width=6000, height=4000,
+                          first_image_id=0, start_time=datetime(2024, 1, 1, 12, 0, 0), interval=1.25, seed=0):
+    """
+    Write a synthetic image series and return the paths of the written files.
+
+    Parameters:
+        output_dir (str): The directory the images are written to.
+        image_file_format (str): 'jpg' or 'raw' (DNG).
+        number_of_images (int): The number of frames.
+        width (int): The width of the frames in pixels.
+        height (int): The height of the frames in pixels.
+        first_image_id (int): The image ID of the first frame, see get_image_name_string for the file names.
+        start_time (datetime): The capture time of the first frame.
+        interval (float): The time between two frames in seconds.
+        seed (int): The seed of the pixel noise.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    rng = np.random.default_rng(seed)
+    image_name_string = get_image_name_string(image_file_format)
+    file_paths = []
+    for i in range(number_of_images):
+        file_path = os.path.join(output_dir, image_name_string.format(first_image_id + i))
+        capture_time = start_time + timedelta(seconds=i * interval)
+        contrast = 1 - 0.5 * i / max(number_of_images - 1, 1)
+        frame = _render_frame(width, height, contrast, rng)
+        if image_file_format == 'jpg':
+            write_synthetic_jpg(file_path, frame, capture_time)
+        else:
+            write_synthetic_dng(file_path, (512 + frame * 60).astype(np.uint16), capture_time)
+        file_paths.append(file_path)
+    return file_paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output_dir')
+    parser.add_argument('--format', choices=['jpg', 'raw'], default='jpg')
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--width', type=int, default=6000)
+    parser.add_argument('--height', type=int, default=4000)
+    args = parser.parse_args()
+    generate_image_series(args.output_dir, args.format, args.images, args.width, args.height)
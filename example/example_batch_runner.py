@@ -0,0 +1,15 @@
+# Import the BatchRunner class from the RadianceMethod.processing.batch_runner module
+from RadianceMethod.processing.batch_runner import BatchRunner
+
+# The batch runner starts worker processes, which import this script again on Windows and macOS, so the batch is only
+# run from the main process
+if __name__ == '__main__':
+    # Create an instance of the BatchRunner class and load the experiments of the configuration file. Both experiments
+    # use the same image series, so every image is decoded once and reduced for both ROI setups.
+    # The same can be run from the command line:
+    # python -m RadianceMethod.processing.batch_runner example_batch_config.json
+    batch_runner = BatchRunner()
+    batch_runner.load_config('example_batch_config.json')
+
+    # Extract and analyse all experiments and print the throughput summary
+    batch_runner.run()
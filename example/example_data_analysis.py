@@ -34,5 +34,7 @@ data_analysis.calc_intensities()
 # Calculate extinction coefficients from intensities and distances, and save them to CSV files
 data_analysis.calc_extinction_coefficients()
 
-#Call plot loop for all 3 channels
-plot_ec_all(results_dir=results_dir, exp_name=exp_name, x_min=x_min, x_max=x_max, y_min=y_min, y_max=y_max)
\ No newline at end of file
+#Call plot loop for all 3 channels, using the calculated extinction coefficients instead of reading the CSV files again
+#For long experiments use mode='collection' (decimated lines) or mode='heatmap' (ROI height over time)
+plot_ec_all(results_dir=results_dir, exp_name=exp_name, x_min=x_min, x_max=x_max, y_min=y_min, y_max=y_max,
+            data_analysis=data_analysis)
\ No newline at end of file
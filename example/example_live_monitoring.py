@@ -0,0 +1,47 @@
+# Import the DataExtractor and DataAnalysis classes
+from RadianceMethod.processing.DataExtractor import DataExtractor
+from RadianceMethod.analysis.DataAnalysis import DataAnalysis
+
+# Create an instance of the DataExtractor class and set its parameters as in example_data_extractor.py
+data_extractor = DataExtractor()
+data_extractor.set_experiment_name("Testexperiment_live")
+data_extractor.set_image_dir('example_images')
+data_extractor.set_results_dir('example_results')
+data_extractor.set_camera_position(0, 0, 0)
+
+# Set the first image ID of the series, the last image ID is open ended during a live experiment
+data_extractor.set_image_series(9682, None)
+data_extractor.set_image_file_format('jpg')
+data_extractor.set_image_name_string('DSC{:05d}.JPG')
+data_extractor.set_reference_image_id(9682)
+data_extractor.set_dark_roi_pixel_bounds((2440, 1984), (2440, 557))
+data_extractor.set_light_roi_pixel_bounds((2483, 1984), (2483, 557))
+data_extractor.set_roi_parameters(10, 100)
+data_extractor.set_dark_roi_real_bounds((0, 4, 0), (0, 4, 3.37))
+data_extractor.set_light_roi_real_bounds((0, 4, 0), (0, 4, 3.37))
+data_extractor.calc_geometrics()
+
+# Write the ROI coordinates and distances before watching, they are needed by the live analysis
+data_extractor.write_roi_real_coordinates()
+data_extractor.write_roi_camera_to_roi_real_distances()
+
+# Create an instance of the DataAnalysis class and load the ROI geometry
+data_analysis = DataAnalysis()
+data_analysis.set_results_dir('example_results')
+data_analysis.set_experiment_name("Testexperiment_live")
+data_analysis.set_baseline_image_bounds([0, 1])
+data_analysis.load_roi_geometry()
+
+# When the live monitoring is restarted, continue the analysis with the baseline of the images already processed
+data_analysis.resume_incremental_analysis()
+
+
+# Print the mean extinction coefficient of every new image as soon as it is available
+def show_visibility(image_id, capture_time, time_delta, roi_values):
+    for result_image_id, intensities, extinction_coefficients in data_analysis.add_roi_values(image_id, roi_values):
+        print(f"Image {result_image_id}: mean extinction coefficient per channel "
+              f"{extinction_coefficients.mean(axis=1).round(3)} 1/m")
+
+
+# Watch the image directory until no new image arrived for 60 seconds (or until Ctrl-C)
+data_extractor.watch_image_dir(show_visibility, idle_timeout=60)
@@ -0,0 +1,98 @@
+import os
+import shutil
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from RadianceMethod.analysis.DataAnalysis import DataAnalysis
+from RadianceMethod.processing.DataExtractor import DataExtractor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE_IMAGE_DIR = os.path.join(REPO_DIR, 'example', 'example_images')
+NUMBER_OF_IMAGES = 300
+RESULT_FILE_NAMES = ([f'intensities_channel_{channel}.csv' for channel in range(3)] +
+                     [f'extinction_coefficients_channel_{channel}.csv' for channel in range(3)])
+
+
+@pytest.fixture(scope='module')
+def results_dir(tmp_path_factory):
+    # The ROI geometry and file headers of the example images with a longer series of synthetic ROI values
+    results_dir = tmp_path_factory.mktemp('results')
+    data_extractor = DataExtractor()
+    data_extractor.set_experiment_name('Testexperiment')
+    data_extractor.set_image_dir(EXAMPLE_IMAGE_DIR)
+    data_extractor.set_results_dir(str(results_dir))
+    data_extractor.set_camera_position(0, 0, 0)
+    data_extractor.set_image_series(9682, 9683)
+    data_extractor.set_image_name_string('DSC{:05d}.JPG')
+    data_extractor.set_reference_image_id(9682)
+    data_extractor.set_dark_roi_pixel_bounds((2440, 1984), (2440, 557))
+    data_extractor.set_light_roi_pixel_bounds((2483, 1984), (2483, 557))
+    data_extractor.set_roi_parameters(10, 100)
+    data_extractor.set_dark_roi_real_bounds((0, 4, 0), (0, 4, 3.37))
+    data_extractor.set_light_roi_real_bounds((0, 4, 0), (0, 4, 3.37))
+    data_extractor.calc_geometrics()
+    data_extractor.process_image_data()
+    data_extractor.write_roi_real_coordinates()
+    data_extractor.write_roi_camera_to_roi_real_distances()
+
+    rng = np.random.default_rng(0)
+    start_time = datetime(2022, 4, 27, 10, 42)
+    for channel in range(3):
+        for cb_face, mean_value in [('dark', 150), ('light', 60)]:
+            file_path = results_dir / f'Testexperiment_{cb_face}_values_channel_{channel}.csv'
+            with open(file_path, newline='') as csvfile:
+                header_lines = csvfile.readlines()[:4]
+            roi_values = rng.integers(mean_value * 140 - 2000, mean_value * 140 + 2000, (NUMBER_OF_IMAGES, 100)) / 140
+            roi_values[rng.random(roi_values.shape) < 0.01] = np.nan
+            with open(file_path, 'w', newline='') as csvfile:
+                csvfile.writelines(header_lines)
+                for image, image_roi_values in enumerate(roi_values):
+                    time_delta = timedelta(seconds=image)
+                    row = [str(image), str(start_time + time_delta), str(time_delta)]
+                    row += ['' if np.isnan(value) else repr(float(value)) for value in image_roi_values]
+                    csvfile.write(','.join(row) + '\r\n')
+    return results_dir
+
+
+def run_analysis(source_dir, results_dir, analysis_engine='pandas', chunk_size=None):
+    shutil.copytree(source_dir, results_dir)
+    data_analysis = DataAnalysis()
+    data_analysis.set_results_dir(str(results_dir))
+    data_analysis.set_experiment_name('Testexperiment')
+    data_analysis.set_baseline_image_bounds([0, 20])
+    data_analysis.set_analysis_engine(analysis_engine)
+    if chunk_size is None:
+        data_analysis.load_result_data()
+        data_analysis.calc_intensities()
+        data_analysis.calc_extinction_coefficients()
+    else:
+        data_analysis.set_chunk_size(chunk_size)
+        data_analysis.calc_results_in_chunks()
+    return data_analysis
+
+
+def assert_same_result_files(results_dir, other_results_dir):
+    for file_name in RESULT_FILE_NAMES:
+        assert (results_dir / file_name).read_bytes() == (other_results_dir / file_name).read_bytes(), file_name
+
+
+def test_numpy_engine_matches_pandas_engine(results_dir, tmp_path):
+    pandas_analysis = run_analysis(results_dir, tmp_path / 'pandas')
+    numpy_analysis = run_analysis(results_dir, tmp_path / 'numpy', 'numpy')
+
+    assert_same_result_files(tmp_path / 'pandas', tmp_path / 'numpy')
+    for i, channel in enumerate(numpy_analysis.channels_to_analyse):
+        np.testing.assert_array_equal(numpy_analysis.intensities[i],
+                                      pandas_analysis.intensities_dict[f'channel_{channel}'].to_numpy())
+        np.testing.assert_array_equal(numpy_analysis.extinction_coefficients[i],
+                                      pandas_analysis.extinction_coefficients_dict[f'channel_{channel}'].to_numpy())
+
+
+def test_chunked_analysis_matches_in_memory_analysis(results_dir, tmp_path):
+    run_analysis(results_dir, tmp_path / 'in_memory')
+    # A chunk size that splits the baseline images and leaves a shorter last chunk
+    run_analysis(results_dir, tmp_path / 'chunked', chunk_size=16)
+
+    assert_same_result_files(tmp_path / 'in_memory', tmp_path / 'chunked')
@@ -0,0 +1,49 @@
+import os
+import shutil
+
+from RadianceMethod.processing.DataExtractor import DataExtractor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE_IMAGE_DIR = os.path.join(REPO_DIR, 'example', 'example_images')
+CSV_FILE_NAMES = [f'{cb_face}_values_channel_{channel}.csv' for channel in range(3) for cb_face in ['dark', 'light']]
+
+
+def process_image_data(results_dir, resume=False):
+    data_extractor = DataExtractor()
+    data_extractor.set_experiment_name('Testexperiment')
+    data_extractor.set_image_dir(EXAMPLE_IMAGE_DIR)
+    data_extractor.set_results_dir(str(results_dir))
+    data_extractor.set_camera_position(0, 0, 0)
+    data_extractor.set_image_series(9682, 9687)
+    data_extractor.set_image_name_string('DSC{:05d}.JPG')
+    data_extractor.set_reference_image_id(9682)
+    data_extractor.set_dark_roi_pixel_bounds((2440, 1984), (2440, 557))
+    data_extractor.set_light_roi_pixel_bounds((2483, 1984), (2483, 557))
+    data_extractor.set_roi_parameters(10, 100)
+    data_extractor.set_dark_roi_real_bounds((0, 4, 0), (0, 4, 3.37))
+    data_extractor.set_light_roi_real_bounds((0, 4, 0), (0, 4, 3.37))
+    data_extractor.set_resume(resume)
+    data_extractor.calc_geometrics()
+    data_extractor.process_image_data()
+    return data_extractor
+
+
+def test_resume_after_gap_keeps_image_series_order(tmp_path):
+    complete_results_dir = tmp_path / 'complete'
+    complete_results_dir.mkdir()
+    process_image_data(complete_results_dir)
+
+    # An interrupted run with the images 9682, 9683 and 9685 written, e.g. by workers finishing out of order
+    resumed_results_dir = tmp_path / 'resumed'
+    shutil.copytree(complete_results_dir, resumed_results_dir)
+    for file_name in CSV_FILE_NAMES:
+        file_path = resumed_results_dir / f'Testexperiment_{file_name}'
+        lines = file_path.read_bytes().splitlines(keepends=True)
+        file_path.write_bytes(b''.join(lines[:4] + [lines[4], lines[5], lines[7]]))
+
+    data_extractor = process_image_data(resumed_results_dir, resume=True)
+
+    assert data_extractor.progress['resumed_images'] == 2
+    for file_name in CSV_FILE_NAMES:
+        assert ((resumed_results_dir / f'Testexperiment_{file_name}').read_bytes() ==
+                (complete_results_dir / f'Testexperiment_{file_name}').read_bytes()), file_name
@@ -0,0 +1,52 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from RadianceMethod.processing.DataExtractor import DataExtractor
+
+
+def create_data_extractor():
+    data_extractor = DataExtractor()
+    data_extractor.set_camera_position(0, 0, 0)
+    data_extractor.set_dark_roi_pixel_bounds((2440, 1984), (2440, 557))
+    data_extractor.set_light_roi_pixel_bounds((2483, 1984), (2483, 557))
+    data_extractor.set_roi_parameters(10, 100)
+    data_extractor.set_dark_roi_real_bounds((0, 4, 0), (0, 4, 3.37))
+    data_extractor.set_light_roi_real_bounds((0, 4, 0), (0, 4, 3.37))
+    data_extractor.calc_geometrics()
+    return data_extractor
+
+
+def extract_pixel_values_per_roi(image_array, roi_pixel_coordinates, roi_pixel_dy, roi_pixel_width):
+    # The slicing and mean of every single ROI, as DataExtractor._extract_pixel_values did before the reduction plan
+    roi_pixel_values = []
+    for coord in roi_pixel_coordinates:
+        y_bottom = coord[1]
+        y_top = y_bottom + roi_pixel_dy
+        x_left = coord[0] - int(roi_pixel_width / 2)
+        x_right = x_left + roi_pixel_width
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            roi_pixel_values.append(image_array[y_top:y_bottom, x_left:x_right].mean())
+    return roi_pixel_values
+
+
+# The full frame, a frame cutting off some of the ROIs, and the float fallback of the reduction plan
+@pytest.mark.parametrize('height, dtype', [(2000, np.uint8), (1900, np.uint8), (2000, np.float32)])
+def test_roi_reduction_matches_per_roi_means(height, dtype):
+    data_extractor = create_data_extractor()
+    rng = np.random.default_rng(0)
+    image_array = rng.integers(0, 256, (3, height, 2600)).astype(dtype)
+
+    roi_values = data_extractor.roi_reduction_plan.reduce(image_array)
+    for channel in range(3):
+        for face, (roi_pixel_coordinates, roi_pixel_dy) in enumerate([
+                (data_extractor.dark_roi_pixel_coordinates, data_extractor.dark_roi_pixel_dy),
+                (data_extractor.light_roi_pixel_coordinates, data_extractor.light_roi_pixel_dy)]):
+            expected = extract_pixel_values_per_roi(image_array[channel], roi_pixel_coordinates, roi_pixel_dy,
+                                                    data_extractor.roi_pixel_width)
+            extracted = data_extractor._extract_pixel_values(image_array[channel], roi_pixel_coordinates,
+                                                             roi_pixel_dy)
+            assert np.array_equal(extracted, expected, equal_nan=True)
+            assert np.array_equal(roi_values[channel, face], expected, equal_nan=True)
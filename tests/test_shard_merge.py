@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from RadianceMethod.processing.result_writers import load_npy_result_data
+from RadianceMethod.processing.shard_merge import get_shard_result_name, merge_shard_results
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE_IMAGE_DIR = os.path.join(REPO_DIR, 'example', 'example_images')
+EXPERIMENT_NAME = 'Testexperiment'
+NUMBER_OF_SHARDS = 3
+CSV_FILE_NAMES = [f'{cb_face}_values_channel_{channel}.csv' for channel in range(3) for cb_face in ['dark', 'light']]
+
+
+def run_batch(tmp_path, results_dir, shard=None):
+    config = {
+        'experiments': [{
+            'experiment_name': EXPERIMENT_NAME,
+            'image_dir': str(tmp_path / 'images'),
+            'results_dir': str(results_dir),
+            'image_file_format': 'jpg',
+            'image_name_string': 'DSC{:05d}.JPG',
+            'image_series': [9682, 9687],
+            'reference_image_id': 9682,
+            'camera_position': [0, 0, 0],
+            'dark_roi_pixel_bounds': [[2440, 1984], [2440, 557]],
+            'light_roi_pixel_bounds': [[2483, 1984], [2483, 557]],
+            'dark_roi_real_bounds': [[0, 4, 0], [0, 4, 3.37]],
+            'light_roi_real_bounds': [[0, 4, 0], [0, 4, 3.37]],
+            'roi_parameters': [10, 100],
+            'result_file_formats': ['csv', 'npy'],
+        }]
+    }
+    config_file_path = tmp_path / 'batch_config.json'
+    config_file_path.write_text(json.dumps(config))
+    command = [sys.executable, '-m', 'RadianceMethod.processing.batch_runner', str(config_file_path)]
+    if shard is not None:
+        command += ['--shard', str(shard[0]), str(shard[1])]
+    subprocess.run(command, cwd=REPO_DIR, check=True, capture_output=True,
+                   env=dict(os.environ, MPLBACKEND='Agg'))
+
+
+@pytest.fixture(scope='module')
+def batch_results(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp('shards')
+    shutil.copytree(EXAMPLE_IMAGE_DIR, tmp_path / 'images')
+    run_batch(tmp_path, tmp_path / 'unsharded')
+    for shard_index in range(NUMBER_OF_SHARDS):
+        run_batch(tmp_path, tmp_path / 'sharded', (shard_index, NUMBER_OF_SHARDS))
+    return tmp_path
+
+
+@pytest.fixture
+def shard_dir(batch_results, tmp_path):
+    # Every test merges a fresh copy of the shard results
+    shutil.copytree(batch_results / 'sharded', tmp_path / 'sharded')
+    return tmp_path / 'sharded'
+
+
+def test_merged_results_equal_unsharded_run(batch_results, shard_dir):
+    merge_shard_results(str(shard_dir), EXPERIMENT_NAME, NUMBER_OF_SHARDS, ('csv', 'npy'))
+
+    for file_name in CSV_FILE_NAMES:
+        merged = (shard_dir / f'{EXPERIMENT_NAME}_{file_name}').read_bytes()
+        unsharded = (batch_results / 'unsharded' / f'{EXPERIMENT_NAME}_{file_name}').read_bytes()
+        assert merged == unsharded, file_name
+
+    merged_values, merged_metadata = load_npy_result_data(
+        str(shard_dir / f'{EXPERIMENT_NAME}_roi_values.npy'), str(shard_dir / f'{EXPERIMENT_NAME}_roi_metadata.npz'))
+    unsharded_values, unsharded_metadata = load_npy_result_data(
+        str(batch_results / 'unsharded' / f'{EXPERIMENT_NAME}_roi_values.npy'),
+        str(batch_results / 'unsharded' / f'{EXPERIMENT_NAME}_roi_metadata.npz'))
+    np.testing.assert_array_equal(merged_values, unsharded_values)
+    assert sorted(merged_metadata) == sorted(unsharded_metadata)
+    for key in unsharded_metadata:
+        np.testing.assert_array_equal(merged_metadata[key], unsharded_metadata[key])
+
+
+def test_missing_shard_raises(shard_dir):
+    shard_result_name = get_shard_result_name(EXPERIMENT_NAME, 1, NUMBER_OF_SHARDS)
+    os.remove(shard_dir / f'{shard_result_name}_checkpoint.json')
+
+    with pytest.raises(ValueError, match='has not been processed'):
+        merge_shard_results(str(shard_dir), EXPERIMENT_NAME, NUMBER_OF_SHARDS)
+    assert not (shard_dir / f'{EXPERIMENT_NAME}_{CSV_FILE_NAMES[0]}').exists()
+
+
+def test_duplicated_image_raises(shard_dir):
+    # Append the first image row of shard 0 to shard 1, the rows end with '\r\n'
+    first_shard_result_name = get_shard_result_name(EXPERIMENT_NAME, 0, NUMBER_OF_SHARDS)
+    second_shard_result_name = get_shard_result_name(EXPERIMENT_NAME, 1, NUMBER_OF_SHARDS)
+    for file_name in CSV_FILE_NAMES:
+        first_shard_file_path = shard_dir / f'{first_shard_result_name}_{file_name}'
+        second_shard_file_path = shard_dir / f'{second_shard_result_name}_{file_name}'
+        first_image_row = first_shard_file_path.read_bytes().splitlines(keepends=True)[4]
+        second_shard_file_path.write_bytes(second_shard_file_path.read_bytes() + first_image_row)
+
+    with pytest.raises(ValueError, match='more than once'):
+        merge_shard_results(str(shard_dir), EXPERIMENT_NAME, NUMBER_OF_SHARDS)
+    assert not (shard_dir / f'{EXPERIMENT_NAME}_{CSV_FILE_NAMES[0]}').exists()
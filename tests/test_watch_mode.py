@@ -0,0 +1,111 @@
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from RadianceMethod.analysis.DataAnalysis import DataAnalysis
+from RadianceMethod.processing.DataExtractor import DataExtractor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE_IMAGE_DIR = os.path.join(REPO_DIR, 'example', 'example_images')
+IMAGE_IDS = range(9682, 9687)
+CSV_FILE_NAMES = [f'{cb_face}_values_channel_{channel}.csv' for channel in range(3) for cb_face in ['dark', 'light']]
+
+
+def create_data_extractor(image_dir, results_dir, last_image_id):
+    data_extractor = DataExtractor()
+    data_extractor.set_experiment_name('Testexperiment')
+    data_extractor.set_image_dir(str(image_dir))
+    data_extractor.set_results_dir(str(results_dir))
+    data_extractor.set_camera_position(0, 0, 0)
+    data_extractor.set_image_series(IMAGE_IDS[0], last_image_id)
+    data_extractor.set_image_file_format('jpg')
+    data_extractor.set_image_name_string('DSC{:05d}.JPG')
+    data_extractor.set_reference_image_id(IMAGE_IDS[0])
+    data_extractor.set_dark_roi_pixel_bounds((2440, 1984), (2440, 557))
+    data_extractor.set_light_roi_pixel_bounds((2483, 1984), (2483, 557))
+    data_extractor.set_roi_parameters(10, 100)
+    data_extractor.set_dark_roi_real_bounds((0, 4, 0), (0, 4, 3.37))
+    data_extractor.set_light_roi_real_bounds((0, 4, 0), (0, 4, 3.37))
+    data_extractor.calc_geometrics()
+    return data_extractor
+
+
+def copy_images(image_dir):
+    for image_id in IMAGE_IDS:
+        time.sleep(0.2)
+        file_name = f'DSC{image_id:05d}.JPG'
+        shutil.copyfile(os.path.join(EXAMPLE_IMAGE_DIR, file_name), os.path.join(image_dir, file_name))
+
+
+def test_watched_images_equal_batch_run(tmp_path):
+    batch_results_dir = tmp_path / 'batch'
+    batch_results_dir.mkdir()
+    create_data_extractor(EXAMPLE_IMAGE_DIR, batch_results_dir, IMAGE_IDS[-1] + 1).process_image_data()
+
+    image_dir = tmp_path / 'images'
+    watch_results_dir = tmp_path / 'watch'
+    image_dir.mkdir()
+    watch_results_dir.mkdir()
+    watched_image_ids = []
+    copy_thread = threading.Thread(target=copy_images, args=(image_dir,))
+    copy_thread.start()
+    try:
+        create_data_extractor(image_dir, watch_results_dir, None).watch_image_dir(
+            lambda image_id, capture_time, time_delta, roi_values: watched_image_ids.append(image_id),
+            poll_interval=0.05, idle_timeout=30, max_images=len(IMAGE_IDS))
+    finally:
+        copy_thread.join()
+
+    assert watched_image_ids == list(IMAGE_IDS)
+    for file_name in CSV_FILE_NAMES:
+        with open(watch_results_dir / f'Testexperiment_{file_name}') as watch_file, \
+                open(batch_results_dir / f'Testexperiment_{file_name}') as batch_file:
+            assert watch_file.read() == batch_file.read(), file_name
+
+
+def watch_with_analysis(image_dir, results_dir, max_images, results):
+    data_extractor = create_data_extractor(image_dir, results_dir, None)
+    data_extractor.write_roi_real_coordinates()
+    data_extractor.write_roi_camera_to_roi_real_distances()
+    data_analysis = DataAnalysis()
+    data_analysis.set_results_dir(str(results_dir))
+    data_analysis.set_experiment_name('Testexperiment')
+    data_analysis.set_baseline_image_bounds([0, 2])
+    data_analysis.load_roi_geometry()
+    data_analysis.resume_incremental_analysis()
+
+    def add_roi_values(image_id, capture_time, time_delta, roi_values):
+        for result_image_id, _, extinction_coefficients in data_analysis.add_roi_values(image_id, roi_values):
+            assert result_image_id not in results
+            results[result_image_id] = extinction_coefficients
+
+    data_extractor.watch_image_dir(add_roi_values, poll_interval=0.05, idle_timeout=30, max_images=max_images)
+
+
+@pytest.mark.parametrize('first_run_images', [1, 3])
+def test_restarted_watch_reports_the_same_results(tmp_path, first_run_images):
+    # A restart before and after the baseline images are complete
+    image_dir = tmp_path / 'images'
+    shutil.copytree(EXAMPLE_IMAGE_DIR, image_dir)
+    uninterrupted_results_dir = tmp_path / 'uninterrupted'
+    restarted_results_dir = tmp_path / 'restarted'
+    uninterrupted_results_dir.mkdir()
+    restarted_results_dir.mkdir()
+
+    uninterrupted_results = {}
+    watch_with_analysis(image_dir, uninterrupted_results_dir, len(IMAGE_IDS), uninterrupted_results)
+    restarted_results = {}
+    watch_with_analysis(image_dir, restarted_results_dir, first_run_images, restarted_results)
+    watch_with_analysis(image_dir, restarted_results_dir, len(IMAGE_IDS) - first_run_images, restarted_results)
+
+    assert sorted(restarted_results) == sorted(uninterrupted_results) == list(IMAGE_IDS)
+    for image_id in IMAGE_IDS:
+        np.testing.assert_array_equal(restarted_results[image_id], uninterrupted_results[image_id])
+    for file_name in CSV_FILE_NAMES:
+        with open(restarted_results_dir / f'Testexperiment_{file_name}') as restarted_file, \
+                open(uninterrupted_results_dir / f'Testexperiment_{file_name}') as uninterrupted_file:
+            assert restarted_file.read() == uninterrupted_file.read(), file_name